@@ -0,0 +1,91 @@
+"""
+JWT authentication from the claims of the access token.
+
+Tokens issued by `tokens.tokens_for` carry the username, the roles and the
+token version of the user, so requests are authenticated without loading the
+user's row. The current version of every user comes from an in-process TTL
+cache; tokens with another version are rejected, as are the tokens of deleted
+or deactivated users. Revocations take effect right away in this process and
+in others once their cached entry expired. Tokens without a version claim,
+issued before, are authenticated from the database as before.
+"""
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import ClaimsUser
+
+VERSION_CLAIM = 'token_version'
+USER_CLAIMS = ('username', 'is_staff', 'is_superuser')
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 30
+
+_lock = threading.Lock()
+_cache = None
+_missing = object()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(maxsize=getattr(settings, 'SMART_HOME_AUTH_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                          ttl=getattr(settings, 'SMART_HOME_AUTH_CACHE_TTL', DEFAULT_CACHE_TTL))
+    return _cache
+
+
+def current_version(user_id):
+    """
+    The token version of an active user, or None if the user was deleted or deactivated.
+    """
+    with _lock:
+        cached = get_cache().get(user_id, _missing)
+    if cached is not _missing:
+        return cached
+
+    row = User.objects.filter(pk=user_id).values_list('is_active', 'token_version__version').first()
+    version = (row[1] or 0) if row is not None and row[0] else None
+    with _lock:
+        get_cache()[user_id] = version
+    return version
+
+
+def invalidate_users(user_ids):
+    with _lock:
+        cache = get_cache()
+        for user_id in user_ids:
+            cache.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        get_cache().clear()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates access tokens carrying user claims as a `ClaimsUser`, checking
+    only their token version.
+    """
+
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        version = current_version(user_id)
+        if version is None:
+            raise AuthenticationFailed("User not found", code='user_not_found')
+        if validated_token[VERSION_CLAIM] != version:
+            raise AuthenticationFailed("Token has been revoked", code='token_revoked')
+
+        claims = {'id': user_id, 'is_active': True, **{claim: validated_token[claim] for claim in USER_CLAIMS}}
+        # from_db expects the values in the order of the model's fields.
+        fields = [field.attname for field in ClaimsUser._meta.concrete_fields if field.attname in claims]
+        return ClaimsUser.from_db(DEFAULT_DB_ALIAS, fields, [claims[field] for field in fields])
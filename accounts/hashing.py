@@ -0,0 +1,90 @@
+"""
+Password hashing off the request workers.
+
+PBKDF2 deliberately takes a sizeable fraction of a CPU second per hash, so a
+burst of logins hashing on the request workers starves every other endpoint.
+The async registration view hands hashing to a dedicated pool of
+SMART_HOME_AUTH_HASHING_WORKERS threads instead (hashlib releases the GIL while
+hashing); the pool threads never touch the database. Logins go through
+`django.contrib.auth.authenticate`, whose backends query the database, on the
+request's own sync thread. Once SMART_HOME_AUTH_HASHING_MAX_PENDING hashes and
+logins are running or waiting, further ones fail fast with `HashingBusy` rather
+than queueing behind the burst.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.hashers import make_password
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+
+_lock = Lock()
+_executor = None
+_pending = 0
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many hashes are already running or waiting.
+    """
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(getattr(settings, 'SMART_HOME_AUTH_HASHING_WORKERS', DEFAULT_WORKERS),
+                                           thread_name_prefix='password-hashing')
+        return _executor
+
+
+def pending():
+    """
+    The number of hashes and logins running or waiting.
+    """
+    return _pending
+
+
+@contextmanager
+def hashing_slot():
+    """
+    Count a hash as pending while in the block, raising `HashingBusy` if too
+    many are already running or waiting.
+    """
+    global _pending
+    with _lock:
+        if _pending >= getattr(settings, 'SMART_HOME_AUTH_HASHING_MAX_PENDING', DEFAULT_MAX_PENDING):
+            raise HashingBusy()
+        _pending += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+async def run_hashing(function, *args):
+    """
+    Await `function(*args)` run in the hashing pool.
+    """
+    with hashing_slot():
+        return await asyncio.wrap_future(get_executor().submit(function, *args))
+
+
+async def hash_password(password):
+    return await run_hashing(make_password, password)
+
+
+async def authenticate(request, username, password):
+    """
+    `django.contrib.auth.authenticate`, so the AUTHENTICATION_BACKENDS and the
+    `user_login_failed` signal apply. Returns the user matching the credentials or None.
+    """
+    with hashing_slot():
+        return await sync_to_async(auth.authenticate)(request, username=username, password=password)
@@ -0,0 +1,49 @@
+import logging
+import time
+from threading import Lock
+
+from django.conf import settings
+
+DEFAULT_RATE = (10, 60)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records of every message per `period` seconds.
+    The first record let through after some were dropped tells how many.
+    """
+
+    def __init__(self, limit, period, clock=time.monotonic):
+        super().__init__()
+        self.limit = limit
+        self.period = period
+        self.clock = clock
+        self.lock = Lock()
+        # (logger name, message) -> [window start, records let through, records dropped]
+        self.windows = {}
+
+    def clear(self):
+        with self.lock:
+            self.windows = {}
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = self.clock()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                dropped = window[2] if window else 0
+                window = self.windows[key] = [now, 0, 0]
+                if dropped:
+                    record.suppressed = dropped
+                    record.msg = f'{record.msg} ({dropped} similar records suppressed)'
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+# Authentication attempts, with `event`, `outcome`, `username` and `ip` as record attributes for structured handlers.
+auth_logger = logging.getLogger('accounts.auth')
+auth_logger.addFilter(RateLimitFilter(*getattr(settings, 'SMART_HOME_AUTH_LOG_RATE', DEFAULT_RATE)))
@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.tokens import revoke_tokens
+
+
+class Command(BaseCommand):
+    help = "Revoke every token issued so far to the given users, e.g. after a credential leak."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='+', help="Users whose tokens to revoke.")
+
+    def handle(self, *args, **options):
+        users = dict(User.objects.filter(username__in=options['usernames']).values_list('username', 'pk'))
+        unknown = set(options['usernames']) - users.keys()
+        if unknown:
+            raise CommandError(f"Unknown users: {', '.join(sorted(unknown))}.")
+
+        for username, user_id in users.items():
+            revoke_tokens(user_id)
+            self.stdout.write(f"Revoked the tokens of {username}.")
@@ -1,3 +1,27 @@
+from django.contrib.auth.models import User
 from django.db import models
 
 
+class TokenVersion(models.Model):
+    """
+    Version of a user's tokens. It is bumped when the user's roles, status or
+    password change, which revokes every token carrying an older version.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='token_version')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Token version {self.version} of {self.user_id}"
+
+
+class ClaimsUser(User):
+    """
+    A user built from the claims of an access token instead of its row. Fields
+    missing from the claims are deferred and loaded on first access.
+    """
+
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        raise TypeError("A user built from token claims cannot be saved, load it from the database instead.")
@@ -10,7 +10,16 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'first_name', 'last_name', 'username', 'email', 'password')
 
     def create(self, validated_data):
-        user = User.objects.create_user(**validated_data)
+        password_hash = validated_data.pop('password_hash', None)
+        if password_hash is None:
+            return User.objects.create_user(**validated_data)
+
+        # The password was hashed beforehand, off the request worker.
+        del validated_data['password']
+        user = User(**validated_data, password=password_hash)
+        user.username = User.normalize_username(user.username)
+        user.email = User.objects.normalize_email(user.email)
+        user.save()
         return user
 
 
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_users
+from .tokens import revoke_tokens
+
+# Fields whose change revokes the user's tokens: the roles in their claims,
+# the status checked on authentication, and the password.
+REVOKING_FIELDS = ('is_staff', 'is_superuser', 'is_active', 'password')
+
+
+@receiver(pre_save, sender=User)
+def remember_revoking_fields(sender, instance, update_fields=None, **kwargs):
+    instance._previous_revoking_fields = None
+    if instance._state.adding or update_fields is not None and not set(update_fields) & set(REVOKING_FIELDS):
+        # New users have no tokens yet; other partial updates, like last_login on every login, revoke nothing.
+        return
+    if update_fields is not None and set(update_fields) == {'password'} and instance._password is None:
+        # check_password re-encoding the same password with the current hasher on login.
+        return
+    instance._previous_revoking_fields = sender.objects.filter(pk=instance.pk).values_list(*REVOKING_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_revoking_fields', None)
+    if previous is not None and previous != tuple(getattr(instance, field) for field in REVOKING_FIELDS):
+        revoke_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    user_ids = [instance.pk]
+    invalidate_users(user_ids)
+    transaction.on_commit(lambda: invalidate_users(user_ids))
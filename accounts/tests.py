@@ -1,3 +1,226 @@
-from django.test import TestCase
+import logging
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import authentication
+from .authentication import ClaimsJWTAuthentication, invalidate_users
+from .logs import RateLimitFilter, auth_logger
+from .models import ClaimsUser, TokenVersion
+from .tokens import revoke_tokens
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+def clear_log_rate_limits():
+    for log_filter in auth_logger.filters:
+        log_filter.clear()
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.clear()
+        clear_log_rate_limits()
+        self.user = User.objects.create_user(username='owner', password='password', email='owner@example.com')
+        self.client = APIClient()
+
+    def login(self, username='owner', password='password'):
+        self.client.credentials()
+        with self.assertLogs('accounts.auth', 'INFO'):
+            response = self.client.post('/api/accounts/login/', {'username': username, 'password': password})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        return response
+
+    def get_devices(self):
+        log = QueryLog()
+        with connection.execute_wrapper(log):
+            response = self.client.get('/analog-devices/')
+        return response, [sql for sql in log.queries if '"auth_user"' in sql]
+
+    def test_requests_do_not_load_the_user(self):
+        self.login()
+        self.get_devices()
+
+        response, user_queries = self.get_devices()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_queries, [])
+
+    def test_role_changes_revoke_tokens(self):
+        self.login()
+        self.assertEqual(self.get_devices()[0].status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.get_devices()[0]
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+
+        self.login()
+        self.assertEqual(self.get_devices()[0].status_code, 200)
+
+    def test_revoked_and_deactivated_users_are_rejected(self):
+        self.login()
+        revoke_tokens(self.user.pk)
+        self.assertEqual(self.get_devices()[0].status_code, 401)
+
+        self.login()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_users([self.user.pk])
+        self.assertEqual(self.get_devices()[0].data['code'], 'user_not_found')
+
+    def test_last_login_does_not_revoke_tokens(self):
+        self.login()
+        with self.assertLogs('accounts.auth', 'INFO'):
+            self.client.post('/api/accounts/login/', {'username': 'owner', 'password': 'password'})
+
+        self.assertEqual(self.get_devices()[0].status_code, 200)
+
+    def test_tokens_without_claims_load_the_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+        response, user_queries = self.get_devices()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(user_queries), 1)
+
+    def test_claims_user(self):
+        access = self.login().json()['access']
+        backend = ClaimsJWTAuthentication()
+        user = backend.get_user(backend.get_validated_token(access))
+
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user, self.user)
+        self.assertEqual((user.username, user.is_staff, user.is_superuser), ('owner', False, False))
+        # Fields missing from the claims are loaded on access.
+        self.assertEqual(user.email, 'owner@example.com')
+        with self.assertRaises(TypeError):
+            user.save()
+
+
+class AuthenticationViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_log_rate_limits()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+
+    def post(self, path, data, **kwargs):
+        # Every attempt leaves an audit record, kept in `self.logs` instead of the test output.
+        with self.assertLogs('accounts.auth', 'INFO') as self.logs:
+            return self.client.post(path, data, **kwargs)
+
+    def login(self, password='password', **kwargs):
+        return self.post('/api/accounts/login/', {'username': 'owner', 'password': password}, **kwargs)
+
+    def test_login(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['userid'], self.user.pk)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(self.client.get('/rooms/').status_code, 200)
+
+        response = self.post('/api/accounts/login/', {'username': 'owner', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Invalid credentials'})
+        self.assertEqual(self.post('/api/accounts/login/', {'username': 'nobody', 'password': 'password'})
+                         .status_code, 401)
+
+    def test_inactive_users_cannot_log_in(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.login().status_code, 401)
+
+    def test_register(self):
+        response = self.post('/api/accounts/register/', {
+            'username': 'new', 'password': 'secret', 'email': 'new@EXAMPLE.com',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.json()), {'refresh', 'access'})
+        user = User.objects.get(username='new')
+        self.assertTrue(user.check_password('secret'))
+        self.assertEqual(user.email, 'new@example.com')
+
+        response = self.post('/api/accounts/register/', {'username': 'new', 'password': 'secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('username', response.json())
+
+    def test_login_goes_through_the_authentication_backends(self):
+        failures = []
+        user_login_failed.connect(lambda sender, credentials, **kwargs: failures.append(credentials['username']),
+                                  weak=False, dispatch_uid='test-login-failed')
+        self.addCleanup(user_login_failed.disconnect, dispatch_uid='test-login-failed')
+
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(failures, ['owner'])
+        # A backend taking no passwords.
+        with self.settings(AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.RemoteUserBackend']):
+            self.assertEqual(self.login().status_code, 401)
+
+    def test_outdated_hashes_are_upgraded_without_revoking_tokens(self):
+        hasher = PBKDF2PasswordHasher()
+        User.objects.filter(pk=self.user.pk).update(password=hasher.encode('password', hasher.salt(), 1000))
+
+        self.assertEqual(self.login().status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertEqual(hasher.decode(self.user.password)['iterations'], hasher.iterations)
+        self.assertFalse(TokenVersion.objects.filter(user=self.user).exists())
+
+    @override_settings(SMART_HOME_AUTH_THROTTLE_RATE=(2, 60))
+    def test_attempts_are_throttled_per_ip(self):
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.login('wrong').status_code, 401)
+
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 61)
+
+        self.assertEqual(self.login(REMOTE_ADDR='10.0.0.2').status_code, 200)
+        # Registration is throttled separately.
+        self.assertEqual(self.post('/api/accounts/register/', {'username': 'new', 'password': 'secret'})
+                         .status_code, 201)
+
+    @override_settings(SMART_HOME_AUTH_HASHING_MAX_PENDING=0)
+    def test_busy_hashing_pool_fails_fast(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_malformed_body(self):
+        response = self.client.post('/api/accounts/login/', '[1, 2]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_attempts_are_logged(self):
+        self.login('wrong')
+        self.assertEqual(self.logs.records[0].getMessage(), 'Login failed for owner from 127.0.0.1')
+        self.assertEqual((self.logs.records[0].event, self.logs.records[0].outcome), ('login', 'failure'))
+
+    def test_rate_limited_logging(self):
+        now = [0]
+        rate_limit = RateLimitFilter(2, 60, clock=lambda: now[0])
+
+        def record(message='Login failed for %s from %s'):
+            return logging.LogRecord('accounts.auth', logging.INFO, __file__, 0, message, ('owner', 'ip'), None)
+
+        self.assertEqual([rate_limit.filter(record()) for _ in range(4)], [True, True, False, False])
+        self.assertTrue(rate_limit.filter(record('Login succeeded for %s from %s')))
+
+        now[0] = 60
+        passed = record()
+        self.assertTrue(rate_limit.filter(passed))
+        self.assertEqual(passed.getMessage(), 'Login failed for owner from ip (2 similar records suppressed)')
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+
+DEFAULT_RATE = (20, 60)
+
+
+def client_ip(request):
+    """
+    The address of the client, trusting the X-Forwarded-For header only as far
+    as REST_FRAMEWORK['NUM_PROXIES'] does for the API's own throttles.
+    """
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    num_proxies = api_settings.NUM_PROXIES
+    if num_proxies is not None and forwarded:
+        if num_proxies == 0:
+            return request.META.get('REMOTE_ADDR')
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[-min(num_proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR')
+
+
+async def throttle(request, scope):
+    """
+    Count an attempt of the client at `scope` in a fixed window of the cache.
+    Returns the seconds until the window ends if the client made more than
+    SMART_HOME_AUTH_THROTTLE_RATE[0] attempts in it, else None.
+    """
+    rate = getattr(settings, 'SMART_HOME_AUTH_THROTTLE_RATE', DEFAULT_RATE)
+    if rate is None:
+        return None
+
+    limit, period = rate
+    now = time.time()
+    key = f'auth-throttle:{scope}:{client_ip(request)}:{int(now // period)}'
+    await cache.aadd(key, 0, period)
+    try:
+        attempts = await cache.aincr(key)
+    except ValueError:
+        # Expired between the two calls.
+        await cache.aset(key, 1, period)
+        attempts = 1
+    if attempts > limit:
+        return int(period - now % period) + 1
+    return None
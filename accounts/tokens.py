@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models import F
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import USER_CLAIMS, VERSION_CLAIM, invalidate_users
+from .models import TokenVersion
+
+
+def token_version(user_id):
+    return TokenVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def tokens_for(user):
+    """
+    A refresh token for the user whose claims, copied into its access tokens,
+    let requests be authenticated without loading the user.
+    """
+    refresh = RefreshToken.for_user(user)
+    for claim in USER_CLAIMS:
+        refresh[claim] = getattr(user, claim)
+    refresh[VERSION_CLAIM] = token_version(user.pk)
+    return refresh
+
+
+def revoke_tokens(user_id):
+    """
+    Revoke every token issued to the user so far.
+    """
+    _, created = TokenVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+    if not created:
+        TokenVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+
+    # Also after commit, so a concurrent request cannot cache the version from before the transaction.
+    invalidate_users([user_id])
+    transaction.on_commit(lambda: invalidate_users([user_id]))
@@ -1,52 +1,114 @@
-from django.contrib.auth import authenticate
-from rest_framework import generics, status
-from rest_framework.response import Response
-from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth.models import User
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .hashing import HashingBusy, authenticate, hash_password
+from .logs import auth_logger
 from .serializers import UserSerializer
+from .throttling import client_ip, throttle
+from .tokens import tokens_for
+
+
+def request_data(request):
+    """
+    The JSON or form fields of the request body, or None if they cannot be parsed.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def log(level, message, event, outcome, request, username):
+    ip = client_ip(request)
+    auth_logger.log(level, message, username, ip,
+                    extra={'event': event, 'outcome': outcome, 'username': username, 'ip': ip})
+
+
+def throttled(retry_after):
+    return JsonResponse({'error': 'Too many attempts, try again later.'}, status=429,
+                        headers={'Retry-After': str(retry_after)})
 
 
-class RegistrationView(generics.CreateAPIView):
-    serializer_class = UserSerializer
+def busy():
+    return JsonResponse({'error': 'The server is busy, try again later.'}, status=503, headers={'Retry-After': '1'})
 
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
 
-        user = serializer.instance
-        refresh = RefreshToken.for_user(user)
+@method_decorator(csrf_exempt, name='dispatch')
+class AuthenticationView(View):
+    """
+    Async views, so the request worker is free while the password is hashed or checked.
+    """
+    http_method_names = ['post']
+    throttle_scope = None
 
-        return Response({
+    async def dispatch(self, request, *args, **kwargs):
+        data = request_data(request)
+        if data is None:
+            return JsonResponse({'error': 'Malformed request body.'}, status=400)
+
+        retry_after = await throttle(request, self.throttle_scope)
+        if retry_after is not None:
+            log(logging.WARNING, "Throttled attempt for %s from %s", self.throttle_scope, 'throttled', request,
+                data.get('username'))
+            return throttled(retry_after)
+
+        try:
+            return await super().dispatch(request, data, *args, **kwargs)
+        except HashingBusy:
+            log(logging.WARNING, "Hashing pool busy, rejected attempt for %s from %s", self.throttle_scope, 'busy',
+                request, data.get('username'))
+            return busy()
+
+
+class RegistrationView(AuthenticationView):
+    throttle_scope = 'register'
+
+    async def post(self, request, data, *args, **kwargs):
+        serializer = UserSerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            log(logging.INFO, "Registration failed for %s from %s", 'register', 'invalid', request,
+                data.get('username'))
+            return JsonResponse(serializer.errors, status=400)
+
+        password_hash = await hash_password(serializer.validated_data['password'])
+        user = await sync_to_async(serializer.save)(password_hash=password_hash)
+        refresh = await sync_to_async(tokens_for)(user)
+        log(logging.INFO, "Registered %s from %s", 'register', 'success', request, user.username)
+
+        return JsonResponse({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
-        }, status=status.HTTP_201_CREATED)
+        }, status=201)
 
 
-class LoginView(APIView):
-    def post(self, request, *args, **kwargs):
-        username = request.data.get('username')
-        password = request.data.get('password')
+class LoginView(AuthenticationView):
+    throttle_scope = 'login'
 
-        # Debugging print statements
-        print(f"Attempting to authenticate user: {username}")
+    async def post(self, request, data, *args, **kwargs):
+        username = data.get('username')
+        password = data.get('password')
 
-        user = authenticate(username=username, password=password)
+        user = await authenticate(request, username, password)
 
         if user:
-            refresh = RefreshToken.for_user(user)
-
-            # Debugging print statements
-            print("User authenticated successfully")
+            refresh = await sync_to_async(tokens_for)(user)
+            log(logging.INFO, "Login succeeded for %s from %s", 'login', 'success', request, username)
 
-            return Response({
+            return JsonResponse({
                 'userid': user.id,
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
             })
         else:
-            # Debugging print statements
-            print("Authentication failed")
+            log(logging.INFO, "Login failed for %s from %s", 'login', 'failure', request, username)
 
-            return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+            return JsonResponse({'error': 'Invalid credentials'}, status=401)
@@ -0,0 +1,163 @@
+"""
+Statistics over the analog value history of devices, computed on NumPy arrays.
+
+Values are loaded for all requested devices at once, in keyset-paginated
+chunks of plain tuples, and every statistic is computed with vectorized array
+operations. Results are cached per device and time window; every device has a
+cache generation, replaced when its values change, so new readings only
+invalidate the cached windows of their own device.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from uuid import uuid4
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import AnalogValues
+from .streaming import keyset_chunks
+
+DEFAULT_CACHE_TIMEOUT = 600
+PERCENTILES = (5, 25, 50, 75, 95)
+MAX_ANOMALIES = 100
+
+
+def generation_key(device_id):
+    return f'analytics:generation:{device_id}'
+
+
+def invalidate_devices(device_ids):
+    cache.set_many({generation_key(device_id): uuid4().hex for device_id in device_ids}, timeout=None)
+
+
+def load_series(device_ids, start, end):
+    """
+    Return `{device_id: (times, values)}` for the values taken between `start`
+    and `end`, as arrays of seconds since the epoch and of values, ordered by time.
+    """
+    device_ids = list(device_ids)
+    rows = AnalogValues.objects.filter(device_id__in=device_ids, timestamp__gte=start, timestamp__lt=end)
+
+    devices, times, values = [], [], []
+    for chunk in keyset_chunks(rows, ['device_id', 'timestamp', 'value'], 'timestamp'):
+        chunk_devices, chunk_times, chunk_values = zip(*chunk)
+        devices.append(np.array(chunk_devices, dtype=np.int64))
+        times.append(np.array([timestamp.timestamp() for timestamp in chunk_times], dtype=np.float64))
+        values.append(np.array(chunk_values, dtype=np.float64))
+
+    series = {device_id: (np.empty(0), np.empty(0)) for device_id in device_ids}
+    if devices:
+        devices, times, values = np.concatenate(devices), np.concatenate(times), np.concatenate(values)
+        # A stable sort by device keeps every device's values in time order.
+        order = np.argsort(devices, kind='stable')
+        devices, times, values = devices[order], times[order], values[order]
+        boundaries = np.flatnonzero(np.diff(devices)) + 1
+        for indices in np.split(np.arange(len(devices)), boundaries):
+            series[int(devices[indices[0]])] = (times[indices], values[indices])
+    return series
+
+
+def ewma(values, alpha):
+    """
+    Exponentially weighted moving average, as a convolution with the weights
+    truncated where they fall below one millionth.
+    """
+    length = min(len(values), max(1, math.ceil(math.log(1e-6) / math.log(1 - alpha))))
+    weights = alpha * (1 - alpha) ** np.arange(length)
+    smoothed = np.convolve(values, weights)[:len(values)]
+    # Normalize the start of the series, where fewer weights apply.
+    return smoothed / np.cumsum(weights)[np.minimum(np.arange(len(values)), length - 1)]
+
+
+def series_statistics(times, values, z_threshold=3.0, ewma_alpha=0.3):
+    """
+    Summary statistics of one series: distribution, rate of change per second,
+    time-weighted integral and the timestamps flagged as anomalous by z-score
+    or by their deviation from the EWMA of the preceding values.
+    """
+    if not len(values):
+        return {'count': 0}
+
+    std = float(values.std())
+    statistics = {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'std': std,
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'percentiles': dict(zip(map(str, PERCENTILES), np.percentile(values, PERCENTILES).tolist())),
+        'first': float(values[0]),
+        'last': float(values[-1]),
+    }
+
+    elapsed = np.diff(times)
+    valid = elapsed > 0
+    rates = np.diff(values)[valid] / elapsed[valid]
+    statistics['rate_of_change'] = {
+        'mean': float(rates.mean()) if len(rates) else None,
+        'min': float(rates.min()) if len(rates) else None,
+        'max': float(rates.max()) if len(rates) else None,
+    }
+
+    # Value-seconds by the trapezoidal rule; divided by 3600, watts become watt-hours.
+    integral = float(np.trapz(values, times))
+    statistics['integral'] = integral
+    statistics['integral_hours'] = integral / 3600
+
+    z_anomalies = np.flatnonzero(np.abs(values - statistics['mean']) > z_threshold * std) if std else np.empty(0, int)
+    residuals = values[1:] - ewma(values, ewma_alpha)[:-1]
+    residual_std = residuals.std() if len(residuals) else 0
+    ewma_anomalies = (np.flatnonzero(np.abs(residuals) > z_threshold * residual_std) + 1 if residual_std
+                      else np.empty(0, int))
+    statistics['anomalies'] = {
+        'zscore': [datetime.fromtimestamp(time, dt_timezone.utc) for time in times[z_anomalies][:MAX_ANOMALIES]],
+        'ewma': [datetime.fromtimestamp(time, dt_timezone.utc) for time in times[ewma_anomalies][:MAX_ANOMALIES]],
+        'zscore_count': len(z_anomalies),
+        'ewma_count': len(ewma_anomalies),
+    }
+    return statistics
+
+
+def device_statistics(device_ids, start, end, z_threshold=3.0):
+    """
+    Statistics of every device's values between `start` and `end`, from the
+    cache where possible. The values of the devices missing from the cache are
+    loaded together.
+    """
+    device_ids = list(device_ids)
+    generations = cache.get_many([generation_key(device_id) for device_id in device_ids])
+    new_generations = {}
+    keys = {}
+    for device_id in device_ids:
+        generation = generations.get(generation_key(device_id))
+        if generation is None:
+            generation = new_generations[generation_key(device_id)] = uuid4().hex
+        keys[device_id] = (f'analytics:{device_id}:{generation}:'
+                           f'{start.timestamp()}:{end.timestamp()}:{z_threshold}')
+    if new_generations:
+        cache.set_many(new_generations, timeout=None)
+
+    cached = cache.get_many(keys.values())
+    statistics = {device_id: cached[key] for device_id, key in keys.items() if key in cached}
+
+    missing = [device_id for device_id in device_ids if device_id not in statistics]
+    if missing:
+        computed = {device_id: series_statistics(times, values, z_threshold)
+                    for device_id, (times, values) in load_series(missing, start, end).items()}
+        cache.set_many({keys[device_id]: result for device_id, result in computed.items()},
+                       getattr(settings, 'SMART_HOME_ANALYTICS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+        statistics.update(computed)
+
+    return statistics
+
+
+def analytics_window(start, end, now, window=timedelta(days=1)):
+    """
+    The `(start, end)` of an analytics request. Without an end, the window ends
+    at the next full minute, so requests within a minute share cache entries;
+    later readings invalidate them like any other.
+    """
+    if end is None:
+        end = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return start if start is not None else end - window, end
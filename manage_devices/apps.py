@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ManagedevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'manage_devices'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,47 @@
+"""
+Packed batches of analog values.
+
+Besides JSON and MessagePack, analog values are exchanged as packed batches of
+`ANALOG_RECORD`s (`application/vnd.smart-home.analog-batch`): 20 bytes per
+value, holding the device id as a uint32, then the time as float64 seconds
+since the Unix epoch and the value as a float64, all little-endian. Gateways
+post such batches to `/values/bulk/`, and `/analog-values/` lists values in the
+format to clients that accept it, with the next and previous pages in a Link header.
+"""
+from rest_framework.response import Response
+
+from .renderers import AnalogBatchRenderer
+
+
+class AnalogBatchListMixin:
+    """
+    Offer packed batches as a format of `list`, and only of `list`: other
+    actions answer clients accepting nothing else with 406 Not Acceptable.
+    """
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            renderers.append(AnalogBatchRenderer())
+        return renderers
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, AnalogBatchRenderer):
+            return super().list(request, *args, **kwargs)
+
+        # The id and the time are also the positions of the cursor pagination.
+        queryset = self.filter_queryset(self.get_queryset()).values('id', 'device_id', 'timestamp', 'value')
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(list(queryset))
+
+        links = [(self.paginator.get_next_link(), 'next'), (self.paginator.get_previous_link(), 'prev')]
+        link = ', '.join(f'<{url}>; rel="{rel}"' for url, rel in links if url)
+        return Response(page, headers={'Link': link} if link else None)
+
+    def handle_exception(self, exc):
+        # Errors are no batches of values: they are rendered like those of the other formats.
+        if isinstance(getattr(self.request, 'accepted_renderer', None), AnalogBatchRenderer):
+            renderer = self.get_renderers()[0]
+            self.request.accepted_renderer, self.request.accepted_media_type = renderer, renderer.media_type
+        return super().handle_exception(exc)
@@ -0,0 +1,343 @@
+"""
+Synthetic data and load generation for benchmarking the REST API.
+
+`seed` creates users, rooms, devices and value histories at a given scale,
+taking the field values of every record from the fixtures in `data/`. Seeded
+users share a username prefix, so `clear` can remove them along with
+everything they own. `run_benchmark` sends requests of each scenario from
+concurrent worker threads, either through Django in-process, which also counts
+the queries of every request, or over HTTP to a running server, and reports
+latency percentiles, throughput, errors and query counts per scenario.
+"""
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from accounts.tokens import tokens_for
+
+from .cache import invalidate_trees
+from .models import Room, DeviceKind, DEVICE_MODELS, VALUE_MODELS
+from .state import refresh_current_state
+
+USERNAME_PREFIX = 'benchmark-'
+DEFAULT_PASSWORD = 'benchmark'
+PERCENTILES = (50, 90, 95, 99)
+DEFAULT_VALUES = {DeviceKind.ANALOG: 0.0, DeviceKind.DIGITAL: False, DeviceKind.SMART: 'Off'}
+
+# Fields of the user fixtures not taken over: identity, credentials and permissions.
+USER_EXCLUDED_FIELDS = {'username', 'email', 'password', 'is_superuser', 'is_staff', 'last_login', 'date_joined',
+                        'groups', 'user_permissions'}
+
+
+def fixture_templates(directory=None):
+    """
+    Return the fields of the records in the JSON fixtures of `directory`, by model label.
+    """
+    templates = {}
+    for path in sorted((directory or settings.BASE_DIR / 'data').glob('*.json')):
+        for record in json.loads(path.read_text()):
+            templates.setdefault(record['model'], []).append(record['fields'])
+    return templates
+
+
+def template(templates, model, index, excluded=()):
+    candidates = templates.get(model._meta.label_lower) or [{}]
+    fields = candidates[index % len(candidates)]
+    return {name: value for name, value in fields.items() if name not in excluded}
+
+
+def benchmark_mac_address(kind, number):
+    # Locally administered addresses, unique per kind and distinct from the placeholders of migration 0007.
+    return ':'.join(f'{octet:02x}' for octet in (0x02, 0xbe, DeviceKind.values.index(kind), *number.to_bytes(3, 'big')))
+
+
+def device_fields(templates, kind, number):
+    fields = template(templates, DEVICE_MODELS[kind], number, {'room', 'mac_address'})
+    if kind == DeviceKind.SMART:
+        # The smart device fixtures predate the protocol name.
+        fields.setdefault('protocol_name', 'zigbee')
+    return fields
+
+
+def seed(users=10, rooms_per_user=2, devices_per_room=5, values_per_device=100, interval=timedelta(minutes=1),
+         password=DEFAULT_PASSWORD, templates=None, random_seed=0, batch_size=5000):
+    """
+    Create `users` users, each owning `rooms_per_user` rooms with
+    `devices_per_room` devices of every kind, and `values_per_device` values per
+    device, `interval` apart and ending now. Returns the number of rows created by model.
+    """
+    templates = fixture_templates() if templates is None else templates
+    rng = random.Random(random_seed)
+    # Hashed once: PBKDF2 for every user would take most of the seeding time.
+    password = make_password(password)
+    now = timezone.now()
+
+    User.objects.bulk_create(
+        User(**template(templates, User, i, USER_EXCLUDED_FIELDS), username=f'{USERNAME_PREFIX}{i}',
+             email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+        for i in range(users)
+    )
+    # Reloaded for their ids, which not every database returns from a bulk insert.
+    owners = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+    Room.objects.bulk_create(
+        Room(**template(templates, Room, i, {'owner'}), owner=owner)
+        for owner in owners for i in range(rooms_per_user)
+    )
+    rooms = list(Room.objects.filter(owner__in=owners).order_by('id'))
+
+    created = {'users': len(owners), 'rooms': len(rooms)}
+    for kind, device_model in DEVICE_MODELS.items():
+        placements = (room for room in rooms for _ in range(devices_per_room))
+        device_model.objects.bulk_create(
+            (device_model(**device_fields(templates, kind, number), room=room,
+                          mac_address=benchmark_mac_address(kind, number))
+             for number, room in enumerate(placements)),
+            batch_size=batch_size,
+        )
+        device_ids = list(device_model.objects.filter(room__in=rooms).values_list('id', flat=True))
+        created[device_model._meta.model_name] = len(device_ids)
+
+        values_model = VALUE_MODELS[kind]
+        rows = 0
+        for device_id in device_ids:
+            values = []
+            for i in range(values_per_device):
+                value = template(templates, values_model, device_id + i).get('value', DEFAULT_VALUES[kind])
+                if kind == DeviceKind.ANALOG:
+                    value += rng.gauss(0, 0.25)
+                values.append(values_model(device_id=device_id, value=value,
+                                           timestamp=now - interval * (values_per_device - i)))
+            values_model.objects.bulk_create(values, batch_size=batch_size)
+            rows += len(values)
+        created[values_model._meta.model_name] = rows
+
+        for start in range(0, len(device_ids), 1000):
+            refresh_current_state(kind, device_ids[start:start + 1000])
+
+    # Bulk inserts send no signals, so the cached trees of staff users are invalidated here.
+    invalidate_trees([owner.pk for owner in owners])
+    return created
+
+
+def clear():
+    """
+    Delete the seeded users and everything they own. Returns the number of users deleted.
+    """
+    return User.objects.filter(username__startswith=USERNAME_PREFIX).delete()[1].get(User._meta.label, 0)
+
+
+def benchmark_sessions():
+    """
+    Return one session per seeded user: its username, an access token and the
+    ids of the analog devices in its rooms.
+    """
+    sessions = []
+    for user in User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'):
+        sessions.append({
+            'username': user.username,
+            'token': str(tokens_for(user).access_token),
+            'analog_devices': list(DEVICE_MODELS[DeviceKind.ANALOG].objects.filter(room__owner=user)
+                                   .values_list('id', flat=True)),
+        })
+    return sessions
+
+
+def list_scenario(path):
+    return lambda session, rng, options: ('get', path, None, session['token'])
+
+
+def activate_scenario(session, rng, options):
+    return 'patch', f"/analog-devices/{rng.choice(session['analog_devices'])}/activate/", {}, session['token']
+
+
+def login_scenario(session, rng, options):
+    return 'post', '/api/accounts/login/', {'username': session['username'], 'password': options['password']}, None
+
+
+def value_list_scenario(kind):
+    def scenario(session, rng, options):
+        return 'get', f"/{kind}-values/?page_size={options['page_size']}", None, session['token']
+    return scenario
+
+
+# A scenario maps a session, a random generator and the run options to `(method, path, data, token)`.
+SCENARIOS = {
+    'rooms': list_scenario('/rooms/'),
+    'devices': list_scenario('/devices/'),
+    'analog-devices': list_scenario('/analog-devices/'),
+    'digital-devices': list_scenario('/digital-devices/'),
+    'smart-devices': list_scenario('/smart-devices/'),
+    'analog-values': value_list_scenario('analog'),
+    'digital-values': value_list_scenario('digital'),
+    'smart-values': value_list_scenario('smart'),
+    'activate': activate_scenario,
+    'login': login_scenario,
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessTransport:
+    """
+    Sends requests through the Django test client and counts their queries.
+    Every worker thread uses its own database connection.
+    """
+
+    def __init__(self, host='localhost'):
+        self.host = host
+
+    def request(self, method, path, data, token):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        client = Client(SERVER_NAME=self.host)
+        # An execute wrapper rather than CaptureQueriesContext, whose query log is reset by every request.
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = getattr(client, method)(path, data=json.dumps(data) if data is not None else None,
+                                               content_type='application/json', **headers)
+        return response.status_code, queries.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    """
+    Sends requests over HTTP to a running server. Query counts are not available.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data, token):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = json.dumps(data).encode() if data is not None else None
+        try:
+            with urlopen(Request(self.base_url + path, data=body, headers=headers, method=method.upper())) as response:
+                response.read()
+                return response.status, None
+        except HTTPError as error:
+            return error.code, None
+
+    def close(self):
+        pass
+
+
+def summarize(samples, elapsed):
+    latencies = np.array([latency for latency, _, _ in samples]) * 1000
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'throughput': len(samples) / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            **{f'p{percentile}': float(value)
+               for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+            'max': float(latencies.max()),
+        },
+        'queries': {'mean': sum(queries) / len(queries), 'max': max(queries)} if queries else None,
+    }
+
+
+def run_scenario(transport, scenario, sessions, requests, concurrency=1, warmup=0, options=None, random_seed=0):
+    """
+    Send `requests` requests of a scenario, spread over `concurrency` worker
+    threads, after `warmup` untimed ones. Returns the summary of the timed requests.
+    """
+    options = {'page_size': 100, 'password': DEFAULT_PASSWORD, **(options or {})}
+
+    def work(count, worker_seed):
+        rng = random.Random(worker_seed)
+        samples = []
+        for _ in range(count):
+            method, path, data, token = scenario(rng.choice(sessions), rng, options)
+            started = time.perf_counter()
+            status, queries = transport.request(method, path, data, token)
+            samples.append((time.perf_counter() - started, status, queries))
+        return samples
+
+    def threaded_work(count, worker_seed):
+        try:
+            return work(count, worker_seed)
+        finally:
+            transport.close()
+
+    work(warmup, random_seed - 1)
+    counts = [requests // concurrency + (worker < requests % concurrency) for worker in range(concurrency)]
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        # In the calling thread, which also lets tests see data of their open transaction.
+        results = [work(requests, random_seed)]
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(threaded_work, counts, range(random_seed, random_seed + concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return summarize([sample for samples in results for sample in samples], elapsed)
+
+
+def run_benchmark(transport, scenarios, requests, concurrency=1, warmup=0, options=None, random_seed=0):
+    """
+    Run the named scenarios one after another against the seeded users and return the report.
+    """
+    sessions = benchmark_sessions()
+    if not sessions:
+        raise ValueError("No benchmark users found, seed the data first.")
+
+    return {
+        'started_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'transport': 'http' if isinstance(transport, HttpTransport) else 'in-process',
+        'requests': requests,
+        'concurrency': concurrency,
+        'scenarios': {name: run_scenario(transport, SCENARIOS[name], sessions, requests, concurrency, warmup,
+                                         options, random_seed)
+                      for name in scenarios},
+    }
+
+
+def compare_reports(report, baseline, threshold=0.2):
+    """
+    Return a description of every regression of `report` against `baseline`:
+    a p95 latency or throughput worse by more than `threshold`, a higher query
+    count or new errors.
+    """
+    regressions = []
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+
+        if current['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + threshold):
+            regressions.append(f"{name}: p95 latency {previous['latency_ms']['p95']:.1f} ms -> "
+                               f"{current['latency_ms']['p95']:.1f} ms")
+        if current['throughput'] and previous['throughput'] and \
+                current['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['throughput']:.1f}/s -> {current['throughput']:.1f}/s")
+        if current['queries'] and previous['queries'] and current['queries']['max'] > previous['queries']['max']:
+            regressions.append(f"{name}: queries per request {previous['queries']['max']} -> "
+                               f"{current['queries']['max']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
@@ -0,0 +1,79 @@
+"""
+Per-user cache of the serialized room/device tree.
+
+Every user has a tree version stored in the cache, and staff users share one
+version covering all rooms. Cached trees are keyed by that version, so a change
+invalidates them by replacing the version rather than by finding and deleting
+every affected entry. The version doubles as the ETag, which lets unchanged
+trees be answered with 304 after a single cache lookup.
+"""
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+DEFAULT_TIMEOUT = 300
+STAFF_SCOPE = 'staff'
+
+
+def version_key(scope):
+    return f'room-tree:version:{scope}'
+
+
+def tree_scope(user):
+    return STAFF_SCOPE if user.is_staff else user.pk
+
+
+def tree_version(scope):
+    # A random initial version keeps trees cached under a version evicted from the cache from being served again.
+    return cache.get_or_set(version_key(scope), lambda: uuid4().hex, timeout=None)
+
+
+def replace_versions(scopes):
+    cache.set_many({version_key(scope): uuid4().hex for scope in scopes}, timeout=None)
+
+
+def invalidate_trees(owner_ids):
+    """
+    Invalidate the cached trees of the given room owners and of staff users.
+    """
+    scopes = {STAFF_SCOPE, *(owner_id for owner_id in owner_ids if owner_id is not None)}
+    replace_versions(scopes)
+    # Also after commit, so a concurrent request cannot cache the tree from before the transaction.
+    transaction.on_commit(lambda: replace_versions(scopes))
+
+
+def cached_tree_response(request, view_key, render):
+    """
+    Return the response of `render()` for the user's current tree version from
+    the cache, rendering and caching it on a miss. Requests whose If-None-Match
+    matches the current version get a 304 without rendering anything.
+    """
+    scope = tree_scope(request.user)
+    version_tag = f'{tree_version(scope)}-{view_key}'
+    # The tree is cached once, but every negotiated format is a representation with its own ETag.
+    etag = f'"{version_tag}-{request.accepted_renderer.format}"'
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    key = f'room-tree:{scope}:{version_tag}'
+    data = cache.get(key)
+
+    if data is None:
+        response = render()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        cache.set(key, response.data, getattr(settings, 'SMART_HOME_ROOM_TREE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    else:
+        response = Response(data)
+
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])
+    return response
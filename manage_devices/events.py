@@ -0,0 +1,135 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from rest_framework import permissions
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import Token
+from accounts.authentication import ClaimsJWTAuthentication
+
+from .models import Room
+from .pubsub import get_broker, room_channel
+
+HEARTBEAT_INTERVAL = 15
+MAX_CONNECTION_AGE = 300
+TICKET_LIFETIME = 30
+
+
+class EventsTicket(Token):
+    """
+    Short-lived token that only opens an event stream. Its type differs from
+    that of access tokens, so neither is accepted in place of the other.
+    """
+    token_type = 'events'
+    lifetime = timedelta(seconds=TICKET_LIFETIME)
+
+
+class EventsTicketView(APIView):
+    """
+    Issue a ticket for `/events/?ticket=`. Browsers cannot set headers on an
+    EventSource, and access tokens must not end up in URLs and their logs.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        lifetime = getattr(settings, 'SMART_HOME_EVENTS_TICKET_LIFETIME', TICKET_LIFETIME)
+        ticket = EventsTicket.for_user(request.user)
+        ticket.set_exp(lifetime=timedelta(seconds=lifetime))
+        return Response({'ticket': str(ticket), 'expires_in': lifetime})
+
+
+def authorized_rooms(request):
+    """
+    Return the ids of the rooms the request may follow, restricted to `?rooms=`
+    when given, or None when the request is not authenticated. Besides an
+    access token in the Authorization header, a ticket of `/events/ticket/`
+    is accepted as `?ticket=`.
+    """
+    authentication = ClaimsJWTAuthentication()
+    header = request.headers.get('Authorization', '')
+
+    if 'ticket' in request.GET:
+        try:
+            # Tickets carry no user claims: the user is loaded and checked to be active.
+            user = authentication.get_user(EventsTicket(request.GET['ticket']))
+        except (TokenError, InvalidToken, AuthenticationFailed):
+            return None
+    elif header.startswith('Bearer '):
+        try:
+            user = authentication.get_user(authentication.get_validated_token(header[len('Bearer '):]))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    elif request.user.is_authenticated:
+        user = request.user
+    else:
+        return None
+
+    rooms = Room.objects.all() if user.is_staff else Room.objects.filter(owner=user)
+    if request.GET.get('rooms'):
+        requested = [room_id for room_id in request.GET['rooms'].split(',') if room_id.isdigit()]
+        rooms = rooms.filter(pk__in=requested)
+    return list(rooms.values_list('pk', flat=True))
+
+
+def format_event(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+async def event_stream(channels, heartbeat_interval, max_age):
+    """
+    Server-sent events for the messages published to `channels`, with a comment
+    line as heartbeat when nothing happened for `heartbeat_interval` seconds.
+    After `max_age` seconds the stream ends and the browser reconnects, which
+    also releases connections whose client went away without the server noticing.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_age
+    subscription = get_broker().subscribe(channels)
+
+    try:
+        yield 'retry: 3000\n\n'
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                message = await asyncio.wait_for(subscription.get(), min(heartbeat_interval, remaining))
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+            else:
+                yield format_event(message)
+    finally:
+        subscription.close()
+
+
+async def room_events(request):
+    """
+    Push value and device changes of the user's rooms as server-sent events.
+    Events are fanned out by the pub/sub broker, so connected clients cost no
+    database queries after the rooms were authorized on connect. Only served
+    under ASGI: a WSGI server would tie up a worker per connected client.
+    """
+    # Django's method decorators do not support coroutine views yet.
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': "Server-sent events are only served under ASGI."}, status=501)
+
+    rooms = await sync_to_async(authorized_rooms)(request)
+    if rooms is None:
+        return JsonResponse({'detail': "Authentication credentials were not provided or are invalid."}, status=401)
+
+    response = StreamingHttpResponse(
+        event_stream([room_channel(room_id) for room_id in rooms],
+                     getattr(settings, 'SMART_HOME_EVENTS_HEARTBEAT', HEARTBEAT_INTERVAL),
+                     getattr(settings, 'SMART_HOME_EVENTS_MAX_AGE', MAX_CONNECTION_AGE)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
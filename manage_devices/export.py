@@ -0,0 +1,183 @@
+"""
+Columnar export of the value history.
+
+Rows are read in keyset-paginated chunks and appended to the file one chunk at
+a time, so an export never holds more than a chunk in memory. Arrow IPC and
+Parquet files are written with pyarrow when it is installed; otherwise the
+history is exported as a compressed NumPy `.npz` archive of `device`,
+`timestamp` and `value` arrays. Smart values, being short state strings, are
+stored in the archive dictionary-encoded, as `value` codes into `categories`.
+"""
+import shutil
+import tempfile
+import zipfile
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.http import FileResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .models import DeviceKind
+from .streaming import keyset_chunks
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FIELDS = ('device_id', 'timestamp', 'value')
+
+NUMPY_VALUE_TYPES = {
+    DeviceKind.ANALOG: np.float64,
+    DeviceKind.DIGITAL: np.bool_,
+    DeviceKind.SMART: np.int32,
+}
+
+CONTENT_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+    'npz': 'application/octet-stream',
+}
+
+
+def export_formats():
+    return ['parquet', 'arrow', 'npz'] if pyarrow is not None else ['npz']
+
+
+def utc_datetimes(timestamps):
+    return np.array([timestamp.astimezone(dt_timezone.utc).replace(tzinfo=None) for timestamp in timestamps],
+                    dtype='datetime64[us]')
+
+
+class NpzWriter:
+    """
+    Writes every column to a temporary file as it arrives and assembles the
+    `.npz` archive on `close`, once the number of rows is known.
+    """
+
+    def __init__(self, fileobj, kind):
+        self.fileobj = fileobj
+        self.kind = kind
+        self.rows = 0
+        self.categories = {}
+        self.columns = {name: tempfile.TemporaryFile() for name in ('device', 'timestamp', 'value')}
+        self.dtypes = {'device': np.dtype(np.int64), 'timestamp': np.dtype('datetime64[us]'),
+                       'value': np.dtype(NUMPY_VALUE_TYPES[kind])}
+
+    def write(self, rows):
+        device_ids, timestamps, values = zip(*rows)
+        if self.kind == DeviceKind.SMART:
+            values = [self.categories.setdefault(value, len(self.categories)) for value in values]
+
+        self.columns['device'].write(np.array(device_ids, dtype=np.int64).tobytes())
+        self.columns['timestamp'].write(utc_datetimes(timestamps).tobytes())
+        self.columns['value'].write(np.array(values, dtype=self.dtypes['value']).tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        with zipfile.ZipFile(self.fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, column in self.columns.items():
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, {
+                        'descr': np.lib.format.dtype_to_descr(self.dtypes[name]),
+                        'fortran_order': False,
+                        'shape': (self.rows,),
+                    })
+                    column.seek(0)
+                    shutil.copyfileobj(column, member)
+                column.close()
+
+            if self.kind == DeviceKind.SMART:
+                with archive.open('categories.npy', 'w') as member:
+                    np.lib.format.write_array(member, np.array(list(self.categories), dtype=str))
+
+
+class ArrowWriter:
+    """
+    Writes every chunk as a record batch of an Arrow IPC file, or as a row
+    group of a Parquet file.
+    """
+    VALUE_TYPES = {
+        DeviceKind.ANALOG: 'float64',
+        DeviceKind.DIGITAL: 'bool_',
+        DeviceKind.SMART: 'string',
+    }
+
+    def __init__(self, fileobj, kind, file_format):
+        self.schema = pyarrow.schema([
+            ('device', pyarrow.int64()),
+            ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+            ('value', getattr(pyarrow, self.VALUE_TYPES[kind])()),
+        ])
+        if file_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(fileobj, self.schema, compression='zstd')
+        else:
+            self.writer = pyarrow.ipc.new_file(fileobj, self.schema,
+                                               options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write(self, rows):
+        device_ids, timestamps, values = zip(*rows)
+        self.writer.write_table(pyarrow.table([
+            pyarrow.array(device_ids, pyarrow.int64()),
+            pyarrow.array(utc_datetimes(timestamps)).cast(self.schema.field('timestamp').type),
+            pyarrow.array(values, self.schema.field('value').type),
+        ], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_values(queryset, kind, file_format, fileobj, chunk_size=50000):
+    """
+    Write the value rows of `queryset`, of the given device kind, ordered by
+    time to `fileobj` in `file_format`. Returns the number of rows written.
+    """
+    if file_format not in export_formats():
+        raise ValueError(f"Unsupported export format {file_format!r}, available: {', '.join(export_formats())}.")
+
+    writer = NpzWriter(fileobj, kind) if file_format == 'npz' else ArrowWriter(fileobj, kind, file_format)
+    rows = 0
+    for chunk in keyset_chunks(queryset, EXPORT_FIELDS, 'timestamp', chunk_size=chunk_size):
+        writer.write(chunk)
+        rows += len(chunk)
+    writer.close()
+    return rows
+
+
+class ExportMixin:
+    """
+    Adds an `export` action to a value viewset, writing the history of a
+    `?device=` or `?room=`, optionally limited by `?start=` and `?end=`, to a
+    columnar file in `?file_format=`. Requires a `kind` attribute.
+    """
+    kind = None
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        room = request.query_params.get('room')
+        if room is not None:
+            if not room.isdigit():
+                raise ValidationError({'room': ["A valid room id is required."]})
+            queryset = queryset.filter(device__room_id=room)
+        elif request.query_params.get('device') is None:
+            raise ValidationError({'device': ["Select a device or a room to export."]})
+
+        file_format = request.query_params.get('file_format', export_formats()[0])
+        if file_format not in export_formats():
+            return Response({'file_format': [f"Available formats are: {', '.join(export_formats())}."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Spooled to disk, so the response can be streamed in blocks once complete.
+        output = tempfile.TemporaryFile()
+        export_values(queryset, self.kind, file_format, output)
+        output.seek(0)
+
+        return FileResponse(output, as_attachment=True, filename=f'{self.basename}.{file_format}',
+                            content_type=CONTENT_TYPES[file_format])
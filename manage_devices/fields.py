@@ -0,0 +1,50 @@
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+MAC_ADDRESS_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+
+def normalize_mac_address(value):
+    """
+    Return a MAC address in the canonical lowercase colon-separated form, accepting
+    the common `AA-BB-CC-DD-EE-FF`, `aabb.ccdd.eeff` and bare hex notations.
+    Returns None if the value is not a MAC address.
+    """
+    digits = re.sub(r'[:\-.\s]', '', str(value)).lower()
+    if not MAC_ADDRESS_PATTERN.match(digits):
+        return None
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def validate_mac_address(value):
+    if normalize_mac_address(value) is None:
+        raise ValidationError("Enter a valid MAC address.", code='invalid')
+
+
+class MacAddressField(models.CharField):
+    """
+    MAC address stored normalized, so the unique index and exact lookups match
+    any notation a gateway or user submits.
+    """
+    default_validators = [validate_mac_address]
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 17)
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        value = super().to_python(value)
+        if value is None:
+            return value
+        # Invalid values are left alone for the validator to report.
+        return normalize_mac_address(value) or value
+
+    def get_prep_value(self, value):
+        return self.to_python(super().get_prep_value(value))
+
+    def pre_save(self, model_instance, add):
+        value = self.to_python(super().pre_save(model_instance, add))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,147 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from .fields import normalize_mac_address
+from .models import DeviceKind
+
+
+def parse_datetime_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValidationError({name: ["Enter a valid ISO 8601 date/time."]})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class TimeRangeFilter(filters.BaseFilterBackend):
+    """
+    Filter value rows by `?device=<id>` and by the time they were taken at with
+    `?start=` (inclusive) and `?end=` (exclusive) ISO 8601 date/times, so range
+    queries are served from the `(device, timestamp)` index.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        device = request.query_params.get('device')
+        if device is not None:
+            if not device.isdigit():
+                raise ValidationError({'device': ["A valid device id is required."]})
+            queryset = queryset.filter(device_id=device)
+
+        start = parse_datetime_param(request, 'start')
+        if start is not None:
+            queryset = queryset.filter(timestamp__gte=start)
+
+        end = parse_datetime_param(request, 'end')
+        if end is not None:
+            queryset = queryset.filter(timestamp__lt=end)
+
+        return queryset
+
+
+def id_list_param(request, name):
+    """
+    The comma-separated ids of a query parameter, or None if it is absent.
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+
+    ids = value.split(',')
+    if not all(item.isdigit() for item in ids):
+        raise ValidationError({name: ["A valid id or comma-separated list of ids is required."]})
+    return ids
+
+
+def supported_param(request, queryset, name, field):
+    """
+    The value of a query parameter filtering on `field`, rejecting it on models without that field.
+    """
+    value = request.query_params.get(name)
+    if value is not None and field not in {model_field.name for model_field in queryset.model._meta.get_fields()}:
+        raise ValidationError({name: ["This filter is not supported here."]})
+    return value
+
+
+def filter_name_prefix(request, queryset):
+    # Case-insensitive like the default MySQL collation, so LIKE 'prefix%' is served by the name indexes.
+    name = request.query_params.get('name')
+    return queryset.filter(name__istartswith=name) if name else queryset
+
+
+class DeviceFilter(filters.BaseFilterBackend):
+    """
+    Filter devices by `?room=<id>`, `?active=true|false`, `?name=<prefix>` and
+    `?mac_address=`, and where devices have one, by `?kind=` and `?protocol=`.
+    Several rooms, kinds or protocols can be given comma-separated; filters
+    combine. Used by the registry and the endpoint of every kind, whose
+    `(room, active)`, `(room, name)` and `protocol_name` indexes serve them.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        kinds = supported_param(request, queryset, 'kind', 'kind')
+        if kinds:
+            kinds = kinds.lower().split(',')
+            unknown = set(kinds) - set(DeviceKind.values)
+            if unknown:
+                raise ValidationError({'kind': [f"Unknown device types: {', '.join(sorted(unknown))}."]})
+            queryset = queryset.filter(kind__in=kinds)
+
+        rooms = id_list_param(request, 'room')
+        if rooms is not None:
+            queryset = queryset.filter(room_id__in=rooms)
+
+        active = request.query_params.get('active')
+        if active is not None:
+            if active.lower() not in ('true', 'false'):
+                raise ValidationError({'active': ["Must be true or false."]})
+            queryset = queryset.filter(active=active.lower() == 'true')
+
+        queryset = filter_name_prefix(request, queryset)
+
+        protocols = supported_param(request, queryset, 'protocol', 'protocol_name')
+        if protocols:
+            queryset = queryset.filter(protocol_name__in=protocols.split(','))
+
+        mac_address = request.query_params.get('mac_address')
+        if mac_address:
+            # Devices store their MAC address normalized, the registry view included.
+            normalized = normalize_mac_address(mac_address)
+            if normalized is None:
+                raise ValidationError({'mac_address': ["Enter a valid MAC address."]})
+            queryset = queryset.filter(mac_address=normalized)
+
+        return queryset
+
+
+class RoomFilter(filters.BaseFilterBackend):
+    """
+    Filter rooms by `?name=<prefix>` and, for staff users, who see every room,
+    by `?owner=<id>`. Several owners can be given comma-separated.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        owners = id_list_param(request, 'owner')
+        if owners is not None:
+            queryset = queryset.filter(owner_id__in=owners)
+
+        return filter_name_prefix(request, queryset)
+
+
+class ValidatedOrderingFilter(filters.OrderingFilter):
+    """
+    `?ordering=` rejecting the fields the view does not allow, instead of ignoring them.
+    """
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        valid = super().remove_invalid_fields(queryset, fields, view, request)
+        if len(valid) != len([field for field in fields if field]):
+            allowed = ', '.join(name for name, _ in self.get_valid_fields(queryset, view, {'request': request}))
+            raise ValidationError({self.ordering_param: [f"Unknown ordering field, expected one of: {allowed}."]})
+        return valid
@@ -0,0 +1,202 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DeviceKind, DeviceState, DEVICE_MODELS, VALUE_MODELS
+from .rollups import update_rollups
+from .signals import values_changed, values_recorded
+from .state import refresh_current_state, touch_current_state, update_current_state
+
+BULK_BATCH_SIZE = 500
+
+
+def record_values(kind, values):
+    """
+    Bookkeeping that has to happen in the same transaction as every write of
+    new value rows, however they were inserted. Sends `values_recorded` once
+    the transaction committed.
+    """
+    update_current_state(kind, values)
+
+    if kind == DeviceKind.ANALOG:
+        update_rollups(values)
+
+    transaction.on_commit(lambda: values_recorded.send(sender=VALUE_MODELS[kind], kind=kind, values=values))
+
+
+def refresh_values(kind, device_ids):
+    """
+    Bookkeeping after existing value rows of the given devices were changed or
+    deleted. Sends `values_changed` once the transaction committed.
+    """
+    device_ids = set(device_ids)
+    refresh_current_state(kind, device_ids)
+    transaction.on_commit(lambda: values_changed.send(sender=VALUE_MODELS[kind], kind=kind, device_ids=device_ids))
+
+
+def stores_changes_only(kind):
+    """
+    Whether readings of the given kind are only stored when they change the
+    device's state, per the `SMART_HOME_CHANGE_ONLY_KINDS` setting.
+    """
+    return kind in getattr(settings, 'SMART_HOME_CHANGE_ONLY_KINDS', ())
+
+
+def split_repeats(kind, values):
+    """
+    Split unsaved value rows into the ones changing the state of their device,
+    given its current state and the earlier rows in `values`, and the ones
+    repeating it. Readings older than the current state are kept as changes,
+    since whether they repeated the state back then is not known.
+    """
+    current_states = DeviceState.objects.filter(kind=kind, device_id__in={value.device_id for value in values})
+    states = {device_id: (value, updated_at)
+              for device_id, value, updated_at in current_states.values_list('device_id', 'value', 'updated_at')}
+
+    changes, repeats = [], []
+    for value in sorted(values, key=lambda value: (value.device_id, value.timestamp)):
+        current = states.get(value.device_id)
+        if current is not None and value.timestamp >= current[1] and value.value == current[0]:
+            repeats.append(value)
+        else:
+            changes.append(value)
+            if current is None or value.timestamp >= current[1]:
+                states[value.device_id] = (value.value, value.timestamp)
+
+    return changes, repeats
+
+
+def store_values(kind, values, batch_size=BULK_BATCH_SIZE, changes_only=None):
+    """
+    Insert unsaved value rows of one kind with bulk INSERTs of `batch_size` rows.
+    With `changes_only`, which defaults to `stores_changes_only(kind)`, rows
+    repeating their device's state only update its last seen time.
+    Returns the stored rows.
+    """
+    if changes_only is None:
+        changes_only = stores_changes_only(kind)
+
+    with transaction.atomic():
+        if changes_only:
+            values, repeats = split_repeats(kind, values)
+            touch_current_state(kind, repeats)
+
+        VALUE_MODELS[kind].objects.bulk_create(values, batch_size=batch_size)
+        record_values(kind, values)
+
+    return values
+
+
+def parse_kind(kind):
+    try:
+        return DeviceKind(str(kind).lower())
+    except ValueError:
+        raise ValidationError(f"Unknown device type {kind!r}, expected one of: {', '.join(DeviceKind.values)}.")
+
+
+def clean_value(kind, value):
+    return VALUE_MODELS[kind]._meta.get_field('value').clean(value, None)
+
+
+def clean_timestamp(timestamp):
+    """
+    Parse the optional ISO 8601 time a reading was taken at, defaulting to now.
+    Binary request formats may give it as a datetime already.
+    """
+    if timestamp is None:
+        return timezone.now()
+
+    if isinstance(timestamp, datetime):
+        parsed = timestamp
+    else:
+        parsed = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+    if parsed is None:
+        raise ValidationError("Enter a valid ISO 8601 date/time.")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def ingest_readings(user, readings, batch_size=BULK_BATCH_SIZE):
+    """
+    Validate and store a batch of mixed readings of the form
+    `{'type': 'analog', 'device': 1, 'value': 21.5, 'timestamp': '2023-11-04T14:09:00Z'}`,
+    where the timestamp is optional.
+
+    Ownership is checked against the device ids the user may write to, fetched
+    with one query per device kind. Invalid readings are skipped and reported;
+    the valid ones are stored. Returns a `(created, unchanged, errors)` tuple
+    where `created` counts the stored readings per kind, `unchanged` the valid
+    readings not stored because they repeated the state of their device, and
+    `errors` lists `{'index', 'errors'}` entries for the rejected ones.
+    """
+    errors = []
+    parsed = []
+
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            errors.append({'index': index, 'errors': {'non_field_errors': ["Expected an object."]}})
+            continue
+
+        item_errors = {}
+        kind = device_id = value = timestamp = None
+
+        try:
+            kind = parse_kind(reading.get('type'))
+        except ValidationError as e:
+            item_errors['type'] = e.messages
+
+        try:
+            device_id = int(reading.get('device'))
+        except (TypeError, ValueError):
+            item_errors['device'] = ["A valid device id is required."]
+
+        if kind is not None:
+            try:
+                value = clean_value(kind, reading.get('value'))
+            except ValidationError as e:
+                item_errors['value'] = e.messages
+
+        try:
+            timestamp = clean_timestamp(reading.get('timestamp'))
+        except ValidationError as e:
+            item_errors['timestamp'] = e.messages
+
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            parsed.append((index, kind, device_id, value, timestamp))
+
+    allowed_devices = {}
+    for kind in DeviceKind:
+        device_ids = {device_id for _, reading_kind, device_id, _, _ in parsed if reading_kind == kind}
+        if not device_ids:
+            continue
+
+        devices = DEVICE_MODELS[kind].objects.filter(pk__in=device_ids)
+        if not user.is_staff:
+            devices = devices.filter(room__owner=user)
+        allowed_devices[kind] = set(devices.values_list('pk', flat=True))
+
+    values = {kind: [] for kind in DeviceKind}
+    for index, kind, device_id, value, timestamp in parsed:
+        if device_id in allowed_devices[kind]:
+            values[kind].append(VALUE_MODELS[kind](device_id=device_id, value=value, timestamp=timestamp))
+        else:
+            errors.append({'index': index, 'errors': {
+                'device': ["You cannot create a value for a device in a room you don't own or that does not exist."]
+            }})
+
+    created, unchanged = {}, {}
+    with transaction.atomic():
+        for kind, kind_values in values.items():
+            stored = store_values(kind, kind_values, batch_size=batch_size) if kind_values else []
+            created[kind.value] = len(stored)
+            unchanged[kind.value] = len(kind_values) - len(stored)
+
+    errors.sort(key=lambda error: error['index'])
+    return created, unchanged, errors
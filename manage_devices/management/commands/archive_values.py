@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from manage_devices.ingest import stores_changes_only
+from manage_devices.models import DeviceKind, VALUE_MODELS
+from manage_devices.partitions import archive_month, drop_archive, list_archives, month_bounds
+
+
+def parse_month(value):
+    try:
+        parsed = datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise CommandError(f"Invalid month {value!r}, expected YYYY-MM.")
+    return parsed.year, parsed.month
+
+
+class Command(BaseCommand):
+    help = ("Move readings of whole months into per-month archive tables, list the archives, "
+            "or drop an archived month.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=DeviceKind.values, action='append',
+                            help="Only handle the values of this device kind. Defaults to all kinds.")
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--before', type=parse_month, metavar='YYYY-MM',
+                            help="Archive every month before this one.")
+        action.add_argument('--list', action='store_true', help="List the archived months.")
+        action.add_argument('--drop', type=parse_month, metavar='YYYY-MM', help="Drop the archive of this month.")
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Number of rows moved per transaction.")
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or DeviceKind.values:
+            values_model = VALUE_MODELS[kind]
+            archives = list_archives(values_model)
+
+            if options['list']:
+                for year, month in archives:
+                    self.stdout.write(f"{kind} {year:04d}-{month:02d}")
+
+            elif options['drop']:
+                if options['drop'] in archives:
+                    drop_archive(values_model, *options['drop'])
+                    self.stdout.write(f"Dropped {kind} archive {options['drop'][0]:04d}-{options['drop'][1]:02d}.")
+
+            else:
+                cutoff, _ = month_bounds(*options['before'])
+                oldest = (values_model.objects.filter(timestamp__lt=cutoff).order_by('timestamp')
+                          .values_list('timestamp', flat=True).first())
+                if oldest is None:
+                    continue
+
+                oldest = timezone.localtime(oldest)
+                year, month = oldest.year, oldest.month
+                while (year, month) < options['before']:
+                    moved = archive_month(values_model, year, month, batch_size=options['batch_size'],
+                                          keep_latest=stores_changes_only(kind))
+                    if moved:
+                        self.stdout.write(f"Archived {moved} {kind} values of {year:04d}-{month:02d}.")
+                    year, month = year + month // 12, month % 12 + 1
@@ -0,0 +1,82 @@
+import json
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from manage_devices.benchmark import (SCENARIOS, HttpTransport, InProcessTransport, clear, compare_reports,
+                                      run_benchmark, seed)
+
+
+class Command(BaseCommand):
+    help = ("Seed synthetic users, rooms, devices and values and measure latency percentiles, throughput and query "
+            "counts of the REST API under concurrent load, writing a JSON report. Use a database file or MySQL: "
+            "worker threads do not share an in-memory SQLite database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users to seed.")
+        parser.add_argument('--rooms-per-user', type=int, default=2, help="Number of rooms of every user.")
+        parser.add_argument('--devices-per-room', type=int, default=5,
+                            help="Number of devices of every kind in each room.")
+        parser.add_argument('--values-per-device', type=int, default=100, help="Number of values of every device.")
+        parser.add_argument('--value-interval', type=int, default=60, help="Seconds between two values of a device.")
+        parser.add_argument('--scenario', choices=list(SCENARIOS), action='append',
+                            help="Only run this scenario. Defaults to all of them.")
+        parser.add_argument('--requests', type=int, default=200, help="Number of timed requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Number of concurrent worker threads.")
+        parser.add_argument('--warmup', type=int, default=10, help="Number of untimed requests per scenario.")
+        parser.add_argument('--page-size', type=int, default=100, help="Page size of the value lists.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random data and request choices.")
+        parser.add_argument('--base-url', help="Send the requests over HTTP to the server running at this URL, "
+                                               "using the same database, instead of in-process.")
+        parser.add_argument('--no-seed', action='store_true',
+                            help="Reuse the data seeded by an earlier run with --keep.")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded data after the run.")
+        parser.add_argument('--output', help="Path of the JSON report. Defaults to standard output.")
+        parser.add_argument('--baseline', help="JSON report of an earlier run to check for regressions.")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative latency or throughput change counted as a regression.")
+
+    def handle(self, *args, **options):
+        if not options['no_seed']:
+            clear()
+            created = seed(options['users'], options['rooms_per_user'], options['devices_per_room'],
+                           options['values_per_device'], timedelta(seconds=options['value_interval']),
+                           random_seed=options['seed'])
+            self.stderr.write(f"Seeded {', '.join(f'{count} {name}' for name, count in created.items())}.")
+
+        transport = HttpTransport(options['base_url']) if options['base_url'] else InProcessTransport()
+        # In-process requests all come from one address: the login scenario would only measure its throttle.
+        unthrottled = nullcontext() if options['base_url'] else override_settings(SMART_HOME_AUTH_THROTTLE_RATE=None)
+        try:
+            with unthrottled:
+                report = run_benchmark(transport, options['scenario'] or list(SCENARIOS), options['requests'],
+                                       options['concurrency'], options['warmup'],
+                                       {'page_size': options['page_size']}, options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            if not options['keep']:
+                clear()
+
+        report['scale'] = {name: options[name] for name in
+                           ('users', 'rooms_per_user', 'devices_per_room', 'values_per_device')}
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        for name, result in report['scenarios'].items():
+            latency = result['latency_ms']
+            queries = f", {result['queries']['mean']:.1f} queries" if result['queries'] else ""
+            self.stderr.write(f"{name}: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+                              f"{result['throughput']:.1f} req/s, {result['errors']} errors{queries}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare_reports(report, json.load(baseline), options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stderr.write("No regressions against the baseline.")
@@ -0,0 +1,135 @@
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import msgpack
+import numpy
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from manage_devices.models import Room, AnalogDevice, DigitalDevice, SmartDevice, AnalogValues
+from manage_devices.renderers import ANALOG_BATCH_MEDIA_TYPE, ANALOG_RECORD
+
+ENDPOINTS = ['/analog-devices/', '/digital-devices/', '/smart-devices/', '/analog-values/']
+
+# Media type and client-side decoder of every format.
+FORMATS = {
+    'json': ('application/json', json.loads),
+    'msgpack': ('application/msgpack', msgpack.unpackb),
+    'packed': (ANALOG_BATCH_MEDIA_TYPE, lambda content: numpy.frombuffer(content, dtype=ANALOG_RECORD)),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def milliseconds(seconds):
+    return f'{seconds * 1000:.1f} ms'
+
+
+class Command(BaseCommand):
+    help = ("Compare the payload size and latency of JSON, MessagePack and packed analog batches, for the device and "
+            "value list endpoints and for bulk ingest, on synthetic data created in a transaction that is rolled back "
+            "afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=500, help="Number of devices of each kind.")
+        parser.add_argument('--page-size', type=int, default=500, help="Page size of the value lists.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of readings per bulk request.")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of timed requests per endpoint and format.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = self.seed(options['devices'], options['page_size'])
+                # localhost is an allowed host without any ALLOWED_HOSTS configured.
+                client = APIClient(SERVER_NAME='localhost')
+                client.force_authenticate(user)
+                self.benchmark_lists(client, options['page_size'], options['repeat'])
+                self.benchmark_ingest(client, options['batch_size'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, devices, values):
+        user = User.objects.create_user(username='benchmark-formats', is_staff=True)
+        room = Room.objects.create(name='Benchmark', owner=user)
+        for number, model in enumerate((AnalogDevice, DigitalDevice, SmartDevice)):
+            model.objects.bulk_create(
+                model(name=f'{model.__name__} {i}', room=room, active=True,
+                      mac_address=':'.join(f'{byte:02x}' for byte in (2, number, *(i * 4 + 3).to_bytes(4, 'big'))),
+                      ip=f'10.{number}.{i // 256 % 256}.{i % 256}')
+                for i in range(devices)
+            )
+
+        now = timezone.now()
+        analog = AnalogDevice.objects.filter(room=room).first()
+        AnalogValues.objects.bulk_create(AnalogValues(device=analog, value=i, timestamp=now - timedelta(seconds=i))
+                                         for i in range(values))
+        return user
+
+    def time_requests(self, send, repeat):
+        """
+        Median latency of `send(iteration)` over `repeat` timed calls after an untimed first
+        one, and the last response.
+        """
+        send(0)
+        samples = []
+        for iteration in range(1, repeat + 1):
+            started = time.perf_counter()
+            response = send(iteration)
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples), response
+
+    def benchmark_lists(self, client, page_size, repeat):
+        for url in ENDPOINTS:
+            params = {'page_size': page_size} if 'values' in url else {}
+            formats = FORMATS if url == '/analog-values/' else ['json', 'msgpack']
+            results = []
+            for name in formats:
+                media_type, decode = FORMATS[name]
+                latency, response = self.time_requests(
+                    lambda iteration: client.get(url, params, HTTP_ACCEPT=media_type), repeat)
+                started = time.perf_counter()
+                decode(response.content)
+                results.append(f"{name} {len(response.content)} B, {milliseconds(latency)} "
+                               f"+ {milliseconds(time.perf_counter() - started)} to decode")
+            self.stdout.write(f"GET {url}: {'; '.join(results)}")
+
+    def benchmark_ingest(self, client, batch_size, repeat):
+        device = AnalogDevice.objects.filter(room__owner__username='benchmark-formats').first()
+        start = timezone.now().timestamp()
+
+        def readings(iteration):
+            # Every batch continues the previous one, so none of its values are dropped as unchanged.
+            offset = (iteration + 1) * batch_size
+            return [(device.id, start + offset + i, float(offset + i)) for i in range(batch_size)]
+
+        bodies = {
+            'json': lambda iteration: json.dumps([
+                {'type': 'analog', 'device': device_id, 'value': value,
+                 'timestamp': datetime.fromtimestamp(taken_at, tz=dt_timezone.utc).isoformat()}
+                for device_id, taken_at, value in readings(iteration)]).encode(),
+            'msgpack': lambda iteration: msgpack.packb([
+                {'type': 'analog', 'device': device_id, 'value': value,
+                 'timestamp': datetime.fromtimestamp(taken_at, tz=dt_timezone.utc)}
+                for device_id, taken_at, value in readings(iteration)], datetime=True),
+            'packed': lambda iteration: numpy.array(readings(iteration), dtype=ANALOG_RECORD).tobytes(),
+        }
+
+        results = []
+        for number, (name, body) in enumerate(bodies.items()):
+            media_type = FORMATS[name][0]
+            # Payloads are encoded ahead of the timed requests; every format posts batches of its own.
+            payloads = [body(number * (repeat + 1) + iteration) for iteration in range(repeat + 1)]
+            latency, response = self.time_requests(
+                lambda iteration: client.post('/values/bulk/', payloads[iteration], content_type=media_type), repeat)
+            if response.status_code != 201:
+                self.stderr.write(f"{name} ingest failed with {response.status_code}: {response.content[:200]}")
+            results.append(f"{name} {len(payloads[-1])} B, {milliseconds(latency)}")
+        self.stdout.write(f"POST /values/bulk/ ({batch_size} readings): {'; '.join(results)}")
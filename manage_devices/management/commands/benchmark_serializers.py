@@ -0,0 +1,79 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from manage_devices.models import Room, AnalogDevice, DigitalDevice, SmartDevice, AnalogValues, DigitalValues
+
+ENDPOINTS = ['/analog-devices/', '/digital-devices/', '/smart-devices/', '/analog-values/', '/digital-values/']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Compare the latency of the device and value list endpoints through their serializers and through the "
+            "?fast=1 path, on synthetic data created in a transaction that is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=500, help="Number of devices of each kind.")
+        parser.add_argument('--page-size', type=int, default=500, help="Page size of the value lists.")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of timed requests per endpoint and path.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = self.seed(options['devices'], options['page_size'])
+                self.benchmark(user, options['page_size'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, devices, values):
+        user = User.objects.create_user(username='benchmark-serializers', is_staff=True)
+        room = Room.objects.create(name='Benchmark', owner=user)
+        for number, model in enumerate((AnalogDevice, DigitalDevice, SmartDevice)):
+            model.objects.bulk_create(
+                model(name=f'{model.__name__} {i}', room=room, active=True,
+                      mac_address=':'.join(f'{byte:02x}' for byte in (2, number, *(i * 4 + 3).to_bytes(4, 'big'))),
+                      ip=f'10.{number}.{i // 256 % 256}.{i % 256}')
+                for i in range(devices)
+            )
+
+        now = timezone.now()
+        analog, digital = AnalogDevice.objects.filter(room=room).first(), DigitalDevice.objects.filter(room=room).first()
+        AnalogValues.objects.bulk_create(AnalogValues(device=analog, value=i, timestamp=now - timedelta(seconds=i))
+                                         for i in range(values))
+        DigitalValues.objects.bulk_create(DigitalValues(device=digital, value=i % 2,
+                                                        timestamp=now - timedelta(seconds=i)) for i in range(values))
+        return user
+
+    def benchmark(self, user, page_size, repeat):
+        # localhost is an allowed host without any ALLOWED_HOSTS configured.
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+
+        for url in ENDPOINTS:
+            params = {'page_size': page_size} if 'values' in url else {}
+            timings = {}
+            for path, extra in (('serializer', {}), ('fast', {'fast': '1'})):
+                client.get(url, {**params, **extra})
+                samples = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    response = client.get(url, {**params, **extra})
+                    samples.append(time.perf_counter() - started)
+                timings[path] = statistics.median(samples)
+                rows = json.loads(response.content)
+                rows = len(rows['results'] if isinstance(rows, dict) else rows)
+
+            self.stdout.write(f"{url} ({rows} rows): serializer {timings['serializer'] * 1000:.1f} ms, "
+                              f"fast {timings['fast'] * 1000:.1f} ms, "
+                              f"{timings['serializer'] / timings['fast']:.1f}x faster")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from manage_devices.models import DeviceKind
+from manage_devices.retention import compact_values
+
+
+class Command(BaseCommand):
+    help = ("Delete value history and analog rollups that expired under the retention policies, "
+            "in short transactions, and report the rows and bytes reclaimed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=DeviceKind.values, action='append',
+                            help="Only handle the values of this device kind. Defaults to all kinds.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Number of rows deleted per transaction.")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between chunks, to throttle the load on the database.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted.")
+
+    def handle(self, *args, **options):
+        report = compact_values(options['kind'] or DeviceKind.values, batch_size=options['batch_size'],
+                                pause=options['pause'], dry_run=options['dry_run'])
+
+        verb = "Would reclaim" if options['dry_run'] else "Reclaimed"
+        for reclaimed in report:
+            if reclaimed['rows'] or reclaimed['dropped']:
+                note = " (table dropped)" if reclaimed['dropped'] else ""
+                self.stdout.write(f"{verb} {reclaimed['rows']} rows, ~{reclaimed['bytes']} bytes "
+                                  f"from {reclaimed['table']}{note}.")
+
+        rows = sum(reclaimed['rows'] for reclaimed in report)
+        size = sum(reclaimed['bytes'] for reclaimed in report)
+        self.stdout.write(f"{verb} {rows} rows, ~{size} bytes in total.")
@@ -0,0 +1,47 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from manage_devices.export import export_formats, export_values
+from manage_devices.ingest import clean_timestamp
+from manage_devices.models import DeviceKind, VALUE_MODELS
+
+
+class Command(BaseCommand):
+    help = ("Export the value history of a device or room to a columnar file: Parquet or Arrow IPC when pyarrow "
+            "is installed, otherwise a compressed NumPy .npz archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=DeviceKind.values, required=True,
+                            help="Device kind of the exported values.")
+        selection = parser.add_mutually_exclusive_group(required=True)
+        selection.add_argument('--device', type=int, help="Export the values of this device.")
+        selection.add_argument('--room', type=int, help="Export the values of every device in this room.")
+        parser.add_argument('--start', help="Only export values taken at or after this ISO 8601 date/time.")
+        parser.add_argument('--end', help="Only export values taken before this ISO 8601 date/time.")
+        parser.add_argument('--format', dest='file_format', choices=['parquet', 'arrow', 'npz'],
+                            help="File format. Defaults to Parquet if available, otherwise npz.")
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Number of rows read per query.")
+        parser.add_argument('output', help="Path of the file to write.")
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or export_formats()[0]
+        if file_format not in export_formats():
+            raise CommandError(f"The {file_format} format requires pyarrow to be installed.")
+
+        values = VALUE_MODELS[options['kind']].objects.all()
+        if options['device'] is not None:
+            values = values.filter(device_id=options['device'])
+        else:
+            values = values.filter(device__room_id=options['room'])
+
+        for name, lookup in (('start', 'timestamp__gte'), ('end', 'timestamp__lt')):
+            if options[name]:
+                try:
+                    values = values.filter(**{lookup: clean_timestamp(options[name])})
+                except ValidationError:
+                    raise CommandError(f"Invalid {name} {options[name]!r}, expected an ISO 8601 date/time.")
+
+        with open(options['output'], 'wb') as output:
+            rows = export_values(values, options['kind'], file_format, output, chunk_size=options['chunk_size'])
+
+        self.stdout.write(f"Exported {rows} {options['kind']} values to {options['output']} ({file_format}).")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from manage_devices.models import DeviceKind
+from manage_devices.state import rebuild_current_state
+
+
+class Command(BaseCommand):
+    help = "Rebuild the current state of every device from the analog, digital and smart value tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of devices whose state is rebuilt per query.")
+
+    def handle(self, *args, **options):
+        for kind in DeviceKind:
+            count = rebuild_current_state(kind, batch_size=options['batch_size'])
+            self.stdout.write(f"Rebuilt state of {count} {kind.label.lower()} devices.")
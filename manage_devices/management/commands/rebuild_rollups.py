@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from manage_devices.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the minute, hour and day rollups of analog values from the raw value history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int, action='append',
+                            help="Only rebuild the rollups of this analog device. Defaults to all devices.")
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Number of values read per query.")
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups(options['device'], batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt {count} rollups.")
@@ -0,0 +1,47 @@
+import paho.mqtt.client as mqtt
+from django.core.management.base import BaseCommand, CommandError
+
+from manage_devices.models import Settings
+from manage_devices.mqtt import MqttIngestWorker, TOPIC_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Subscribe to the MQTT broker and store the readings devices publish under their MAC address topics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help="Broker address. Defaults to the broker_ip from the settings table.")
+        parser.add_argument('--port', type=int, default=1883)
+        parser.add_argument('--topic-prefix', default=TOPIC_PREFIX,
+                            help="Readings are expected on <topic-prefix>/<mac_address>.")
+        parser.add_argument('--client-id', default='smart-home-ingest')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Flush when this many readings are buffered.")
+        parser.add_argument('--flush-interval', type=float, default=1.0,
+                            help="Flush buffered readings at least every this many seconds.")
+        parser.add_argument('--max-pending', type=int, default=5000,
+                            help="Stop reading from the broker until buffered readings are stored past this size.")
+
+    def handle(self, *args, **options):
+        host = options['host']
+        if host is None:
+            settings = Settings.objects.first()
+            if settings is None:
+                raise CommandError("No broker configured, pass --host or add a Settings row with a broker_ip.")
+            host = settings.broker_ip
+
+        # A persistent session lets the broker queue QoS 1 readings while the worker reconnects.
+        client = mqtt.Client(client_id=options['client_id'], clean_session=False)
+        worker = MqttIngestWorker(client, host, port=options['port'], topic_prefix=options['topic_prefix'],
+                                  batch_size=options['batch_size'], flush_interval=options['flush_interval'],
+                                  max_pending=options['max_pending'])
+
+        self.stdout.write(f"Ingesting readings from {host}:{options['port']} on {worker.topic}")
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+
+        stats = worker.stats
+        self.stdout.write(f"Stored {stats['stored']} of {stats['received']} readings "
+                          f"({stats['unchanged']} unchanged, {stats['rejected']} rejected, "
+                          f"{stats['dropped']} dropped).")
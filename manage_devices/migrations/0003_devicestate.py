@@ -0,0 +1,44 @@
+# Generated by Django 4.2.6 on 2026-10-18 15:55
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def populate_device_state(apps, schema_editor):
+    DeviceState = apps.get_model('manage_devices', 'DeviceState')
+    now = timezone.now()
+
+    for kind, values_model_name in (('analog', 'AnalogValues'), ('digital', 'DigitalValues'), ('smart', 'SmartValues')):
+        values_model = apps.get_model('manage_devices', values_model_name)
+        latest_ids = values_model.objects.values('device_id').annotate(latest_id=Max('id')).values('latest_id')
+        DeviceState.objects.bulk_create(
+            (DeviceState(kind=kind, device_id=value.device_id, value=value.value, updated_at=now)
+             for value in values_model.objects.filter(id__in=latest_ids).iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0002_analogdevice_active_digitaldevice_active_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('analog', 'Analog'), ('digital', 'Digital'), ('smart', 'Smart')], max_length=10)),
+                ('device_id', models.BigIntegerField()),
+                ('value', models.JSONField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='devicestate',
+            constraint=models.UniqueConstraint(fields=('kind', 'device_id'), name='unique_device_state'),
+        ),
+        migrations.RunPython(populate_device_state, migrations.RunPython.noop),
+    ]
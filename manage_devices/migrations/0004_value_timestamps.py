@@ -0,0 +1,88 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+VALUE_MODELS = ('analogvalues', 'digitalvalues', 'smartvalues')
+
+
+def backfill_timestamps(apps, schema_editor):
+    """
+    Readings stored before this migration have no recorded time. They are all
+    stamped with the migration time, in id ranges so no single UPDATE locks a
+    whole table; ties on the timestamp are broken by id as before.
+    """
+    now = django.utils.timezone.now()
+    batch_size = 10000
+
+    for model_name in VALUE_MODELS:
+        model = apps.get_model('manage_devices', model_name)
+        last_id = model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        for start in range(0, last_id, batch_size):
+            model.objects.filter(id__gt=start, id__lte=start + batch_size, timestamp__isnull=True).update(timestamp=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0003_devicestate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analogvalues',
+            name='timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='digitalvalues',
+            name='timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='smartvalues',
+            name='timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_timestamps, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='analogvalues',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='digitalvalues',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='smartvalues',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='analogvalues',
+            index=models.Index(fields=['device', 'timestamp'], name='analog_values_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analogvalues',
+            index=models.Index(fields=['timestamp'], name='analog_values_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='digitalvalues',
+            index=models.Index(fields=['device', 'timestamp'], name='digital_values_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='digitalvalues',
+            index=models.Index(fields=['timestamp'], name='digital_values_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartvalues',
+            index=models.Index(fields=['device', 'timestamp'], name='smart_values_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartvalues',
+            index=models.Index(fields=['timestamp'], name='smart_values_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0004_value_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, '1 minute'), (3600, '1 hour'), (86400, '1 day')])),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('sum', models.FloatField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('last', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='manage_devices.analogdevice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='analogrollup',
+            constraint=models.UniqueConstraint(fields=('device', 'resolution', 'bucket'), name='unique_analog_rollup'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+# One row per device of every kind. Ids are interleaved by kind so they stay
+# unique across the three tables without a separate sequence. Migrations
+# altering the device tables drop the view first and recreate it afterwards.
+CREATE_VIEW = """
+CREATE VIEW manage_devices_device AS
+SELECT id * 3 AS id, 'analog' AS kind, id AS device_id, NULL AS protocol_name,
+       mac_address, name, ip, room_id, active
+FROM manage_devices_analogdevice
+UNION ALL
+SELECT id * 3 + 1, 'digital', id, NULL, mac_address, name, ip, room_id, active
+FROM manage_devices_digitaldevice
+UNION ALL
+SELECT id * 3 + 2, 'smart', id, protocol_name, mac_address, name, ip, room_id, active
+FROM manage_devices_smartdevice
+"""
+
+DROP_VIEW = "DROP VIEW IF EXISTS manage_devices_device"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0005_analogrollup'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('analog', 'Analog'), ('digital', 'Digital'), ('smart', 'Smart')], max_length=10)),
+                ('device_id', models.BigIntegerField()),
+                ('protocol_name', models.CharField(max_length=100, null=True)),
+                ('mac_address', models.CharField(max_length=17)),
+                ('name', models.CharField(max_length=100)),
+                ('ip', models.GenericIPAddressField()),
+                ('active', models.BooleanField()),
+                ('room', models.ForeignKey(db_constraint=False, on_delete=models.deletion.DO_NOTHING, related_name='devices', to='manage_devices.room')),
+            ],
+            options={
+                'db_table': 'manage_devices_device',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:12
+
+from importlib import import_module
+
+from django.db import migrations, models
+import manage_devices.fields
+
+device_registry = import_module('manage_devices.migrations.0006_device_registry')
+
+DEVICE_MODELS = ('analogdevice', 'digitaldevice', 'smartdevice')
+
+
+def placeholder_mac_address(kind_index, device_id):
+    # Locally administered addresses (second-lowest bit of the first octet set) are never assigned to hardware.
+    octets = [0x02, kind_index] + [(device_id >> shift) & 0xff for shift in (24, 16, 8, 0)]
+    return ':'.join(f'{octet:02x}' for octet in octets)
+
+
+def normalize_mac_addresses(apps, schema_editor):
+    """
+    Store every MAC address in canonical form before it becomes unique. Devices
+    whose MAC address is invalid or already taken by an earlier device of the
+    same kind get a placeholder address, to be corrected by their owners.
+    """
+    for kind_index, model_name in enumerate(DEVICE_MODELS):
+        model = apps.get_model('manage_devices', model_name)
+        seen = set()
+
+        for device_id, mac_address in model.objects.order_by('id').values_list('id', 'mac_address').iterator():
+            normalized = manage_devices.fields.normalize_mac_address(mac_address)
+            if normalized is None or normalized in seen:
+                normalized = placeholder_mac_address(kind_index, device_id)
+            seen.add(normalized)
+
+            if normalized != mac_address:
+                model.objects.filter(id=device_id).update(mac_address=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0006_device_registry'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_mac_addresses, migrations.RunPython.noop),
+        # SQLite rebuilds altered tables, which breaks views over them.
+        migrations.RunSQL(device_registry.DROP_VIEW, device_registry.CREATE_VIEW),
+        migrations.AlterField(
+            model_name='analogdevice',
+            name='ip',
+            field=models.GenericIPAddressField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='analogdevice',
+            name='mac_address',
+            field=manage_devices.fields.MacAddressField(max_length=17, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='digitaldevice',
+            name='ip',
+            field=models.GenericIPAddressField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='digitaldevice',
+            name='mac_address',
+            field=manage_devices.fields.MacAddressField(max_length=17, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='smartdevice',
+            name='ip',
+            field=models.GenericIPAddressField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='smartdevice',
+            name='mac_address',
+            field=manage_devices.fields.MacAddressField(max_length=17, unique=True),
+        ),
+        migrations.RunSQL(device_registry.CREATE_VIEW, device_registry.DROP_VIEW),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0007_device_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(blank=True, choices=[('analog', 'Analog'), ('digital', 'Digital'), ('smart', 'Smart')], max_length=10, null=True)),
+                ('raw_retention', models.DurationField(blank=True, null=True)),
+                ('rollup_retention', models.DurationField(blank=True, null=True)),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policies', to='manage_devices.room')),
+            ],
+            options={
+                'verbose_name_plural': 'retention policies',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='retentionpolicy',
+            constraint=models.UniqueConstraint(fields=('kind', 'room'), name='unique_retention_policy'),
+        ),
+    ]
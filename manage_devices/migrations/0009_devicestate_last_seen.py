@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:17
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_seen(apps, schema_editor):
+    DeviceState = apps.get_model('manage_devices', 'DeviceState')
+    DeviceState.objects.update(last_seen=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0008_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicestate',
+            name='last_seen',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_devices', '0009_devicestate_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analogdevice',
+            index=models.Index(fields=['room', 'active'], name='analog_device_room_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analogdevice',
+            index=models.Index(fields=['room', 'name'], name='analog_device_room_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='digitaldevice',
+            index=models.Index(fields=['room', 'active'], name='digital_device_room_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='digitaldevice',
+            index=models.Index(fields=['room', 'name'], name='digital_device_room_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['owner', 'name'], name='room_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartdevice',
+            index=models.Index(fields=['room', 'active'], name='smart_device_room_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartdevice',
+            index=models.Index(fields=['room', 'name'], name='smart_device_room_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartdevice',
+            index=models.Index(fields=['protocol_name'], name='smart_device_protocol_idx'),
+        ),
+    ]
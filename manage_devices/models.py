@@ -1,45 +1,78 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .fields import MacAddressField
+
+
+class DeviceKind(models.TextChoices):
+    ANALOG = 'analog', 'Analog'
+    DIGITAL = 'digital', 'Digital'
+    SMART = 'smart', 'Smart'
 
 
 class Room(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'name'], name='room_owner_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class AnalogDevice(models.Model):
-    mac_address = models.CharField(max_length=17)
+    mac_address = MacAddressField(unique=True)
     name = models.CharField(max_length=100)
-    ip = models.GenericIPAddressField()
+    ip = models.GenericIPAddressField(db_index=True)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='analog_devices')
     active = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'active'], name='analog_device_room_active_idx'),
+            models.Index(fields=['room', 'name'], name='analog_device_room_name_idx'),
+        ]
+
     def __str__(self):
         return f"Analog Device for {self.name}"
 
 
 class DigitalDevice(models.Model):
-    mac_address = models.CharField(max_length=17)
+    mac_address = MacAddressField(unique=True)
     name = models.CharField(max_length=100)
-    ip = models.GenericIPAddressField()
+    ip = models.GenericIPAddressField(db_index=True)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='digital_devices')
     active = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'active'], name='digital_device_room_active_idx'),
+            models.Index(fields=['room', 'name'], name='digital_device_room_name_idx'),
+        ]
+
     def __str__(self):
         return f"Digital Device for {self.name}"
 
 
 class SmartDevice(models.Model):
     protocol_name = models.CharField(max_length=100)
-    mac_address = models.CharField(max_length=17)
+    mac_address = MacAddressField(unique=True)
     name = models.CharField(max_length=100)
-    ip = models.GenericIPAddressField()
+    ip = models.GenericIPAddressField(db_index=True)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='smart_devices')
     active = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'active'], name='smart_device_room_active_idx'),
+            models.Index(fields=['room', 'name'], name='smart_device_room_name_idx'),
+            models.Index(fields=['protocol_name'], name='smart_device_protocol_idx'),
+        ]
+
     def __str__(self):
         return f"Smart Device for {self.name}"
 
@@ -47,6 +80,13 @@ class SmartDevice(models.Model):
 class AnalogValues(models.Model):
     device = models.ForeignKey('AnalogDevice', on_delete=models.CASCADE)
     value = models.FloatField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['device', 'timestamp'], name='analog_values_device_ts_idx'),
+            models.Index(fields=['timestamp'], name='analog_values_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.name} - Analog Value: {self.value}"
@@ -55,6 +95,13 @@ class AnalogValues(models.Model):
 class DigitalValues(models.Model):
     device = models.ForeignKey('DigitalDevice', on_delete=models.CASCADE)
     value = models.BooleanField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['device', 'timestamp'], name='digital_values_device_ts_idx'),
+            models.Index(fields=['timestamp'], name='digital_values_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.name} - Digital Value: {self.value}"
@@ -63,13 +110,149 @@ class DigitalValues(models.Model):
 class SmartValues(models.Model):
     device = models.ForeignKey('SmartDevice', on_delete=models.CASCADE)
     value = models.CharField(max_length=255)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['device', 'timestamp'], name='smart_values_device_ts_idx'),
+            models.Index(fields=['timestamp'], name='smart_values_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.name} - Smart Value: {self.value}"
 
 
+class AnalogRollup(models.Model):
+    """
+    Aggregate of the analog values of a device within one time bucket, kept up to
+    date as values are ingested so charts never have to read the raw history.
+    """
+
+    class Resolution(models.IntegerChoices):
+        MINUTE = 60, '1 minute'
+        HOUR = 3600, '1 hour'
+        DAY = 86400, '1 day'
+
+    device = models.ForeignKey('AnalogDevice', on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.PositiveIntegerField(choices=Resolution.choices)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    sum = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+    last = models.FloatField()
+    last_timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'resolution', 'bucket'], name='unique_analog_rollup'),
+        ]
+
+    @property
+    def avg(self):
+        return self.sum / self.count
+
+    def __str__(self):
+        return f"{self.device.name} - {self.get_resolution_display()} Rollup at {self.bucket}"
+
+
+class DeviceState(models.Model):
+    """
+    Current state of a device: a denormalized copy of its latest value row,
+    kept up to date on every write so reads never have to scan the value history.
+    """
+    kind = models.CharField(max_length=10, choices=DeviceKind.choices)
+    device_id = models.BigIntegerField()
+    value = models.JSONField()
+    updated_at = models.DateTimeField()
+    # Time of the latest reading, also of readings repeating the state that were not stored.
+    last_seen = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'device_id'], name='unique_device_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} Device {self.device_id} - State: {self.value}"
+
+
+class RetentionPolicy(models.Model):
+    """
+    How long the value history is kept, for one device kind and/or room. The
+    most specific policy applies: kind and room, then room, then kind, then the
+    policy without either. A retention of None keeps data forever.
+    """
+    kind = models.CharField(max_length=10, choices=DeviceKind.choices, null=True, blank=True)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, null=True, blank=True, related_name='retention_policies')
+    raw_retention = models.DurationField(null=True, blank=True)
+    rollup_retention = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'room'], name='unique_retention_policy'),
+        ]
+        verbose_name_plural = 'retention policies'
+
+    @property
+    def specificity(self):
+        return (self.room_id is not None, self.kind is not None)
+
+    def __str__(self):
+        return (f"Retention for {self.get_kind_display() if self.kind else 'all'} devices in "
+                f"{self.room if self.room_id else 'all rooms'}: "
+                f"raw {self.raw_retention}, rollups {self.rollup_retention}")
+
+
+class Device(models.Model):
+    """
+    Read-only registry of the devices of every kind, backed by a database view
+    over the analog, digital and smart device tables (see migration 0006), so
+    cross-kind queries filter, sort and paginate in a single SQL query.
+    `id` is unique across kinds; `device_id` is the id in the table of `kind`.
+    """
+    KIND_OFFSETS = {DeviceKind.ANALOG: 0, DeviceKind.DIGITAL: 1, DeviceKind.SMART: 2}
+
+    id = models.BigIntegerField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=DeviceKind.choices)
+    device_id = models.BigIntegerField()
+    protocol_name = models.CharField(max_length=100, null=True)
+    mac_address = models.CharField(max_length=17)
+    name = models.CharField(max_length=100)
+    ip = models.GenericIPAddressField()
+    room = models.ForeignKey(Room, on_delete=models.DO_NOTHING, related_name='devices', db_constraint=False)
+    active = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'manage_devices_device'
+
+    @classmethod
+    def registry_id(cls, kind, device_id):
+        return device_id * len(cls.KIND_OFFSETS) + cls.KIND_OFFSETS[kind]
+
+    def get_device(self):
+        return DEVICE_MODELS[self.kind].objects.get(pk=self.device_id)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} Device {self.name}"
+
+
 class Settings(models.Model):
     broker_ip = models.GenericIPAddressField()
 
     def __str__(self):
         return f"Settings for Broker: {self.broker_ip}"
+
+
+DEVICE_MODELS = {
+    DeviceKind.ANALOG: AnalogDevice,
+    DeviceKind.DIGITAL: DigitalDevice,
+    DeviceKind.SMART: SmartDevice,
+}
+
+VALUE_MODELS = {
+    DeviceKind.ANALOG: AnalogValues,
+    DeviceKind.DIGITAL: DigitalValues,
+    DeviceKind.SMART: SmartValues,
+}
@@ -0,0 +1,281 @@
+import json
+import logging
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, close_old_connections, connection
+
+from .fields import normalize_mac_address
+from .ingest import clean_timestamp, clean_value, parse_kind, store_values
+from .models import DeviceKind, DEVICE_MODELS, VALUE_MODELS
+
+logger = logging.getLogger(__name__)
+
+TOPIC_PREFIX = 'smart_home/devices'
+
+MQTT_ERR_SUCCESS = 0
+
+
+class DeviceDirectory:
+    """
+    Maps MAC addresses to the devices that use them. The whole mapping is loaded
+    with one query per device kind and reloaded when an unknown MAC shows up,
+    at most once every `refresh_interval` seconds.
+    """
+
+    def __init__(self, refresh_interval=30.0, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.devices = {}
+        self.loaded_at = None
+
+    def load(self):
+        devices = {}
+        for kind, model in DEVICE_MODELS.items():
+            for mac_address, device_id in model.objects.values_list('mac_address', 'pk'):
+                devices.setdefault(mac_address, []).append((kind, device_id))
+
+        self.devices = devices
+        self.loaded_at = self.clock()
+
+    def resolve(self, mac_address, kind=None):
+        """
+        Return the `(kind, device_id)` for a MAC address, or None if it is unknown
+        or ambiguous without a device type.
+        """
+        mac_address = normalize_mac_address(mac_address)
+        if mac_address is None:
+            return None
+
+        if mac_address not in self.devices and (
+                self.loaded_at is None or self.clock() - self.loaded_at >= self.refresh_interval):
+            self.load()
+
+        candidates = [device for device in self.devices.get(mac_address, []) if kind is None or device[0] == kind]
+        if len(candidates) != 1:
+            return None
+        return candidates[0]
+
+
+def decode_payload(payload):
+    """
+    Decode a message payload into a `(kind, value, timestamp)` tuple. The payload
+    is either a bare JSON value or an object
+    `{"value": ..., "type": "analog", "timestamp": "2023-11-04T14:09:00Z"}`, where
+    the timestamp is optional and the type is only required when several kinds of
+    devices share a MAC address.
+    """
+    data = json.loads(payload)
+
+    if isinstance(data, dict):
+        kind = parse_kind(data['type']) if data.get('type') is not None else None
+        return kind, data.get('value'), clean_timestamp(data.get('timestamp'))
+
+    return None, data, clean_timestamp(None)
+
+
+class MqttIngestWorker:
+    """
+    Subscribes to `<topic_prefix>/<mac_address>` and stores the readings
+    published there as value rows.
+
+    Readings are buffered in memory and written with bulk inserts when `batch_size`
+    readings are pending or `flush_interval` seconds passed since the last flush.
+    The worker is single threaded: messages are handled inside `client.loop()`, so
+    when `max_pending` readings are buffered it flushes before reading the next
+    message, which in turn makes the broker hold back delivery. Readings that
+    could not be stored because of a database error are put back in front of the
+    pending ones and retried with growing delays, keeping at most `max_pending`.
+
+    `client` is anything with the paho-mqtt `Client` interface used here:
+    `connect`, `reconnect`, `subscribe`, `loop`, `disconnect` and the
+    `on_connect`/`on_message` callbacks.
+    """
+
+    def __init__(self, client, host, port=1883, topic_prefix=TOPIC_PREFIX, batch_size=500, flush_interval=1.0,
+                 max_pending=5000, keepalive=60, max_reconnect_delay=60.0, directory=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.topic_prefix = topic_prefix.rstrip('/')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self.keepalive = keepalive
+        self.max_reconnect_delay = max_reconnect_delay
+        self.directory = directory or DeviceDirectory(clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+
+        self.pending = {kind: [] for kind in DeviceKind}
+        self.pending_count = 0
+        self.last_flush = clock()
+        # Consecutive flushes that failed with a database error.
+        self.failures = 0
+        self.running = False
+        self.stats = {'received': 0, 'stored': 0, 'unchanged': 0, 'rejected': 0, 'retried': 0, 'dropped': 0}
+
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+
+    @property
+    def topic(self):
+        return f'{self.topic_prefix}/+'
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != MQTT_ERR_SUCCESS:
+            logger.warning("MQTT connection to %s:%s refused with code %s", self.host, self.port, rc)
+            return
+
+        # Subscribing here renews the subscription after every reconnect.
+        client.subscribe(self.topic, qos=1)
+        logger.info("Subscribed to %s on %s:%s", self.topic, self.host, self.port)
+
+    def on_message(self, client, userdata, message):
+        self.stats['received'] += 1
+        mac_address = message.topic[len(self.topic_prefix) + 1:]
+
+        try:
+            kind, raw_value, timestamp = decode_payload(message.payload)
+            device = self.directory.resolve(mac_address, kind)
+            if device is None:
+                raise ValidationError(f"No unique device with MAC address {mac_address!r}.")
+            kind, device_id = device
+            value = clean_value(kind, raw_value)
+        except (ValueError, KeyError, ValidationError) as e:
+            self.stats['rejected'] += 1
+            logger.debug("Rejected message on %s: %s", message.topic, e)
+            return
+        except DatabaseError:
+            self.stats['dropped'] += 1
+            logger.exception("Dropped message on %s: the device directory could not be loaded", message.topic)
+            return
+
+        self.pending[kind].append(VALUE_MODELS[kind](device_id=device_id, value=value, timestamp=timestamp))
+        self.pending_count += 1
+
+        if self.pending_count >= self.max_pending:
+            self.flush()
+
+    def flush_if_due(self):
+        if self.failures:
+            # Back off while the database is failing.
+            due = self.clock() - self.last_flush >= min(self.flush_interval * 2 ** self.failures,
+                                                        self.max_reconnect_delay)
+        else:
+            due = self.pending_count >= self.batch_size or self.clock() - self.last_flush >= self.flush_interval
+        if self.pending_count and due:
+            self.flush()
+
+    def flush(self):
+        # The worker outlives requests, which otherwise recycle stale connections,
+        # but a connection is never closed within a transaction of the caller.
+        if not connection.in_atomic_block:
+            close_old_connections()
+
+        pending, self.pending = self.pending, {kind: [] for kind in DeviceKind}
+        self.pending_count = 0
+        self.last_flush = self.clock()
+        failed = False
+
+        for kind, values in pending.items():
+            if not values:
+                continue
+
+            try:
+                # Devices may have been deleted since their MAC address was resolved.
+                existing_ids = set(DEVICE_MODELS[kind].objects.filter(pk__in={value.device_id for value in values})
+                                   .values_list('pk', flat=True))
+                existing = [value for value in values if value.device_id in existing_ids]
+                stored = store_values(kind, existing, batch_size=self.batch_size)
+            except DatabaseError:
+                failed = True
+                logger.exception("Could not store %d %s readings, retrying later", len(values), kind)
+                self.requeue(kind, values)
+            else:
+                self.stats['dropped'] += len(values) - len(existing)
+                self.stats['stored'] += len(stored)
+                self.stats['unchanged'] += len(existing) - len(stored)
+
+        self.failures = self.failures + 1 if failed else 0
+
+    def requeue(self, kind, values):
+        """
+        Put readings that could not be stored back in front of the pending ones,
+        dropping the oldest beyond `max_pending`.
+        """
+        for value in values:
+            # Ids of the rolled back insert.
+            value.pk = None
+
+        excess = self.pending_count + len(values) - self.max_pending
+        if excess > 0:
+            self.stats['dropped'] += excess
+            logger.warning("Dropped %d %s readings waiting to be retried", excess, kind)
+            values = values[excess:]
+
+        self.pending[kind][:0] = values
+        self.pending_count += len(values)
+        self.stats['retried'] += len(values)
+
+    def connect(self):
+        delay = 1.0
+
+        while self.running:
+            try:
+                if self.client.connect(self.host, self.port, self.keepalive) == MQTT_ERR_SUCCESS:
+                    return True
+            except OSError as e:
+                logger.warning("Could not connect to MQTT broker %s:%s: %s", self.host, self.port, e)
+
+            self.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+        return False
+
+    def reconnect(self):
+        delay = 1.0
+
+        while self.running:
+            try:
+                if self.client.reconnect() == MQTT_ERR_SUCCESS:
+                    logger.info("Reconnected to MQTT broker %s:%s", self.host, self.port)
+                    return
+            except OSError as e:
+                logger.warning("Could not reconnect to MQTT broker %s:%s: %s", self.host, self.port, e)
+
+            self.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def run(self, max_iterations=None):
+        """
+        Process messages until `stop()` is called or `max_iterations` network loop
+        iterations passed, then flush whatever is still buffered.
+        """
+        self.running = True
+        iterations = 0
+
+        try:
+            if not self.connect():
+                return
+
+            while self.running and (max_iterations is None or iterations < max_iterations):
+                iterations += 1
+                rc = self.client.loop(timeout=min(self.flush_interval, 1.0))
+                self.flush_if_due()
+
+                if rc != MQTT_ERR_SUCCESS:
+                    logger.warning("Lost connection to MQTT broker %s:%s (code %s)", self.host, self.port, rc)
+                    self.flush()
+                    self.reconnect()
+        finally:
+            self.running = False
+            self.flush()
+            if self.pending_count:
+                self.stats['dropped'] += self.pending_count
+                logger.error("Dropped %d readings that could not be stored before stopping", self.pending_count)
+            self.client.disconnect()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ValuesCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the value endpoints, so a page costs an index range scan
+    no matter how deep into the history it is. Ordered by `-id` unless the request
+    picks one of the view's `ordering_fields` with `?ordering=`.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class DevicePagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
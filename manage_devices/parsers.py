@@ -0,0 +1,53 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+
+import msgpack
+import numpy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .models import DeviceKind
+from .renderers import ANALOG_BATCH_MEDIA_TYPE, ANALOG_RECORD
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack request bodies. Timestamps of the MessagePack timestamp
+    extension type become aware datetimes; dates can also be sent as ISO 8601 strings.
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), timestamp=3)
+        except (ValueError, TypeError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+def epoch_datetime(seconds):
+    try:
+        return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        # Passed on as is, to be reported as an invalid time by the bulk ingest.
+        return seconds
+
+
+class AnalogBatchParser(BaseParser):
+    """
+    Parses a body of packed `ANALOG_RECORD`s into the analog readings of the bulk
+    endpoint. Non-finite values and times are passed on to be reported per reading.
+    """
+    media_type = ANALOG_BATCH_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = stream.read()
+        if len(data) % ANALOG_RECORD.itemsize:
+            raise ParseError(f"Packed analog batch parse error - the body is not a sequence of "
+                             f"{ANALOG_RECORD.itemsize}-byte records.")
+
+        return [{
+            'type': DeviceKind.ANALOG,
+            'device': device,
+            'value': value if math.isfinite(value) else None,
+            'timestamp': epoch_datetime(timestamp),
+        } for device, timestamp, value in numpy.frombuffer(data, dtype=ANALOG_RECORD).tolist()]
@@ -0,0 +1,103 @@
+"""
+Time partitioning of the value history.
+
+Native table partitioning is not an option for the value tables: MySQL does
+not allow foreign keys on partitioned tables and SQLite has no partitioning at
+all. Instead, old readings are moved month by month into archive tables named
+`<value table>_<YYYYMM>`, which can later be dropped as a whole instead of
+deleting their rows one by one.
+"""
+import re
+from datetime import datetime
+
+from django.apps.registry import Apps
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .transitions import superseded
+
+
+def month_bounds(year, month):
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+
+def archive_table_name(values_model, year, month):
+    return f'{values_model._meta.db_table}_{year:04d}{month:02d}'
+
+
+def archive_model(values_model, year, month):
+    """
+    Model for the archive table of a value model for the given month. The device
+    is a plain column, so archived readings can outlive their device.
+    """
+    table = archive_table_name(values_model, year, month)
+    meta = type('Meta', (), {
+        'app_label': values_model._meta.app_label,
+        'db_table': table,
+        'apps': Apps(),
+        'indexes': [models.Index(fields=['device_id', 'timestamp'], name=f'{table}_device_ts')],
+    })
+
+    return type(f'{values_model.__name__}{year:04d}{month:02d}', (models.Model,), {
+        '__module__': __name__,
+        'Meta': meta,
+        'id': models.BigIntegerField(primary_key=True),
+        'device_id': models.BigIntegerField(),
+        'value': values_model._meta.get_field('value').clone(),
+        'timestamp': models.DateTimeField(),
+    })
+
+
+def list_archives(values_model):
+    """
+    Return the `(year, month)` of every archive table of a value model.
+    """
+    pattern = re.compile(rf'^{re.escape(values_model._meta.db_table)}_(\d{{4}})(\d{{2}})$')
+    matches = (pattern.match(table) for table in connection.introspection.table_names())
+    return sorted((int(match.group(1)), int(match.group(2))) for match in matches if match)
+
+
+def archive_month(values_model, year, month, batch_size=10000, keep_latest=False):
+    """
+    Move the readings taken in the given month into its archive table, in
+    chunks of `batch_size` rows so each transaction only locks a bounded range.
+    With `keep_latest`, for change-only kinds, the latest reading of every
+    device stays in the value table. Returns the number of moved rows.
+    """
+    archive = archive_model(values_model, year, month)
+    if archive._meta.db_table not in connection.introspection.table_names():
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(archive)
+
+    start, end = month_bounds(year, month)
+    rows = values_model.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if keep_latest:
+        rows = superseded(rows)
+
+    qn = connection.ops.quote_name
+    fields = ('id', 'device_id', 'value', 'timestamp')
+    insert_sql = f"INSERT INTO {qn(archive._meta.db_table)} ({', '.join(qn(field) for field in fields)}) "
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = rows.order_by('id').values_list('id', flat=True)
+            last_id = list(ids[batch_size - 1:batch_size]) or list(ids.reverse()[:1])
+            if not last_id:
+                return moved
+
+            chunk = rows.filter(id__lte=last_id[0])
+            select_sql, params = chunk.values_list(*fields).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(insert_sql + select_sql, params)
+            moved += chunk.delete()[0]
+
+
+def drop_archive(values_model, year, month):
+    """
+    Drop the archive table of the given month and every reading in it.
+    """
+    with connection.schema_editor() as schema_editor:
+        schema_editor.delete_model(archive_model(values_model, year, month))
@@ -1,5 +1,59 @@
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
 from rest_framework import permissions
 
+from .models import Room
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 30
+
+_lock = threading.Lock()
+_room_ids = None
+
+
+def get_room_ids_cache():
+    global _room_ids
+    if _room_ids is None:
+        _room_ids = TTLCache(maxsize=getattr(settings, 'SMART_HOME_AUTH_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                             ttl=getattr(settings, 'SMART_HOME_AUTH_CACHE_TTL', DEFAULT_CACHE_TTL))
+    return _room_ids
+
+
+def owned_room_ids(user):
+    """
+    Ids of the rooms owned by the user, from an in-process TTL cache. Room
+    changes invalidate it right away in this process and after the TTL in others.
+    """
+    with _lock:
+        room_ids = get_room_ids_cache().get(user.pk)
+    if room_ids is None:
+        room_ids = frozenset(Room.objects.filter(owner_id=user.pk).values_list('pk', flat=True))
+        with _lock:
+            get_room_ids_cache()[user.pk] = room_ids
+    return room_ids
+
+
+def invalidate_room_owners(user_ids):
+    with _lock:
+        cache = get_room_ids_cache()
+        for user_id in user_ids:
+            cache.pop(user_id, None)
+
+
+def owns_room(user, room_id):
+    """
+    Whether the user owns the room, without loading the room or the user.
+    """
+    if room_id in owned_room_ids(user):
+        return True
+    # Rooms created by another process since the ids were cached are not in them yet.
+    if Room.objects.filter(pk=room_id, owner_id=user.pk).exists():
+        invalidate_room_owners([user.pk])
+        return True
+    return False
+
 
 class IsAdminUserOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -21,6 +75,6 @@ class IsOwnerOfDeviceInRoom(permissions.BasePermission):
         if request.user.is_superuser:
             return True
 
-        if request.user == obj.room.owner:
+        if owns_room(request.user, obj.room_id):
             return True
         return False
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'manage_devices.pubsub.InMemoryBroker'
+
+
+def room_channel(room_id):
+    return f'room:{room_id}'
+
+
+class Subscription:
+    """
+    Messages published to a set of channels, consumed as an async iterator on
+    the event loop the subscription was created on. Holds at most `max_queue`
+    undelivered messages; when a slow consumer falls behind, the oldest ones are
+    dropped rather than letting memory grow.
+    """
+
+    def __init__(self, broker, channels, max_queue):
+        self.broker = broker
+        self.channels = frozenset(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def deliver(self, message):
+        # Always runs on the subscriber's event loop.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker:
+    """
+    Interface of the pub/sub backends fanning out device events to connected
+    clients. `publish` may be called from any thread; `subscribe` must be called
+    from the event loop that consumes the subscription.
+    """
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channels, max_queue=100):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def has_subscribers(self, channels=None):
+        """
+        Whether publishing to any of `channels` (any channel if None) can reach a
+        subscriber, so publishers can skip building messages nobody receives.
+        Backends that cannot tell must return True.
+        """
+        return True
+
+
+class InMemoryBroker(BaseBroker):
+    """
+    Broker delivering messages to the subscribers of the current process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's event loop is closed.
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channels, max_queue=100):
+        subscription = Subscription(self, channels, max_queue)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self.subscriptions.pop(channel, None)
+
+    def has_subscribers(self, channels=None):
+        if channels is None:
+            return bool(self.subscriptions)
+        return any(channel in self.subscriptions for channel in channels)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """
+    The process-wide broker, of the class named by the `SMART_HOME_PUBSUB_BACKEND` setting.
+    """
+    return import_string(getattr(settings, 'SMART_HOME_PUBSUB_BACKEND', DEFAULT_BACKEND))()
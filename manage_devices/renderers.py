@@ -0,0 +1,61 @@
+import msgpack
+import numpy
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+ANALOG_BATCH_MEDIA_TYPE = 'application/vnd.smart-home.analog-batch'
+
+# One analog value of a packed batch: the device id, the time it was taken at
+# in seconds since the Unix epoch and the value, little-endian and unpadded.
+ANALOG_RECORD = numpy.dtype([('device', '<u4'), ('timestamp', '<f8'), ('value', '<f8')])
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    JSON renderer backed by orjson, for data made of plain dicts, lists and
+    scalars, such as the rows of the fast list path.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack renderer with the structure of the JSON responses. Dates,
+    decimals and other values without a MessagePack type are encoded as the
+    strings the JSON renderer would produce.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class AnalogBatchRenderer(BaseRenderer):
+    """
+    Renders analog value rows, dicts with their `device_id`, `timestamp` and
+    `value`, as packed `ANALOG_RECORD`s.
+    """
+    media_type = ANALOG_BATCH_MEDIA_TYPE
+    format = 'analog-batch'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        records = numpy.empty(len(data), dtype=ANALOG_RECORD)
+        records['device'] = [row['device_id'] for row in data]
+        records['timestamp'] = [row['timestamp'].timestamp() for row in data]
+        records['value'] = [row['value'] for row in data]
+        return records.tobytes()
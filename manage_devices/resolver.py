@@ -0,0 +1,89 @@
+"""
+In-process cache resolving MAC addresses to devices.
+
+Entries are evicted least recently used once the cache is full and expire after
+a TTL, which bounds how stale another process's cache can be; in this process,
+device changes invalidate the affected addresses right away through signals.
+"""
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from .fields import normalize_mac_address
+from .models import DEVICE_MODELS
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 300
+
+_lock = threading.Lock()
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(maxsize=getattr(settings, 'SMART_HOME_MAC_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                          ttl=getattr(settings, 'SMART_HOME_MAC_CACHE_TTL', DEFAULT_CACHE_TTL))
+    return _cache
+
+
+def resolve_mac_addresses(mac_addresses):
+    """
+    Map canonical MAC addresses to the `(kind, device_id, owner_id)` of every
+    device using them, one per device kind at most. Addresses missing from the
+    cache are looked up with one indexed query per device kind; unknown
+    addresses are cached too, as an empty list.
+    """
+    mac_addresses = set(mac_addresses)
+    with _lock:
+        cache = get_cache()
+        resolved = {mac_address: cache[mac_address] for mac_address in mac_addresses if mac_address in cache}
+
+    missing = mac_addresses - resolved.keys()
+    if missing:
+        found = {mac_address: [] for mac_address in missing}
+        for kind, model in DEVICE_MODELS.items():
+            rows = model.objects.filter(mac_address__in=missing).values_list('mac_address', 'pk', 'room__owner_id')
+            for mac_address, device_id, owner_id in rows:
+                found[mac_address].append((kind, device_id, owner_id))
+
+        with _lock:
+            get_cache().update(found)
+        resolved.update(found)
+
+    return resolved
+
+
+def resolve_for_user(user, mac_addresses):
+    """
+    Resolve MAC addresses in any notation to the devices the user may access.
+    Returns `{given address: [(kind, device_id), ...]}` and the invalid addresses.
+    """
+    normalized, invalid = {}, []
+    for mac_address in mac_addresses:
+        canonical = normalize_mac_address(mac_address)
+        if canonical is None:
+            invalid.append(mac_address)
+        else:
+            normalized[mac_address] = canonical
+
+    resolved = resolve_mac_addresses(normalized.values())
+    devices = {
+        mac_address: [(kind, device_id) for kind, device_id, owner_id in resolved[canonical]
+                      if user.is_staff or owner_id == user.pk]
+        for mac_address, canonical in normalized.items()
+    }
+    return devices, invalid
+
+
+def invalidate_mac_addresses(mac_addresses):
+    with _lock:
+        cache = get_cache()
+        for mac_address in mac_addresses:
+            cache.pop(mac_address, None)
+
+
+def clear():
+    with _lock:
+        get_cache().clear()
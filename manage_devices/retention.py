@@ -0,0 +1,180 @@
+"""
+Retention of the value history.
+
+Retention policies pick a cutoff per device; expired rows are deleted in
+chunks of bounded size, each in its own short transaction, from the value
+tables, their monthly archives and the analog rollups. Deleting a device's
+values does not touch its current state, which keeps showing the last reading.
+"""
+import time
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .ingest import stores_changes_only
+from .models import AnalogRollup, DeviceKind, RetentionPolicy, DEVICE_MODELS, VALUE_MODELS
+from .partitions import archive_model, drop_archive, list_archives, month_bounds
+from .transitions import superseded
+
+
+class Retention:
+    """
+    Cutoffs of one device kind: `rooms` maps device ids governed by a room
+    policy to their cutoff, `default` applies to every other device, including
+    deleted ones whose rows live on in the archives. A cutoff of None keeps data.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+        self.rooms = {}
+
+    def conditions(self):
+        """
+        Yield `(cutoff, Q)` pairs covering every device with a cutoff.
+        """
+        by_cutoff = {}
+        for device_id, cutoff in self.rooms.items():
+            if cutoff is not None:
+                by_cutoff.setdefault(cutoff, []).append(device_id)
+
+        for cutoff, device_ids in sorted(by_cutoff.items()):
+            yield cutoff, Q(device_id__in=device_ids)
+        if self.default is not None:
+            yield self.default, ~Q(device_id__in=list(self.rooms))
+
+    @property
+    def earliest_cutoff(self):
+        """
+        The cutoff before which the data of every device expired, or None.
+        """
+        cutoffs = [self.default, *self.rooms.values()]
+        return None if None in cutoffs else min(cutoffs)
+
+
+def applicable_policy(policies, kind, room_id):
+    candidates = [policy for policy in policies
+                  if policy.kind in (kind, None) and policy.room_id in (room_id, None)]
+    return max(candidates, key=lambda policy: policy.specificity, default=None)
+
+
+def retention_for(kind, attribute, now=None):
+    """
+    Cutoffs of a device kind for the `raw_retention` or `rollup_retention` of the policies.
+    """
+    now = now or timezone.now()
+    policies = list(RetentionPolicy.objects.filter(Q(kind=kind) | Q(kind__isnull=True)).order_by('id'))
+
+    def cutoff(policy):
+        retention = getattr(policy, attribute) if policy is not None else None
+        return now - retention if retention is not None else None
+
+    retention = Retention(default=cutoff(applicable_policy(policies, kind, None)))
+    room_ids = {policy.room_id for policy in policies if policy.room_id is not None}
+    if room_ids:
+        devices = DEVICE_MODELS[kind].objects.filter(room_id__in=room_ids).values_list('pk', 'room_id')
+        for device_id, room_id in devices:
+            retention.rooms[device_id] = cutoff(applicable_policy(policies, kind, room_id))
+    return retention
+
+
+def table_stats(table):
+    """
+    Bytes used by a table and its indexes and its number of rows, both
+    estimates on MySQL, or `(None, None)` if the database cannot tell.
+    """
+    qn = connection.ops.quote_name
+    if connection.vendor == 'mysql':
+        # Statistics instead of COUNT(*), which scans the whole table on InnoDB.
+        sql = ('SELECT data_length + index_length, table_rows FROM information_schema.tables '
+               'WHERE table_schema = DATABASE() AND table_name = %s')
+    elif connection.vendor == 'sqlite':
+        sql = (f'SELECT (SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+               f'(SELECT name FROM sqlite_master WHERE tbl_name = %s)), COUNT(*) FROM {qn(table)}')
+    else:
+        return None, None
+
+    try:
+        # In a savepoint, so a failed query leaves an enclosing transaction usable.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except OperationalError:
+        # SQLite builds without the dbstat virtual table.
+        return None, None
+    return tuple(row) if row else (None, None)
+
+
+def delete_expired(model, retention, timestamp_field='timestamp', batch_size=5000, pause=0.0, dry_run=False,
+                   keep_latest=False):
+    """
+    Delete the rows of `model` older than their device's cutoff, `batch_size`
+    rows per transaction, sleeping `pause` seconds between chunks to leave room
+    for other writers. With `keep_latest`, for change-only kinds, the latest row
+    of every device is kept. Bytes are estimated from the table's average row size.
+    """
+    table = model._meta.db_table
+    size, total_rows = table_stats(table)
+    reclaimed = {'table': table, 'rows': 0, 'bytes': 0, 'dropped': False}
+
+    for cutoff, condition in retention.conditions():
+        rows = model.objects.filter(condition, **{f'{timestamp_field}__lt': cutoff})
+        if keep_latest:
+            rows = superseded(rows)
+        if dry_run:
+            reclaimed['rows'] += rows.count()
+            continue
+
+        while True:
+            with transaction.atomic():
+                ids = list(rows.order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                # A plain DELETE by primary key: value models have no dependents or delete signals.
+                reclaimed['rows'] += model.objects.filter(pk__in=ids).delete()[0]
+            if pause:
+                time.sleep(pause)
+
+    if size and total_rows:
+        reclaimed['bytes'] = size * reclaimed['rows'] // total_rows
+    return reclaimed
+
+
+def compact_values(kinds=DeviceKind.values, batch_size=5000, pause=0.0, dry_run=False):
+    """
+    Apply the retention policies to the value tables, their archives and the
+    analog rollups. Archives of months that expired as a whole are dropped.
+    Returns one `{'table', 'rows', 'bytes', 'dropped'}` dict per table.
+    """
+    report = []
+
+    for kind in kinds:
+        values_model = VALUE_MODELS[kind]
+        retention = retention_for(kind, 'raw_retention')
+        # The latest transition of a change-only device holds its current state, however old it is.
+        report.append(delete_expired(values_model, retention, batch_size=batch_size, pause=pause, dry_run=dry_run,
+                                     keep_latest=stores_changes_only(kind)))
+
+        earliest_cutoff = retention.earliest_cutoff
+        for year, month in list_archives(values_model):
+            start, end = month_bounds(year, month)
+            if not any(cutoff > start for cutoff, _ in retention.conditions()):
+                continue
+
+            archive = archive_model(values_model, year, month)
+            if earliest_cutoff is not None and end <= earliest_cutoff:
+                # Every row of the month expired: drop the table instead of deleting row by row.
+                size, rows = table_stats(archive._meta.db_table)
+                reclaimed = {'table': archive._meta.db_table, 'rows': rows or 0, 'bytes': size or 0,
+                             'dropped': not dry_run}
+                if not dry_run:
+                    drop_archive(values_model, year, month)
+            else:
+                reclaimed = delete_expired(archive, retention, batch_size=batch_size, pause=pause, dry_run=dry_run)
+            report.append(reclaimed)
+
+        if kind == DeviceKind.ANALOG:
+            report.append(delete_expired(AnalogRollup, retention_for(kind, 'rollup_retention'), 'bucket',
+                                         batch_size=batch_size, pause=pause, dry_run=dry_run))
+
+    return report
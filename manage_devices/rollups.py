@@ -0,0 +1,200 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from .models import AnalogRollup, AnalogValues
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def bucket_start(timestamp, resolution):
+    """
+    Start of the bucket of `resolution` seconds containing `timestamp`. Buckets
+    are aligned to the Unix epoch, so day buckets start at midnight UTC.
+    """
+    seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def merge(rollup, other):
+    rollup.count += other.count
+    rollup.sum += other.sum
+    rollup.min = min(rollup.min, other.min)
+    rollup.max = max(rollup.max, other.max)
+    if other.last_timestamp >= rollup.last_timestamp:
+        rollup.last = other.last
+        rollup.last_timestamp = other.last_timestamp
+
+
+def aggregate(values, resolutions=AnalogRollup.Resolution.values):
+    """
+    Aggregate analog value rows into unsaved rollups keyed by `(device_id, resolution, bucket)`.
+    """
+    rollups = {}
+
+    for value in values:
+        for resolution in resolutions:
+            bucket = bucket_start(value.timestamp, resolution)
+            rollup = AnalogRollup(device_id=value.device_id, resolution=resolution, bucket=bucket, count=1,
+                                  sum=value.value, min=value.value, max=value.value, last=value.value,
+                                  last_timestamp=value.timestamp)
+
+            key = (value.device_id, resolution, bucket)
+            if key in rollups:
+                merge(rollups[key], rollup)
+            else:
+                rollups[key] = rollup
+
+    return rollups
+
+
+# Rows per upsert statement, which keeps their parameters within SQLite's limit.
+UPSERT_BATCH_SIZE = 100
+
+ROLLUP_FIELDS = ('device', 'resolution', 'bucket', 'count', 'sum', 'min', 'max', 'last', 'last_timestamp')
+
+
+def merging_upsert(connection):
+    """
+    SQL inserting rollups, and adding the ones of a bucket already stored to it,
+    minus the VALUES rows.
+    """
+    quote = connection.ops.quote_name
+    table = quote(AnalogRollup._meta.db_table)
+    columns = {name: quote(AnalogRollup._meta.get_field(name).column) for name in ROLLUP_FIELDS}
+
+    if connection.vendor == 'mysql':
+        # Assignments see the columns assigned before them, so `last` comes before `last_timestamp`.
+        conflict = 'ON DUPLICATE KEY UPDATE'
+        old, new = columns.get, lambda name: f'VALUES({columns[name]})'
+    else:
+        unique = ', '.join(columns[name] for name in ('device', 'resolution', 'bucket'))
+        conflict = f'ON CONFLICT ({unique}) DO UPDATE SET'
+        old, new = lambda name: f'{table}.{columns[name]}', lambda name: f'excluded.{columns[name]}'
+    least, greatest = ('MIN', 'MAX') if connection.vendor == 'sqlite' else ('LEAST', 'GREATEST')
+
+    assignments = [
+        f"{columns['count']} = {old('count')} + {new('count')}",
+        f"{columns['sum']} = {old('sum')} + {new('sum')}",
+        f"{columns['min']} = {least}({old('min')}, {new('min')})",
+        f"{columns['max']} = {greatest}({old('max')}, {new('max')})",
+        f"{columns['last']} = CASE WHEN {new('last_timestamp')} >= {old('last_timestamp')} "
+        f"THEN {new('last')} ELSE {old('last')} END",
+        f"{columns['last_timestamp']} = {greatest}({old('last_timestamp')}, {new('last_timestamp')})",
+    ]
+    return f"INSERT INTO {table} ({', '.join(columns.values())}) VALUES {{rows}} {conflict} {', '.join(assignments)}"
+
+
+def save_rollups(rollups):
+    """
+    Add the rollups to the stored ones of their buckets, creating those missing.
+    Concurrent writers of the same bucket, even a new one, add up rather than
+    overwrite each other.
+    """
+    if not rollups:
+        return
+
+    connection = connections[router.db_for_write(AnalogRollup)]
+    sql = merging_upsert(connection)
+    fields = [AnalogRollup._meta.get_field(name) for name in ROLLUP_FIELDS]
+    row = f"({', '.join(['%s'] * len(fields))})"
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rollups), UPSERT_BATCH_SIZE):
+            batch = rollups[start:start + UPSERT_BATCH_SIZE]
+            params = [field.get_db_prep_save(getattr(rollup, field.attname), connection)
+                      for rollup in batch for field in fields]
+            cursor.execute(sql.format(rows=', '.join([row] * len(batch))), params)
+
+
+def update_rollups(values):
+    """
+    Fold newly stored analog value rows into the rollups of every resolution,
+    with one merging upsert per call.
+    """
+    rollups = aggregate(values)
+    if not rollups:
+        return
+
+    save_rollups(list(rollups.values()))
+
+
+def refresh_rollups(device_id, timestamps):
+    """
+    Recompute the buckets of a device containing the given timestamps from the
+    raw values, after values in them were changed or deleted.
+    """
+    with transaction.atomic():
+        for resolution in AnalogRollup.Resolution.values:
+            buckets = {bucket_start(timestamp, resolution) for timestamp in timestamps}
+            in_buckets = Q()
+            for bucket in buckets:
+                in_buckets |= Q(timestamp__gte=bucket, timestamp__lt=bucket + timedelta(seconds=resolution))
+
+            AnalogRollup.objects.filter(device_id=device_id, resolution=resolution, bucket__in=buckets).delete()
+            values = AnalogValues.objects.filter(in_buckets, device_id=device_id).only('device_id', 'value', 'timestamp')
+            save_rollups(list(aggregate(values, [resolution]).values()))
+
+
+def rebuild_rollups(device_ids=None, batch_size=10000):
+    """
+    Rebuild the rollups of the given devices, or of all devices, from the raw
+    values. Values are read in keyset-paginated chunks ordered by device and time,
+    and every bucket is written as soon as all its values were read.
+    Returns the number of rollups written.
+    """
+    values = AnalogValues.objects.only('device_id', 'value', 'timestamp').order_by('device_id', 'timestamp', 'id')
+    rollups = AnalogRollup.objects.all()
+    if device_ids is not None:
+        values = values.filter(device_id__in=device_ids)
+        rollups = rollups.filter(device_id__in=device_ids)
+
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+
+        pending = {}
+        position = None
+        while True:
+            chunk = values
+            if position is not None:
+                device_id, timestamp, value_id = position
+                chunk = chunk.filter(Q(device_id__gt=device_id)
+                                     | Q(device_id=device_id, timestamp__gt=timestamp)
+                                     | Q(device_id=device_id, timestamp=timestamp, id__gt=value_id))
+            chunk = list(chunk[:batch_size])
+            if not chunk:
+                break
+
+            last = chunk[-1]
+            position = (last.device_id, last.timestamp, last.id)
+            for key, rollup in aggregate(chunk).items():
+                if key in pending:
+                    merge(pending[key], rollup)
+                else:
+                    pending[key] = rollup
+
+            # Values are read in device and time order, so buckets of earlier devices
+            # and buckets ending before the last value read are complete.
+            complete = [key for key in pending
+                        if key[0] != last.device_id or key[2] + timedelta(seconds=key[1]) <= last.timestamp]
+            save_rollups([pending.pop(key) for key in complete])
+            written += len(complete)
+
+        save_rollups(list(pending.values()))
+        written += len(pending)
+
+    return written
+
+
+def choose_resolution(start, end, max_points):
+    """
+    The finest resolution whose buckets cover `start`-`end` in at most
+    `max_points` points, falling back to the coarsest one.
+    """
+    span = (end - start).total_seconds()
+    for resolution in sorted(AnalogRollup.Resolution.values):
+        if span / resolution <= max_points:
+            return resolution
+    return max(AnalogRollup.Resolution.values)
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .models import DEVICE_MODELS
+from .signals import devices_changed
+
+
+def apply_scene(user, active, rooms=(), devices=None):
+    """
+    Set `active` on every device in `rooms` and on the devices given as
+    `{kind: [ids]}`, limited to the devices the user may control. Costs one
+    locking read and at most one UPDATE per device table. Sends a single
+    `devices_changed` for the whole batch once the transaction committed.
+
+    Returns the resulting states as `{kind: [(id, room_id), ...]}` together with
+    the devices whose state actually changed, in the same shape.
+    """
+    devices = devices or {}
+    matched, changed = {}, {}
+
+    with transaction.atomic():
+        for kind, model in DEVICE_MODELS.items():
+            selection = Q(room_id__in=rooms) | Q(pk__in=devices.get(kind, ()))
+            queryset = model.objects.filter(selection)
+            if not user.is_staff:
+                queryset = queryset.filter(room__owner=user)
+
+            rows = list(queryset.select_for_update().order_by('pk').values_list('pk', 'room_id', 'active'))
+            matched[kind] = [(pk, room_id) for pk, room_id, _ in rows]
+            changed[kind] = [(pk, room_id) for pk, room_id, current in rows if current != active]
+
+            if changed[kind]:
+                model.objects.filter(pk__in=[pk for pk, _ in changed[kind]]).update(active=active)
+
+        if any(changed.values()):
+            transaction.on_commit(lambda: devices_changed.send(sender=apply_scene, active=active, devices=changed))
+
+    return matched, changed
@@ -1,17 +1,22 @@
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Room, AnalogDevice, DigitalDevice, SmartDevice, AnalogValues, DigitalValues, SmartValues
+from rest_framework.reverse import reverse
+from .models import (Room, AnalogDevice, DigitalDevice, SmartDevice, AnalogValues, DigitalValues, SmartValues,
+                     DeviceKind, Device)
+from .state import current_value
 
 
 class AnalogDeviceSerializer(serializers.HyperlinkedModelSerializer):
     room = serializers.PrimaryKeyRelatedField(queryset=Room.objects.all())
+    value = serializers.ReadOnlyField(source='current_value', default=None)
 
     class Meta:
         model = AnalogDevice
-        fields = ('url', 'id', 'mac_address', 'name', 'ip', 'room', 'active')
+        fields = ('url', 'id', 'mac_address', 'name', 'ip', 'room', 'active', 'value')
 
     def create(self, validated_data):
-        if (self.context['request'].user == validated_data['room'].owner) or self.context['request'].user.is_staff:
+        if validated_data['room'].owner_id == self.context['request'].user.pk or self.context['request'].user.is_staff:
             return super().create(validated_data)
         raise serializers.ValidationError("You cannot create a device in a room you don't own.")
 
@@ -28,13 +33,14 @@ class AnalogDeviceSerializer(serializers.HyperlinkedModelSerializer):
 
 class DigitalDeviceSerializer(serializers.HyperlinkedModelSerializer):
     room = serializers.PrimaryKeyRelatedField(queryset=Room.objects.all())
+    value = serializers.ReadOnlyField(source='current_value', default=None)
 
     class Meta:
         model = DigitalDevice
-        fields = ('url', 'id', 'mac_address', 'name', 'ip', 'room', 'active')
+        fields = ('url', 'id', 'mac_address', 'name', 'ip', 'room', 'active', 'value')
 
     def create(self, validated_data):
-        if (self.context['request'].user == validated_data['room'].owner) or self.context['request'].user.is_staff:
+        if validated_data['room'].owner_id == self.context['request'].user.pk or self.context['request'].user.is_staff:
             return super().create(validated_data)
         raise serializers.ValidationError("You cannot create a device in a room you don't own.")
 
@@ -51,13 +57,14 @@ class DigitalDeviceSerializer(serializers.HyperlinkedModelSerializer):
 
 class SmartDeviceSerializer(serializers.HyperlinkedModelSerializer):
     room = serializers.PrimaryKeyRelatedField(queryset=Room.objects.all())
+    value = serializers.ReadOnlyField(source='current_value', default=None)
 
     class Meta:
         model = SmartDevice
-        fields = ('url', 'id', 'protocol_name', 'mac_address', 'name', 'ip', 'room', 'active')
+        fields = ('url', 'id', 'protocol_name', 'mac_address', 'name', 'ip', 'room', 'active', 'value')
 
     def create(self, validated_data):
-        if (self.context['request'].user == validated_data['room'].owner) or self.context['request'].user.is_staff:
+        if validated_data['room'].owner_id == self.context['request'].user.pk or self.context['request'].user.is_staff:
             return super().create(validated_data)
         raise serializers.ValidationError("You cannot create a device in a room you don't own.")
 
@@ -75,19 +82,36 @@ class SmartDeviceSerializer(serializers.HyperlinkedModelSerializer):
 class AnalogValuesSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = AnalogValues
-        fields = ('url', 'id', 'device', 'value')
+        fields = ('url', 'id', 'device', 'value', 'timestamp')
 
 
 class DigitalValuesSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = DigitalValues
-        fields = ('url', 'id', 'device', 'value')
+        fields = ('url', 'id', 'device', 'value', 'timestamp')
 
 
 class SmartValuesSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = SmartValues
-        fields = ('url', 'id', 'device', 'value')
+        fields = ('url', 'id', 'device', 'value', 'timestamp')
+
+
+class DeviceSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    type = serializers.CharField(source='get_kind_display', read_only=True)
+    value = serializers.ReadOnlyField(source='current_value', default=None)
+
+    class Meta:
+        model = Device
+        fields = ('url', 'id', 'type', 'device_id', 'protocol_name', 'mac_address', 'name', 'ip', 'room', 'active',
+                  'value')
+
+    def get_url(self, obj):
+        """
+        URL of the device on the endpoint of its kind, where it can be changed.
+        """
+        return reverse(f'{obj.kind}device-detail', args=[obj.device_id], request=self.context.get('request'))
 
 
 class RoomSerializer(serializers.HyperlinkedModelSerializer):
@@ -98,63 +122,66 @@ class RoomSerializer(serializers.HyperlinkedModelSerializer):
         model = Room
         fields = ('id', 'name', 'owner', 'devices')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Prefetch the devices of every room together with their current value, so the
+        device tree is built with a fixed number of queries regardless of its size.
+        Devices are ordered by id, whichever of the room indexes the database picks.
+        """
+        return queryset.select_related('owner').prefetch_related(
+            Prefetch('analog_devices', queryset=AnalogDevice.objects.annotate(
+                current_value=current_value(DeviceKind.ANALOG)).order_by('pk')),
+            Prefetch('digital_devices', queryset=DigitalDevice.objects.annotate(
+                current_value=current_value(DeviceKind.DIGITAL)).order_by('pk')),
+            Prefetch('smart_devices', queryset=SmartDevice.objects.annotate(
+                current_value=current_value(DeviceKind.SMART)).order_by('pk')),
+        )
+
     def get_devices(self, room):
         device_list = []
 
-        analog_devices = AnalogDevice.objects.filter(room=room)
-        digital_devices = DigitalDevice.objects.filter(room=room)
-        smart_devices = SmartDevice.objects.filter(room=room)
-
-        for device in analog_devices:
-            device_data = {
-                'id': device.id,
-                'type': 'Analog',
-                'name': device.name,
-                'ip': device.ip,
-                'value': None
-            }
-
-            latest_value = AnalogValues.objects.filter(device=device).order_by('-id').first()
-            if latest_value:
-                device_data['value'] = latest_value.value
-
-            device_list.append(device_data)
-
-        for device in digital_devices:
-            device_data = {
-                'id': device.id,
-                'type': 'Digital',
-                'name': device.name,
-                'ip': device.ip,
-                'value': None
-            }
-
-            latest_value = DigitalValues.objects.filter(device=device).order_by('-id').first()
-            if latest_value:
-                device_data['value'] = latest_value.value
-
-            device_list.append(device_data)
-
-        for device in smart_devices:
-            device_data = {
-                'id': device.id,
-                'type': 'Smart',
-                'name': device.name,
-                'ip': device.ip,
-                'value': None
-            }
-
-            latest_value = SmartValues.objects.filter(device=device).order_by('-id').first()
-            if latest_value:
-                device_data['value'] = latest_value.value
-
-            device_list.append(device_data)
+        for device_type, devices in (('Analog', room.analog_devices.all()),
+                                     ('Digital', room.digital_devices.all()),
+                                     ('Smart', room.smart_devices.all())):
+            for device in devices:
+                device_list.append({
+                    'id': device.id,
+                    'type': device_type,
+                    'name': device.name,
+                    'ip': device.ip,
+                    'value': device.current_value
+                })
 
         return device_list
 
+
 class RoomCreationSerializer(serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
 
     class Meta:
         model = Room
         fields = ('name', 'owner')
+
+
+class SceneSerializer(serializers.Serializer):
+    active = serializers.BooleanField()
+    rooms = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    devices = serializers.DictField(child=serializers.ListField(child=serializers.IntegerField()),
+                                    required=False, default=dict)
+
+    def validate_devices(self, devices):
+        unknown = set(devices) - set(DeviceKind.values)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown device types {', '.join(sorted(unknown))}, expected: {', '.join(DeviceKind.values)}.")
+        return {DeviceKind(kind): ids for kind, ids in devices.items()}
+
+    def validate(self, data):
+        if not data['rooms'] and not any(data['devices'].values()):
+            raise serializers.ValidationError("Select at least one room or device.")
+        return data
+
+
+class ResolveSerializer(serializers.Serializer):
+    mac_addresses = serializers.ListField(child=serializers.CharField(), allow_empty=False, max_length=1000)
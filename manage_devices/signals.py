@@ -0,0 +1,183 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver, Signal
+
+from . import analytics, resolver
+from .cache import invalidate_trees
+from .models import Room, AnalogDevice, DigitalDevice, SmartDevice, DeviceKind, DeviceState, DEVICE_MODELS
+from .permissions import invalidate_room_owners
+from .pubsub import get_broker, room_channel
+
+# Sent once the transaction storing new value rows committed, with the `kind`
+# of the devices and the stored `values`, however they were inserted.
+values_recorded = Signal()
+
+# Sent once the transaction changing or deleting existing value rows committed,
+# with the `kind` and the `device_ids` of the affected devices.
+values_changed = Signal()
+
+# Sent once the transaction of a bulk `active` change committed, with the new
+# `active` state and the changed `devices` as `{kind: [(id, room_id), ...]}`.
+# Bulk updates bypass post_save, so this is their only change notification.
+devices_changed = Signal()
+
+
+def device_kind(model):
+    return next(kind for kind, device_model in DEVICE_MODELS.items() if device_model is model)
+
+
+@receiver(post_delete, sender=AnalogDevice)
+@receiver(post_delete, sender=DigitalDevice)
+@receiver(post_delete, sender=SmartDevice)
+def delete_device_state(sender, instance, **kwargs):
+    DeviceState.objects.filter(kind=device_kind(sender), device_id=instance.pk).delete()
+
+
+@receiver(values_recorded)
+def publish_values(sender, kind, values, **kwargs):
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+
+    latest = {}
+    for value in values:
+        if value.device_id not in latest or value.timestamp >= latest[value.device_id].timestamp:
+            latest[value.device_id] = value
+
+    rooms = dict(DEVICE_MODELS[kind].objects.filter(pk__in=latest.keys()).values_list('pk', 'room_id'))
+    for device_id, value in latest.items():
+        if device_id in rooms:
+            broker.publish(room_channel(rooms[device_id]), {
+                'type': 'value',
+                'kind': kind,
+                'device': device_id,
+                'room': rooms[device_id],
+                'value': value.value,
+                'timestamp': value.timestamp.isoformat(),
+            })
+
+
+@receiver(post_save, sender=AnalogDevice)
+@receiver(post_save, sender=DigitalDevice)
+@receiver(post_save, sender=SmartDevice)
+def publish_device(sender, instance, **kwargs):
+    message = {
+        'type': 'device',
+        'kind': device_kind(sender),
+        'device': instance.pk,
+        'room': instance.room_id,
+        'name': instance.name,
+        'active': instance.active,
+    }
+    transaction.on_commit(lambda: get_broker().publish(room_channel(instance.room_id), message))
+
+
+@receiver(devices_changed)
+def publish_scene(sender, active, devices, **kwargs):
+    rooms = {}
+    for kind, changed in devices.items():
+        for device_id, room_id in changed:
+            rooms.setdefault(room_id, []).append({'kind': kind, 'device': device_id})
+
+    broker = get_broker()
+    for room_id, room_devices in rooms.items():
+        broker.publish(room_channel(room_id), {'type': 'devices', 'room': room_id, 'active': active,
+                                               'devices': room_devices})
+
+
+def room_owners(room_ids):
+    return set(Room.objects.filter(pk__in=room_ids).values_list('owner_id', flat=True))
+
+
+@receiver(pre_save, sender=Room)
+def remember_room_owner(sender, instance, **kwargs):
+    instance._previous_owner_ids = set(sender.objects.filter(pk=instance.pk).values_list('owner_id', flat=True))
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_room_trees(sender, instance, **kwargs):
+    invalidate_trees({instance.owner_id, *getattr(instance, '_previous_owner_ids', ())})
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_owned_rooms(sender, instance, **kwargs):
+    owner_ids = {instance.owner_id, *getattr(instance, '_previous_owner_ids', ())}
+    # Also after commit, so a concurrent lookup cannot cache the rooms from before the transaction.
+    invalidate_room_owners(owner_ids)
+    transaction.on_commit(lambda: invalidate_room_owners(owner_ids))
+
+
+@receiver(pre_save, sender=AnalogDevice)
+@receiver(pre_save, sender=DigitalDevice)
+@receiver(pre_save, sender=SmartDevice)
+def remember_device_owner(sender, instance, **kwargs):
+    previous = sender.objects.filter(pk=instance.pk).values_list('room__owner_id', 'mac_address')
+    instance._previous_owner_ids = {owner_id for owner_id, _ in previous}
+    instance._previous_mac_addresses = {mac_address for _, mac_address in previous}
+
+
+@receiver(post_save, sender=AnalogDevice)
+@receiver(post_save, sender=DigitalDevice)
+@receiver(post_save, sender=SmartDevice)
+@receiver(post_delete, sender=AnalogDevice)
+@receiver(post_delete, sender=DigitalDevice)
+@receiver(post_delete, sender=SmartDevice)
+def invalidate_device_trees(sender, instance, **kwargs):
+    invalidate_trees(room_owners([instance.room_id]) | getattr(instance, '_previous_owner_ids', set()))
+
+
+@receiver(post_save, sender=AnalogDevice)
+@receiver(post_save, sender=DigitalDevice)
+@receiver(post_save, sender=SmartDevice)
+@receiver(post_delete, sender=AnalogDevice)
+@receiver(post_delete, sender=DigitalDevice)
+@receiver(post_delete, sender=SmartDevice)
+def invalidate_device_mac_addresses(sender, instance, **kwargs):
+    mac_addresses = {instance.mac_address, *getattr(instance, '_previous_mac_addresses', ())}
+    # Also after commit, so a concurrent lookup cannot cache the state from before the transaction.
+    resolver.invalidate_mac_addresses(mac_addresses)
+    transaction.on_commit(lambda: resolver.invalidate_mac_addresses(mac_addresses))
+
+
+@receiver(post_save, sender=Room)
+def invalidate_room_mac_addresses(sender, instance, created, **kwargs):
+    if not created and instance.owner_id not in getattr(instance, '_previous_owner_ids', {instance.owner_id}):
+        # The owners of the room's devices changed.
+        transaction.on_commit(resolver.clear)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_trees(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_trees({instance.pk})
+
+
+@receiver(values_recorded)
+def invalidate_value_trees(sender, kind, values, **kwargs):
+    invalidate_value_change_trees(sender, kind, {value.device_id for value in values})
+
+
+@receiver(values_changed)
+def invalidate_value_change_trees(sender, kind, device_ids, **kwargs):
+    invalidate_trees(set(DEVICE_MODELS[kind].objects.filter(pk__in=device_ids)
+                         .values_list('room__owner_id', flat=True).distinct()))
+
+
+@receiver(devices_changed)
+def invalidate_scene_trees(sender, devices, **kwargs):
+    invalidate_trees(room_owners({room_id for changed in devices.values() for _, room_id in changed}))
+
+
+@receiver(values_recorded)
+def invalidate_value_analytics(sender, kind, values, **kwargs):
+    if kind == DeviceKind.ANALOG:
+        analytics.invalidate_devices({value.device_id for value in values})
+
+
+@receiver(values_changed)
+def invalidate_value_change_analytics(sender, kind, device_ids, **kwargs):
+    if kind == DeviceKind.ANALOG:
+        analytics.invalidate_devices(device_ids)
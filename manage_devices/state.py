@@ -0,0 +1,108 @@
+from django.db import connections, router, transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import DeviceState, DEVICE_MODELS, VALUE_MODELS
+
+
+def current_value(kind, device_id=OuterRef('pk')):
+    """
+    Expression resolving to the current value of the device in the outer query,
+    for use in `annotate()` on a device queryset of the given kind. On the
+    `Device` registry, pass `OuterRef('kind')` and `OuterRef('device_id')`.
+    """
+    return Subquery(DeviceState.objects.filter(kind=kind, device_id=device_id).values('value')[:1])
+
+
+def conflict_target(model, unique_fields):
+    """
+    The `unique_fields` of an upsert of `model` with `bulk_create(update_conflicts=True)`.
+    MySQL takes the conflict from any unique constraint and refuses an explicit target.
+    """
+    features = connections[router.db_for_write(model)].features
+    return unique_fields if features.supports_update_conflicts_with_target else None
+
+
+def update_current_state(kind, values):
+    """
+    Store the given value rows as the current state of their devices, unless a
+    device already has a more recent state. When a device has several rows in
+    `values`, the one with the latest timestamp wins, ties going to the later row.
+    """
+    latest = {}
+    for value in values:
+        if value.device_id not in latest or value.timestamp >= latest[value.device_id].timestamp:
+            latest[value.device_id] = value
+
+    if not latest:
+        return
+
+    last_seen = {}
+    existing_states = DeviceState.objects.filter(kind=kind, device_id__in=latest.keys())
+    for device_id, updated_at, seen in existing_states.values_list('device_id', 'updated_at', 'last_seen'):
+        if updated_at > latest[device_id].timestamp:
+            del latest[device_id]
+        elif seen is not None:
+            last_seen[device_id] = seen
+
+    DeviceState.objects.bulk_create(
+        [DeviceState(kind=kind, device_id=device_id, value=value.value, updated_at=value.timestamp,
+                     last_seen=max(value.timestamp, last_seen.get(device_id, value.timestamp)))
+         for device_id, value in latest.items()],
+        update_conflicts=True,
+        unique_fields=conflict_target(DeviceState, ['kind', 'device_id']),
+        update_fields=['value', 'updated_at', 'last_seen'],
+    )
+
+
+def touch_current_state(kind, values):
+    """
+    Record the given value rows as seen without changing the state of their
+    devices, for readings that repeat the current state and are not stored.
+    """
+    seen = {}
+    for value in values:
+        seen[value.device_id] = max(value.timestamp, seen.get(value.device_id, value.timestamp))
+
+    states = list(DeviceState.objects.filter(kind=kind, device_id__in=seen.keys()).only('device_id', 'last_seen'))
+    states = [state for state in states if state.last_seen is None or state.last_seen < seen[state.device_id]]
+    for state in states:
+        state.last_seen = seen[state.device_id]
+    DeviceState.objects.bulk_update(states, ['last_seen'])
+
+
+def refresh_current_state(kind, device_ids):
+    """
+    Recompute the current state of the given devices from their value history,
+    e.g. after a value row was changed or deleted.
+    """
+    values_model = VALUE_MODELS[kind]
+    device_ids = set(device_ids)
+
+    latest_id = values_model.objects.filter(device_id=OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+    latest_ids = (DEVICE_MODELS[kind].objects.filter(pk__in=device_ids)
+                  .annotate(latest_id=Subquery(latest_id)).values('latest_id'))
+    latest_values = list(values_model.objects.filter(id__in=latest_ids))
+
+    with transaction.atomic():
+        states = DeviceState.objects.filter(kind=kind, device_id__in=device_ids)
+        last_seen = list(states.filter(last_seen__isnull=False).values_list('device_id', 'last_seen'))
+        states.delete()
+        update_current_state(kind, latest_values)
+        touch_current_state(kind, [VALUE_MODELS[kind](device_id=device_id, timestamp=seen)
+                                   for device_id, seen in last_seen])
+
+
+def rebuild_current_state(kind, batch_size=1000):
+    """
+    Rebuild the current state of every device of the given kind from the value tables.
+    Returns the number of state rows written.
+    """
+    device_ids = list(DEVICE_MODELS[kind].objects.values_list('pk', flat=True).order_by('pk'))
+
+    with transaction.atomic():
+        DeviceState.objects.filter(kind=kind).delete()
+
+        for start in range(0, len(device_ids), batch_size):
+            refresh_current_state(kind, device_ids[start:start + batch_size])
+
+    return DeviceState.objects.filter(kind=kind).count()
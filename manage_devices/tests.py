@@ -1,3 +1,1472 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import parse_qsl, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import msgpack
+import numpy
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.logs import auth_logger
+from smart_home.metrics import registry
+from smart_home.middleware import MetricsMiddleware
+from smart_home.routers import ReplicaRouter, pin_key, read_database
+
+from .models import (Room, AnalogDevice, DigitalDevice, SmartDevice, AnalogValues, DigitalValues, SmartValues,
+                     AnalogRollup, DeviceKind, DeviceState, RetentionPolicy)
+from . import benchmark, export, resolver, rollups, writebehind
+from .mqtt import MqttIngestWorker
+from .ingest import store_values
+from .partitions import archive_model, archive_month, list_archives
+from .renderers import ANALOG_BATCH_MEDIA_TYPE, ANALOG_RECORD
+from .retention import table_stats
+from .permissions import invalidate_room_owners, owns_room
+from .events import event_stream
+from .pubsub import get_broker, room_channel
+from .signals import devices_changed
+from .state import update_current_state
+from .streaming import keyset_chunks
+
+
+def mac_address(number):
+    return ':'.join(f'{octet:02x}' for octet in number.to_bytes(6, 'big'))
+
+
+def create_room_with_devices(owner, name='Room', devices_per_type=1):
+    room = Room.objects.create(name=name, owner=owner)
+
+    for i in range(devices_per_type):
+        analog = AnalogDevice.objects.create(mac_address=mac_address(room.id << 16 | i), name=f'Analog {i}',
+                                             ip='192.168.100.10', room=room)
+        digital = DigitalDevice.objects.create(mac_address=mac_address(room.id << 16 | i), name=f'Digital {i}',
+                                               ip='192.168.100.11', room=room)
+        smart = SmartDevice.objects.create(protocol_name='zigbee', mac_address=mac_address(room.id << 16 | i),
+                                           name=f'Smart {i}', ip='192.168.100.12', room=room)
+        AnalogValues.objects.create(device=analog, value=1.0)
+        AnalogValues.objects.create(device=analog, value=2.5)
+        DigitalValues.objects.create(device=digital, value=False)
+        DigitalValues.objects.create(device=digital, value=True)
+        SmartValues.objects.create(device=smart, value='On')
+
+    call_command('rebuild_device_state', stdout=StringIO())
+    return room
+
+
+class RoomDeviceTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_devices_contain_latest_values(self):
+        room = create_room_with_devices(self.user)
+        SmartDevice.objects.create(protocol_name='zigbee', mac_address=mac_address(1), name='Idle', ip='192.168.100.13',
+                                   room=room)
+
+        response = self.client.get(f'/rooms/{room.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        values = {device['name']: (device['type'], device['value']) for device in response.data['devices']}
+        self.assertEqual(values, {
+            'Analog 0': ('Analog', 2.5),
+            'Digital 0': ('Digital', True),
+            'Smart 0': ('Smart', 'On'),
+            'Idle': ('Smart', None),
+        })
+
+    def test_room_list_query_count_does_not_depend_on_size(self):
+        create_room_with_devices(self.user, name='Small')
+
+        with self.assertNumQueries(4):
+            self.client.get('/rooms/')
+
+        for i in range(5):
+            create_room_with_devices(self.user, name=f'Large {i}', devices_per_type=4)
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/rooms/')
+
+        self.assertEqual(len(response.data), 6)
+
+    def test_tree_is_served_from_cache_until_it_changes(self):
+        room = create_room_with_devices(self.user)
+        analog = room.analog_devices.get()
+        self.client.get('/rooms/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/rooms/')
+        self.assertEqual(response.data[0]['name'], 'Room')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/rooms/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post('/analog-values/', {'device': f'/analog-devices/{analog.id}/', 'value': 7.5})
+        response = self.client.get(f'/rooms/{room.id}/')
+        values = {device['name']: device['value'] for device in response.data['devices']}
+        self.assertEqual(values['Analog 0'], 7.5)
+
+        analog.name = 'Thermometer'
+        analog.save()
+        response = self.client.get(f'/rooms/{room.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Thermometer', [device['name'] for device in response.data['devices']])
+
+    def test_trees_are_invalidated_again_on_commit(self):
+        room = create_room_with_devices(self.user)
+        analog = room.analog_devices.get()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            analog.name = 'Thermometer'
+            analog.save()
+            # A concurrent request could cache the tree before the change is committed.
+            etag = self.client.get('/rooms/')['ETag']
+        for callback in callbacks:
+            callback()
+
+        response = self.client.get('/rooms/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_trees_are_per_user(self):
+        create_room_with_devices(self.user)
+        other = User.objects.create_user(username='other', password='password')
+        self.client.get('/rooms/')
+
+        self.client.force_authenticate(other)
+        response = self.client.get('/rooms/')
+
+        self.assertEqual(response.data, [])
+
+
+class DeviceRegistryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = create_room_with_devices(self.user, devices_per_type=2)
+        create_room_with_devices(User.objects.create_user(username='other', password='password'))
+
+    def test_lists_devices_of_all_kinds_in_one_query(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/devices/', {'ordering': 'name', 'page_size': 4})
+
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual([device['name'] for device in response.data['results']],
+                         ['Analog 0', 'Analog 1', 'Digital 0', 'Digital 1'])
+        analog = response.data['results'][0]
+        self.assertEqual((analog['type'], analog['value']), ('Analog', 2.5))
+        self.assertTrue(analog['url'].endswith(f"/analog-devices/{analog['device_id']}/"))
+        self.assertEqual(len({device['id'] for device in response.data['results']}), 4)
+
+    def test_filters_across_kinds(self):
+        SmartDevice.objects.filter(name='Smart 1').update(active=True)
+
+        response = self.client.get('/devices/', {'kind': 'digital,smart', 'active': 'false', 'room': self.room.id})
+
+        self.assertEqual([device['name'] for device in response.data['results']],
+                         ['Digital 0', 'Digital 1', 'Smart 0'])
+        self.assertEqual(self.client.get('/devices/', {'kind': 'thermal'}).status_code, 400)
+
+
+class DeviceFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.kitchen = create_room_with_devices(self.user, name='Kitchen', devices_per_type=2)
+        self.hall = create_room_with_devices(self.user, name='Hall')
+        SmartDevice.objects.filter(room=self.kitchen, name='Smart 1').update(protocol_name='wifi', active=True)
+        create_room_with_devices(User.objects.create_user(username='other', password='password'), name='Kitchen 2')
+
+    def names(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data['results'] if 'results' in response.data else response.data
+        return [item['name'] for item in results]
+
+    def test_filters_combine_on_every_kind(self):
+        self.assertEqual(self.names('/smart-devices/', room=self.kitchen.pk, protocol='wifi', active='true'),
+                         ['Smart 1'])
+        self.assertEqual(self.names('/smart-devices/', protocol='zigbee,wifi', ordering='-name'),
+                         ['Smart 1', 'Smart 0', 'Smart 0'])
+        self.assertEqual(self.names('/analog-devices/', room=f'{self.kitchen.pk},{self.hall.pk}', name='analog 1'),
+                         ['Analog 1'])
+        self.assertEqual(self.names('/digital-devices/', search='tal 0', ordering='room'), ['Digital 0', 'Digital 0'])
+        self.assertEqual(self.names('/devices/', protocol='wifi'), ['Smart 1'])
+
+    def test_filters_are_validated(self):
+        for path, params in (('/analog-devices/', {'protocol': 'zigbee'}), ('/analog-devices/', {'room': 'kitchen'}),
+                             ('/smart-devices/', {'active': 'yes'}), ('/digital-devices/', {'kind': 'digital'}),
+                             ('/devices/', {'ordering': 'value'}), ('/rooms/', {'ordering': 'owner__password'})):
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 400, (path, params))
+            self.assertEqual(list(response.data), list(params))
+
+    def test_rooms_are_filtered_and_cached_per_query(self):
+        self.assertEqual(self.names('/rooms/'), ['Kitchen', 'Hall'])
+        self.assertEqual(self.names('/rooms/', name='kit'), ['Kitchen'])
+        self.assertEqual(self.names('/rooms/', ordering='name'), ['Hall', 'Kitchen'])
+        self.assertEqual(self.names('/rooms/'), ['Kitchen', 'Hall'])
+
+        # Parameters the list ignores share its cache entry.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('/rooms/', x=1), ['Kitchen', 'Hall'])
+            self.assertEqual(self.names('/rooms/', ordering='name', x=2), ['Hall', 'Kitchen'])
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are specific to the database.")
+    def test_dashboard_queries_are_index_only(self):
+        for queryset, index in (
+            (AnalogDevice.objects.filter(room_id__in=[self.kitchen.pk], active=True), 'analog_device_room_active_idx'),
+            (DigitalDevice.objects.filter(room=self.kitchen).order_by('name'), 'digital_device_room_name_idx'),
+            (SmartDevice.objects.filter(protocol_name='wifi'), 'smart_device_protocol_idx'),
+        ):
+            self.assertIn(f'USING COVERING INDEX {index}', queryset.values('id').explain())
+
+
+class ResolveDevicesTests(TestCase):
+    def setUp(self):
+        resolver.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = create_room_with_devices(self.user)
+        self.analog = room.analog_devices.get()
+        self.digital = room.digital_devices.get()
+        self.foreign = create_room_with_devices(User.objects.create_user(username='other', password='password'))
+
+    def resolve(self, *mac_addresses):
+        return self.client.post('/devices/resolve/', {'mac_addresses': list(mac_addresses)}, format='json')
+
+    def test_resolves_any_notation_to_the_users_devices(self):
+        foreign_mac = self.foreign.analog_devices.get().mac_address
+        upper = self.analog.mac_address.upper().replace(':', '-')
+
+        response = self.resolve(upper, foreign_mac, '02:ff:ff:ff:ff:ff', 'not-a-mac')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['devices'], {
+            upper: [{'type': 'analog', 'id': self.analog.id}, {'type': 'digital', 'id': self.digital.id},
+                    {'type': 'smart', 'id': self.analog.room.smart_devices.get().id}],
+            foreign_mac: [],
+            '02:ff:ff:ff:ff:ff': [],
+        })
+        self.assertEqual(response.data['invalid'], ['not-a-mac'])
+
+        with self.assertNumQueries(0):
+            resolver.resolve_mac_addresses([self.analog.mac_address, '02:ff:ff:ff:ff:ff'])
+
+    def test_device_changes_invalidate_cached_lookups(self):
+        self.resolve(self.analog.mac_address, '02:ff:ff:ff:ff:ff')
+
+        previous_mac = self.analog.mac_address
+        self.analog.mac_address = '02FF.FFFF.FFFF'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.analog.save()
+        self.assertEqual(self.analog.mac_address, '02:ff:ff:ff:ff:ff')
+
+        response = self.resolve(previous_mac, '02:ff:ff:ff:ff:ff')
+        self.assertEqual(len(response.data['devices'][previous_mac]), 2)
+        self.assertEqual(response.data['devices']['02:ff:ff:ff:ff:ff'], [{'type': 'analog', 'id': self.analog.id}])
+
+    def test_one_mac_address_resolves_to_a_device_of_every_kind(self):
+        mac_address = self.analog.mac_address.upper().replace(':', '')
+
+        response = self.resolve(mac_address)
+        self.assertEqual([match['type'] for match in response.data['devices'][mac_address]],
+                         ['analog', 'digital', 'smart'])
+
+        response = self.client.get('/devices/', {'mac_address': mac_address})
+        self.assertEqual([device['type'] for device in response.data['results']], ['Analog', 'Digital', 'Smart'])
+        response = self.client.get('/analog-devices/', {'mac_address': mac_address})
+        self.assertEqual([device['id'] for device in response.data], [self.analog.id])
+        response = self.client.get('/devices/', {'mac_address': 'mac'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_mac_addresses_are_validated_and_unique_per_kind(self):
+        data = {'name': 'Copy', 'ip': '192.168.100.20', 'room': self.analog.room_id}
+
+        response = self.client.post('/analog-devices/', {**data, 'mac_address': self.analog.mac_address.upper()})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/analog-devices/', {**data, 'mac_address': 'mac'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RoomOwnershipTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        invalidate_room_owners([self.owner.pk, self.other.pk])
+        self.room = Room.objects.create(name='Room', owner=self.owner)
+
+    def test_owned_rooms_are_cached_and_invalidated(self):
+        self.assertTrue(owns_room(self.owner, self.room.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(owns_room(self.owner, self.room.pk))
+        self.assertFalse(owns_room(self.other, self.room.pk))
+
+        self.room.owner = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.save()
+
+        self.assertFalse(owns_room(self.owner, self.room.pk))
+        self.assertTrue(owns_room(self.other, self.room.pk))
+
+    def test_rooms_missing_from_the_cache_are_looked_up(self):
+        owns_room(self.owner, self.room.pk)
+        # Created without signals, as if by another process.
+        Room.objects.bulk_create([Room(name='New', owner=self.owner)])
+        new_room = Room.objects.get(name='New')
+
+        self.assertTrue(owns_room(self.owner, new_room.pk))
+
+
+class FastListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = create_room_with_devices(self.user, devices_per_type=3)
+        SmartDevice.objects.create(protocol_name='zigbee', mac_address=mac_address(1), name='Idle',
+                                   ip='192.168.100.13', room=room)
+
+    def assertSameOutput(self, url, params=None):
+        expected = self.client.get(url, params)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {**(params or {}), 'fast': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(response.content)
+        if isinstance(data, dict):
+            # Page links keep the fast path.
+            for link in ('next', 'previous'):
+                if data[link] is not None:
+                    self.assertIn('fast=1', data[link])
+                    data[link] = data[link].replace('&fast=1', '').replace('fast=1&', '').replace('?fast=1', '')
+        self.assertEqual(data, json.loads(expected.content))
+        return queries
+
+    def test_device_lists_match_the_serializers(self):
+        for url in ('/analog-devices/', '/digital-devices/', '/smart-devices/'):
+            queries = self.assertSameOutput(url)
+            self.assertEqual(len(queries), 1)
+
+    def test_value_lists_match_the_serializers_and_paginate(self):
+        self.assertSameOutput('/analog-values/')
+        self.assertSameOutput('/smart-values/', {'ordering': 'timestamp', 'page_size': 2})
+
+        next_page = urlsplit(json.loads(self.client.get('/digital-values/', {'page_size': 2}).content)['next'])
+        self.assertSameOutput(next_page.path, dict(parse_qsl(next_page.query)))
+
+
+class DeviceStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(name='Room', owner=self.user)
+        self.device = AnalogDevice.objects.create(mac_address=mac_address(1), name='Thermometer', ip='192.168.100.10',
+                                                  room=self.room)
+
+    def get_state(self):
+        return DeviceState.objects.get(kind=DeviceKind.ANALOG, device_id=self.device.id).value
+
+    def test_writes_update_current_state(self):
+        self.client.post('/analog-values/', {'device': f'/analog-devices/{self.device.id}/', 'value': 20.5})
+        response = self.client.post('/analog-values/', {'device': f'/analog-devices/{self.device.id}/', 'value': 21})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_state(), 21.0)
+
+        self.client.delete(f"/analog-values/{response.data['id']}/")
+        self.assertEqual(self.get_state(), 20.5)
+
+        response = self.client.get(f'/analog-devices/{self.device.id}/')
+        self.assertEqual(response.data['value'], 20.5)
+
+    def test_late_readings_do_not_replace_newer_state(self):
+        device_url = f'/analog-devices/{self.device.id}/'
+        self.client.post('/analog-values/', {'device': device_url, 'value': 20.5})
+        self.client.post('/analog-values/', {'device': device_url, 'value': 3.0,
+                                             'timestamp': timezone.now() - timedelta(hours=1)})
+
+        self.assertEqual(self.get_state(), 20.5)
+
+    def test_upsert_leaves_conflict_target_to_backends_without_one(self):
+        value = AnalogValues(device=self.device, value=20.5, timestamp=timezone.now())
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(DeviceState.objects, 'bulk_create') as bulk_create:
+            update_current_state(DeviceKind.ANALOG, [value])
+
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+
+    def test_deleting_device_removes_its_state(self):
+        self.client.post('/analog-values/', {'device': f'/analog-devices/{self.device.id}/', 'value': 20.5})
+
+        self.client.delete(f'/analog-devices/{self.device.id}/')
+
+        self.assertFalse(DeviceState.objects.exists())
+
+    def test_rebuild_command_restores_state_from_history(self):
+        AnalogValues.objects.create(device=self.device, value=1.0)
+        AnalogValues.objects.create(device=self.device, value=3.0)
+
+        call_command('rebuild_device_state', stdout=StringIO())
+
+        self.assertEqual(self.get_state(), 3.0)
+
+
+class BulkValuesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = create_room_with_devices(self.user)
+        self.analog = room.analog_devices.get()
+        self.digital = room.digital_devices.get()
+        self.smart = room.smart_devices.get()
+        foreign_owner = User.objects.create_user(username='other', password='password')
+        self.foreign = create_room_with_devices(foreign_owner).analog_devices.get()
+
+    def test_stores_valid_readings_and_reports_invalid_ones(self):
+        readings = [{'type': 'analog', 'device': self.analog.id, 'value': 10 + i} for i in range(100)] + [
+            {'type': 'digital', 'device': self.digital.id, 'value': False},
+            {'type': 'smart', 'device': self.smart.id, 'value': 'Off'},
+            {'type': 'analog', 'device': self.analog.id, 'value': 'warm'},
+            {'type': 'analog', 'device': self.foreign.id, 'value': 1},
+            {'type': 'thermal', 'device': self.analog.id, 'value': 1},
+        ]
+
+        response = self.client.post('/values/bulk/', {'readings': readings}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], {'analog': 100, 'digital': 1, 'smart': 1})
+        self.assertEqual([error['index'] for error in response.data['errors']], [102, 103, 104])
+        self.assertEqual(AnalogValues.objects.filter(device=self.analog).count(), 102)
+        self.assertEqual(DeviceState.objects.get(kind=DeviceKind.ANALOG, device_id=self.analog.id).value, 109.0)
+        self.assertEqual(DeviceState.objects.get(kind=DeviceKind.SMART, device_id=self.smart.id).value, 'Off')
+
+    def test_rejects_batch_without_valid_readings(self):
+        response = self.client.post('/values/bulk/', [{'type': 'analog', 'device': self.foreign.id, 'value': 1}],
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(AnalogValues.objects.filter(device=self.foreign).count(), 2)
+
+
+class BinaryFormatTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = create_room_with_devices(self.user, devices_per_type=2)
+        self.analog = room.analog_devices.first()
+        foreign_owner = User.objects.create_user(username='other', password='password')
+        self.foreign = create_room_with_devices(foreign_owner).analog_devices.get()
+
+    def test_msgpack_responses_match_json(self):
+        for url in ('/analog-devices/', '/smart-devices/?fast=1', '/analog-values/', '/rooms/'):
+            with self.subTest(url=url):
+                expected = json.loads(self.client.get(url).content)
+                response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content), expected)
+
+    def test_room_tree_etag_depends_on_format(self):
+        json_response = self.client.get('/rooms/')
+        response = self.client.get('/rooms/', HTTP_ACCEPT='application/msgpack')
+
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+        self.assertIn('Accept', response['Vary'])
+        response = self.client.get('/rooms/', HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_posts_msgpack(self):
+        body = msgpack.packb({'device': f'http://testserver/analog-devices/{self.analog.id}/', 'value': 21.5})
+
+        response = self.client.post('/analog-values/', body, content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)['value'], 21.5)
+
+        response = self.client.post('/analog-values/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ingests_packed_batch(self):
+        taken_at = datetime(2024, 5, 1, 12, tzinfo=dt_timezone.utc)
+        records = numpy.array([
+            (self.analog.id, taken_at.timestamp(), 19.0),
+            (self.analog.id, taken_at.timestamp() + 60, 19.5),
+            (self.analog.id, taken_at.timestamp() + 120, float('nan')),
+            (self.foreign.id, taken_at.timestamp(), 1.0),
+        ], dtype=ANALOG_RECORD)
+
+        response = self.client.post('/values/bulk/', records.tobytes(), content_type=ANALOG_BATCH_MEDIA_TYPE)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created']['analog'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 3])
+        self.assertEqual(AnalogValues.objects.get(device=self.analog, value=19.5).timestamp,
+                         taken_at + timedelta(minutes=1))
+
+        response = self.client.post('/values/bulk/', records.tobytes()[:-1], content_type=ANALOG_BATCH_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 400)
+
+    def test_lists_packed_batches(self):
+        values = AnalogValues.objects.filter(device__room__owner=self.user).order_by('-id')
+
+        response = self.client.get('/analog-values/?page_size=3', HTTP_ACCEPT=ANALOG_BATCH_MEDIA_TYPE)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], ANALOG_BATCH_MEDIA_TYPE)
+        records = numpy.frombuffer(response.content, dtype=ANALOG_RECORD)
+        self.assertEqual([(int(device), value) for device, _, value in records.tolist()],
+                         [(value.device_id, value.value) for value in values[:3]])
+        self.assertEqual(records['timestamp'][0], values[0].timestamp.timestamp())
+
+        next_url = response['Link'].partition('>')[0].lstrip('<')
+        response = self.client.get(next_url, HTTP_ACCEPT=ANALOG_BATCH_MEDIA_TYPE)
+        self.assertEqual(len(response.content), ANALOG_RECORD.itemsize)
+        self.assertNotIn('rel="next"', response['Link'])
+
+    def test_packed_batches_are_only_offered_for_lists(self):
+        response = self.client.get('/analog-values/?start=yesterday', HTTP_ACCEPT=ANALOG_BATCH_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        value = AnalogValues.objects.filter(device=self.analog).first()
+        response = self.client.get(f'/analog-values/{value.id}/', HTTP_ACCEPT=ANALOG_BATCH_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 406)
+
+
+class SceneTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = create_room_with_devices(self.user, devices_per_type=3)
+        self.other_room = create_room_with_devices(self.user, name='Other')
+        foreign_owner = User.objects.create_user(username='other', password='password')
+        self.foreign = create_room_with_devices(foreign_owner).smart_devices.get()
+
+    def test_activates_rooms_and_devices_with_one_update_per_table(self):
+        smart = self.other_room.smart_devices.get()
+        sent = []
+        devices_changed.connect(lambda **kwargs: sent.append(kwargs['devices']), weak=False, dispatch_uid='scene')
+        self.addCleanup(devices_changed.disconnect, dispatch_uid='scene')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/devices/scene/', {
+                    'active': True, 'rooms': [self.room.id], 'devices': {'smart': [smart.id, self.foreign.id]},
+                }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], 10)
+        self.assertEqual(response.data['not_found'], {'smart': [self.foreign.id]})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 3)
+        self.assertFalse(self.room.analog_devices.filter(active=False).exists())
+        self.assertTrue(SmartDevice.objects.get(pk=smart.pk).active)
+        self.assertFalse(SmartDevice.objects.get(pk=self.foreign.pk).active)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sum(len(devices) for devices in sent[0].values()), 10)
+
+    def test_unchanged_devices_are_not_updated(self):
+        self.client.post('/devices/scene/', {'active': True, 'rooms': [self.room.id]}, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/devices/scene/', {'active': True, 'rooms': [self.room.id]}, format='json')
+
+        self.assertEqual(response.data['changed'], 0)
+        self.assertEqual(len(response.data['devices']), 9)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+
+    def test_rejects_empty_selection(self):
+        response = self.client.post('/devices/scene/', {'active': True, 'devices': {'thermal': [1]}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ChangeOnlyStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.device = DigitalDevice.objects.create(mac_address=mac_address(1), name='Door', ip='192.168.100.10',
+                                                   room=Room.objects.create(name='Hall', owner=self.user))
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def post_readings(self, states):
+        readings = [{'type': 'digital', 'device': self.device.id, 'value': value,
+                     'timestamp': (self.start + timedelta(minutes=minute)).isoformat()}
+                    for minute, value in states]
+        return self.client.post('/values/bulk/', readings, format='json')
+
+    def test_stores_only_transitions_and_tracks_last_seen(self):
+        response = self.post_readings([(0, False), (1, False), (2, True), (3, True), (4, True)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['unchanged']),
+                         ({'analog': 0, 'digital': 2, 'smart': 0}, {'analog': 0, 'digital': 3, 'smart': 0}))
+
+        response = self.post_readings([(5, True), (6, True)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created']['digital'], 0)
+
+        self.assertEqual(list(self.device.digitalvalues_set.order_by('timestamp').values_list('value', flat=True)),
+                         [False, True])
+        state = DeviceState.objects.get(kind=DeviceKind.DIGITAL, device_id=self.device.id)
+        self.assertEqual((state.value, state.updated_at, state.last_seen),
+                         (True, self.start + timedelta(minutes=2), self.start + timedelta(minutes=6)))
+
+    def test_state_at_and_time_in_state_from_transitions(self):
+        self.post_readings([(0, False), (10, True), (40, False)])
+        url = f'/digital-devices/{self.device.id}/'
+
+        response = self.client.get(f'{url}state/', {'at': (self.start + timedelta(minutes=20)).isoformat()})
+        self.assertEqual((response.data['value'], response.data['since']), (True, self.start + timedelta(minutes=10)))
+
+        response = self.client.get(f'{url}time-in-state/', {'start': (self.start + timedelta(minutes=5)).isoformat(),
+                                                            'end': (self.start + timedelta(minutes=50)).isoformat()})
+        self.assertEqual(response.data['states'], [{'value': False, 'seconds': 900.0},
+                                                   {'value': True, 'seconds': 1800.0}])
+
+
+class InProcessBroker:
+    """Stand-in for an MQTT broker that delivers published messages to clients subscribed to a `prefix/+` filter."""
+
+    def __init__(self):
+        self.messages = deque()
+        self.drop_connections = False
+        self.refused_connections = 0
+
+    def publish(self, topic, payload):
+        self.messages.append(SimpleNamespace(topic=topic, payload=payload))
+
+
+class InProcessClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.subscriptions = []
+        self.connected = False
+        self.on_connect = self.on_message = None
+
+    def connect(self, host, port, keepalive):
+        return self.reconnect()
+
+    def reconnect(self):
+        if self.broker.refused_connections:
+            self.broker.refused_connections -= 1
+            raise ConnectionRefusedError
+        self.connected = True
+        self.on_connect(self, None, {}, 0)
+        return 0
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def loop(self, timeout=1.0):
+        if self.broker.drop_connections:
+            self.broker.drop_connections = False
+            self.connected = False
+            return 7
+
+        while self.broker.messages:
+            message = self.broker.messages.popleft()
+            if any(message.topic.startswith(topic[:-1]) for topic in self.subscriptions):
+                self.on_message(self, None, message)
+        return 0
+
+    def disconnect(self):
+        self.connected = False
+
+
+class MqttIngestWorkerTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='password')
+        room = Room.objects.create(name='Room', owner=owner)
+        self.analog = AnalogDevice.objects.create(mac_address='AA:00:00:00:00:01', name='Thermometer',
+                                                  ip='192.168.100.10', room=room)
+        self.digital = DigitalDevice.objects.create(mac_address='aa:00:00:00:00:02', name='Door',
+                                                    ip='192.168.100.11', room=room)
+        self.broker = InProcessBroker()
+        self.client = InProcessClient(self.broker)
+        self.worker = MqttIngestWorker(self.client, 'localhost', batch_size=10, sleep=lambda delay: None)
+
+    def test_buffers_readings_and_flushes_in_batches(self):
+        for i in range(25):
+            self.broker.publish('smart_home/devices/aa:00:00:00:00:01', str(i))
+        self.broker.publish('smart_home/devices/AA:00:00:00:00:02', b'{"value": true}')
+        self.broker.publish('smart_home/devices/aa:00:00:00:00:03', b'1')
+        self.broker.publish('smart_home/devices/aa:00:00:00:00:01', b'not json')
+
+        self.worker.run(max_iterations=1)
+
+        self.assertEqual(AnalogValues.objects.filter(device=self.analog).count(), 25)
+        self.assertTrue(DigitalValues.objects.get(device=self.digital).value)
+        self.assertEqual(DeviceState.objects.get(kind=DeviceKind.ANALOG, device_id=self.analog.id).value, 24.0)
+        self.assertEqual(self.worker.stats, {'received': 28, 'stored': 26, 'unchanged': 0, 'rejected': 2, 'retried': 0,
+                                             'dropped': 0})
+
+    def test_applies_backpressure_when_buffer_is_full(self):
+        self.worker.max_pending = 10
+        for i in range(15):
+            self.broker.publish('smart_home/devices/aa:00:00:00:00:01', str(i))
+
+        self.client.reconnect()
+        self.client.loop()
+
+        self.assertEqual(AnalogValues.objects.count(), 10)
+        self.assertEqual(self.worker.pending_count, 5)
+
+    def test_retries_readings_after_database_errors(self):
+        self.worker.max_pending = 12
+        for i in range(10):
+            self.broker.publish('smart_home/devices/aa:00:00:00:00:01', str(i))
+        self.client.reconnect()
+        self.client.loop()
+
+        self.broker.publish('smart_home/devices/aa:00:00:00:00:01', b'10')
+        self.broker.publish('smart_home/devices/aa:00:00:00:00:09', b'1')
+        self.worker.directory.loaded_at = None
+        with self.assertLogs('manage_devices.mqtt', 'ERROR'), \
+                mock.patch('manage_devices.mqtt.store_values', side_effect=DatabaseError), \
+                mock.patch.object(self.worker.directory, 'load', side_effect=DatabaseError):
+            self.worker.flush()
+            self.client.loop()
+
+        self.assertEqual(self.worker.pending_count, 11)
+        self.worker.flush()
+        self.assertEqual(list(AnalogValues.objects.filter(device=self.analog).order_by('timestamp')
+                              .values_list('value', flat=True)), list(range(11)))
+        self.assertEqual((self.worker.stats['retried'], self.worker.stats['dropped']), (10, 1))
+
+    def test_reconnects_and_resubscribes_after_connection_loss(self):
+        delays = []
+        self.worker.sleep = delays.append
+        self.broker.publish('smart_home/devices/aa:00:00:00:00:01', b'1.5')
+        self.broker.drop_connections = True
+        self.broker.refused_connections = 2
+
+        self.worker.run(max_iterations=2)
+
+        self.assertEqual(delays, [1.0, 2.0])
+        self.assertEqual(self.client.subscriptions, ['smart_home/devices/+', 'smart_home/devices/+'])
+        self.assertEqual(AnalogValues.objects.get().value, 1.5)
+
+
+class ValueHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = Room.objects.create(name='Room', owner=self.user)
+        self.device = AnalogDevice.objects.create(mac_address=mac_address(1), name='Thermometer', ip='192.168.100.10',
+                                                  room=room)
+        for day in range(1, 4):
+            AnalogValues.objects.create(device=self.device, value=day,
+                                        timestamp=timezone.make_aware(datetime(2023, 11, day, 12)))
+        AnalogValues.objects.create(device=self.device, value=31,
+                                    timestamp=timezone.make_aware(datetime(2023, 10, 31, 12)))
+
+    def test_filters_values_by_time_range(self):
+        response = self.client.get('/analog-values/', {'device': self.device.id, 'start': '2023-11-02T00:00:00',
+                                                       'end': '2023-11-03T12:00:00'})
+
+        self.assertEqual([value['value'] for value in response.data['results']], [2.0])
+
+        response = self.client.get('/analog-values/', {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_through_history_with_cursor(self):
+        seen = []
+        url = '/analog-values/?page_size=3&ordering=timestamp'
+        while url:
+            response = self.client.get(url)
+            seen += [value['value'] for value in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, [31, 1, 2, 3])
+
+    def test_streams_history_as_ndjson_and_csv(self):
+        response = self.client.get('/analog-values/', {'stream': 'ndjson', 'ordering': '-timestamp'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['value'] for line in lines], [3, 2, 1, 31])
+        self.assertEqual(json.loads(lines[0])['device'], self.device.id)
+
+        response = self.client.get('/analog-values/', {'stream': 'csv', 'start': '2023-11-02T00:00:00'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+        self.assertEqual(rows[0], ['id', 'device', 'value', 'timestamp'])
+        # Newest first, as the pages.
+        self.assertEqual([row[2] for row in rows[1:]], ['3.0', '2.0'])
+
+    def test_stream_reads_in_bounded_chunks(self):
+        with self.assertNumQueries(3):
+            chunks = list(keyset_chunks(AnalogValues.objects.all(), ['value'], '-timestamp', chunk_size=2))
+
+        self.assertEqual(chunks, [[(3,), (2,)], [(1,), (31,)]])
+
+
+class ValueExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = create_room_with_devices(self.user, devices_per_type=2)
+
+    def load_npz(self, content):
+        with numpy.load(BytesIO(content)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def test_exports_room_history_as_npz(self):
+        response = self.client.get('/analog-values/export/', {'room': self.room.id, 'file_format': 'npz'})
+
+        self.assertEqual(response.status_code, 200)
+        arrays = self.load_npz(b''.join(response.streaming_content))
+        self.assertEqual(arrays['value'].dtype, numpy.float64)
+        self.assertEqual(sorted(arrays['value'].tolist()), [1.0, 1.0, 2.5, 2.5])
+        self.assertEqual(set(arrays['device'].tolist()), set(self.room.analog_devices.values_list('pk', flat=True)))
+        self.assertEqual(arrays['timestamp'].dtype, numpy.dtype('datetime64[us]'))
+
+    def test_command_exports_smart_values_dictionary_encoded_in_chunks(self):
+        device = self.room.smart_devices.first()
+        SmartValues.objects.create(device=device, value='Off')
+        SmartValues.objects.create(device=device, value='On')
+        output = StringIO()
+
+        with tempfile.NamedTemporaryFile(suffix='.npz') as file:
+            call_command('export_values', '--kind', 'smart', '--device', device.id, '--format', 'npz',
+                         '--chunk-size', '2', file.name, stdout=output)
+            arrays = self.load_npz(open(file.name, 'rb').read())
+
+        self.assertIn("Exported 3 smart values", output.getvalue())
+        self.assertEqual(arrays['categories'][arrays['value']].tolist(), ['On', 'Off', 'On'])
+
+    @skipUnless(export.pyarrow, "pyarrow is not installed")
+    def test_exports_parquet_and_arrow(self):
+        for file_format in ('parquet', 'arrow'):
+            response = self.client.get('/digital-values/export/', {'room': self.room.id, 'file_format': file_format})
+            content = export.pyarrow.BufferReader(b''.join(response.streaming_content))
+            if file_format == 'parquet':
+                table = export.pyarrow.parquet.read_table(content)
+            else:
+                table = export.pyarrow.ipc.open_file(content).read_all()
+
+            self.assertEqual(table.column_names, ['device', 'timestamp', 'value'])
+            self.assertEqual(sorted(table.column('value').to_pylist()), [False, False, True, True])
+
+    def test_requires_a_device_or_room(self):
+        self.assertEqual(self.client.get('/analog-values/export/').status_code, 400)
+        self.assertEqual(self.client.get('/analog-values/export/', {'room': self.room.id, 'file_format': 'xls'})
+                         .status_code, 400)
+
+
+class ValueArchiveTests(TransactionTestCase):
+    # The schema editor cannot run inside the transaction wrapping a TestCase on SQLite.
+    setUp = ValueHistoryTests.setUp
+
+    def test_archives_and_drops_whole_months(self):
+        call_command('archive_values', '--before', '2023-11', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(list_archives(AnalogValues), [(2023, 10)])
+        self.assertEqual(list(AnalogValues.objects.values_list('value', flat=True).order_by('value')), [1, 2, 3])
+        self.assertEqual(list(archive_model(AnalogValues, 2023, 10).objects.values_list('value', flat=True)), [31])
+
+        call_command('archive_values', '--drop', '2023-10', stdout=StringIO())
+
+        self.assertEqual(list_archives(AnalogValues), [])
+        self.assertNotIn('manage_devices_analogvalues_202310', connection.introspection.table_names())
+
+
+class RetentionTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.room = create_room_with_devices(self.user)
+        self.kept_room = create_room_with_devices(self.user, name='Lab')
+        self.now = timezone.now()
+        for room in (self.room, self.kept_room):
+            device = room.analog_devices.get()
+            store_values(DeviceKind.ANALOG, [
+                AnalogValues(device=device, value=1000 + days, timestamp=self.now - timedelta(days=days))
+                for days in (1, 10, 400)
+            ])
+
+    def test_deletes_expired_history_in_chunks_and_reports_it(self):
+        archive_month(AnalogValues, 2020, 1)
+        RetentionPolicy.objects.create(kind=DeviceKind.ANALOG, raw_retention=timedelta(days=7),
+                                       rollup_retention=timedelta(days=365))
+        RetentionPolicy.objects.create(room=self.kept_room, raw_retention=None)
+        RetentionPolicy.objects.create(kind=DeviceKind.ANALOG, room=self.kept_room, raw_retention=timedelta(days=30))
+        output = StringIO()
+
+        call_command('compact_values', '--kind', 'analog', '--batch-size', '1', stdout=output)
+
+        remaining = AnalogValues.objects.filter(value__gt=1000).order_by('value')
+        self.assertEqual(list(remaining.filter(device__room=self.room).values_list('value', flat=True)), [1001])
+        self.assertEqual(list(remaining.filter(device__room=self.kept_room).values_list('value', flat=True)),
+                         [1001, 1010])
+        old_rollups = AnalogRollup.objects.filter(bucket__lt=self.now - timedelta(days=366))
+        self.assertEqual(list(old_rollups.values_list('device__room', flat=True).distinct()), [self.kept_room.id])
+        self.assertTrue(AnalogRollup.objects.filter(device__room=self.room, last=1010).exists())
+        self.assertEqual(list_archives(AnalogValues), [])
+        self.assertIn("Reclaimed 3 rows", output.getvalue())
+        self.assertIn("(table dropped)", output.getvalue())
+
+    def test_dry_run_deletes_nothing(self):
+        RetentionPolicy.objects.create(raw_retention=timedelta(days=7))
+
+        call_command('compact_values', '--dry-run', stdout=StringIO())
+
+        self.assertEqual(AnalogValues.objects.count(), 10)
+
+    def test_table_stats_are_unknown_when_the_database_cannot_tell(self):
+        self.assertEqual(table_stats('no_such_table'), (None, None))
+
+    def test_keeps_the_latest_transition_of_change_only_devices(self):
+        device = self.room.digital_devices.get()
+        switched_on = datetime(2020, 1, 20, tzinfo=dt_timezone.utc)
+        # The device was switched on long ago and has been stable ever since.
+        DigitalValues.objects.filter(device=device).delete()
+        store_values(DeviceKind.DIGITAL, [
+            DigitalValues(device=device, value=False, timestamp=switched_on - timedelta(days=10)),
+            DigitalValues(device=device, value=True, timestamp=switched_on),
+        ], changes_only=False)
+        RetentionPolicy.objects.create(kind=DeviceKind.DIGITAL, raw_retention=timedelta(days=7))
+
+        self.assertEqual(archive_month(DigitalValues, 2020, 1, keep_latest=True), 1)
+        call_command('compact_values', '--kind', 'digital', stdout=StringIO())
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/digital-devices/{device.id}/state/')
+        self.assertEqual((response.data['value'], response.data['since']), (True, switched_on))
+
+
+class AnalogRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        room = Room.objects.create(name='Room', owner=self.user)
+        self.device = AnalogDevice.objects.create(mac_address=mac_address(1), name='Thermometer', ip='192.168.100.10',
+                                                  room=room)
+        readings = [{'type': 'analog', 'device': self.device.id, 'value': minute % 7,
+                     'timestamp': f'2023-11-04T{10 + minute // 60:02d}:{minute % 60:02d}:30Z'} for minute in range(150)]
+        self.client.post('/values/bulk/', readings[:100], format='json')
+        self.client.post('/values/bulk/', readings[100:], format='json')
+
+    def rollups(self):
+        return sorted(AnalogRollup.objects.values_list('resolution', 'bucket', 'count', 'sum', 'min', 'max', 'last'))
+
+    def test_ingest_maintains_rollups_of_every_resolution(self):
+        hours = AnalogRollup.objects.filter(resolution=AnalogRollup.Resolution.HOUR).order_by('bucket')
+
+        self.assertEqual(AnalogRollup.objects.filter(resolution=AnalogRollup.Resolution.MINUTE).count(), 150)
+        self.assertEqual([(rollup.count, rollup.min, rollup.max, rollup.last) for rollup in hours],
+                         [(60, 0, 6, 3), (60, 0, 6, 0), (30, 0, 6, 2)])
+        self.assertEqual(AnalogRollup.objects.get(resolution=AnalogRollup.Resolution.DAY).avg,
+                         sum(minute % 7 for minute in range(150)) / 150)
+
+    def test_writers_of_a_new_bucket_add_up(self):
+        taken_at = datetime(2023, 11, 5, 8, 0, 10, tzinfo=dt_timezone.utc)
+        # Both writers aggregate their values before either stored the bucket.
+        values = [AnalogValues(device=self.device, value=4.0, timestamp=taken_at),
+                  AnalogValues(device=self.device, value=1.0, timestamp=taken_at - timedelta(seconds=5))]
+        batches = [list(rollups.aggregate([value]).values()) for value in values]
+
+        for batch in batches:
+            rollups.save_rollups(batch)
+
+        rollup = AnalogRollup.objects.get(resolution=AnalogRollup.Resolution.MINUTE, bucket=taken_at.replace(second=0))
+        self.assertEqual((rollup.count, rollup.sum, rollup.min, rollup.max, rollup.last), (2, 5.0, 1.0, 4.0, 4.0))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        incremental = self.rollups()
+
+        call_command('rebuild_rollups', '--batch-size', '7', stdout=StringIO())
+
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_aggregate_picks_resolution_from_point_budget(self):
+        params = {'device': self.device.id, 'start': '2023-11-04T10:00:00Z', 'end': '2023-11-04T13:00:00Z'}
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/analog-values/aggregate/', {**params, 'points': 200})
+        self.assertEqual(response.data['resolution'], 60)
+        self.assertEqual(len(response.data['buckets']), 150)
+
+        response = self.client.get('/analog-values/aggregate/', {**params, 'points': 10})
+        self.assertEqual(response.data['resolution'], 3600)
+        self.assertEqual([bucket['count'] for bucket in response.data['buckets']], [60, 60, 30])
+
+    def test_deleting_a_value_refreshes_its_buckets(self):
+        value = AnalogValues.objects.get(timestamp=datetime(2023, 11, 4, 12, 29, 30, tzinfo=dt_timezone.utc))
+
+        self.client.delete(f'/analog-values/{value.id}/')
+
+        bucket = datetime(2023, 11, 4, 12, tzinfo=dt_timezone.utc)
+        self.assertEqual(AnalogRollup.objects.get(resolution=AnalogRollup.Resolution.HOUR, bucket=bucket).count, 29)
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = create_room_with_devices(self.user, devices_per_type=2)
+        self.device = self.room.analog_devices.first()
+        self.start = timezone.now() - timedelta(hours=2)
+        # One reading a minute rising by 1, with a spike at minute 30.
+        store_values(DeviceKind.ANALOG, [
+            AnalogValues(device=self.device, value=100.0 if minute == 30 else float(minute),
+                         timestamp=self.start + timedelta(minutes=minute))
+            for minute in range(60)
+        ])
+        self.params = {'start': self.start.isoformat(), 'end': (self.start + timedelta(hours=1)).isoformat()}
+
+    def test_device_statistics(self):
+        response = self.client.get(f'/analog-devices/{self.device.id}/analytics/', self.params)
+
+        statistics = response.data['devices'][0]
+        self.assertEqual(statistics['count'], 60)
+        self.assertEqual(statistics['max'], 100.0)
+        self.assertEqual(statistics['percentiles']['50'], 30.0)
+        self.assertAlmostEqual(statistics['rate_of_change']['max'], 71 / 60)
+        # Trapezoids of a minute each, plus the area the spike adds to the two around it.
+        self.assertAlmostEqual(statistics['integral'], sum(60 * (minute + 0.5) for minute in range(59)) + 70 * 60)
+        self.assertEqual(statistics['anomalies']['zscore'], [self.start + timedelta(minutes=30)])
+        self.assertIn(self.start + timedelta(minutes=30), statistics['anomalies']['ewma'])
+
+    def test_room_statistics_are_cached_until_new_readings(self):
+        url = f'/rooms/{self.room.id}/analytics/'
+        response = self.client.get(url, self.params)
+        self.assertEqual([device['count'] for device in response.data['devices']], [60, 0])
+
+        # The room and its devices.
+        with self.assertNumQueries(2):
+            self.client.get(url, self.params)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store_values(DeviceKind.ANALOG, [AnalogValues(device=self.device, value=5.0,
+                                                          timestamp=self.start + timedelta(minutes=59, seconds=30))])
+        # Only the values of the changed device are loaded again.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, self.params)
+        self.assertIn(f'IN ({self.device.id})', queries[-1]['sql'])
+        self.assertEqual(response.data['devices'][0]['count'], 61)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_follows_the_fixtures(self):
+        created = benchmark.seed(users=2, rooms_per_user=2, devices_per_room=3, values_per_device=4)
+
+        self.assertEqual(created['users'], 2)
+        self.assertEqual(created['rooms'], 4)
+        self.assertEqual(created['smartdevice'], 12)
+        self.assertEqual(created['digitalvalues'], 48)
+        self.assertEqual(set(Room.objects.values_list('name', flat=True)), {'Room_1', 'Room_2'})
+        self.assertTrue(SmartDevice.objects.filter(name='Switch Room 1', protocol_name='zigbee').exists())
+        self.assertEqual(set(SmartValues.objects.values_list('value', flat=True)), {'On', 'Off'})
+        self.assertEqual(DeviceState.objects.count(), 36)
+
+        self.assertEqual(benchmark.clear(), 2)
+        self.assertFalse(Room.objects.exists())
+
+    def test_report_covers_every_scenario(self):
+        benchmark.seed(users=2, rooms_per_user=1, devices_per_room=2, values_per_device=3)
+
+        for log_filter in auth_logger.filters:
+            log_filter.clear()
+        with self.assertLogs('accounts.auth', 'INFO'):
+            report = benchmark.run_benchmark(benchmark.InProcessTransport(host='testserver'),
+                                             ['rooms', 'analog-values', 'activate', 'login'], requests=2)
+
+        self.assertEqual(set(report['scenarios']), {'rooms', 'analog-values', 'activate', 'login'})
+        for result in report['scenarios'].values():
+            self.assertEqual(result['requests'], 2)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries']['max'], 0)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        json.dumps(report)
+
+    def test_compare_reports_flags_regressions(self):
+        def report(p95, throughput, queries, errors=0):
+            return {'scenarios': {'rooms': {'latency_ms': {'p95': p95}, 'throughput': throughput,
+                                            'queries': {'mean': queries, 'max': queries}, 'errors': errors}}}
+
+        self.assertEqual(benchmark.compare_reports(report(11, 95, 2), report(10, 100, 2)), [])
+        self.assertEqual(len(benchmark.compare_reports(report(20, 50, 3, errors=1), report(10, 100, 2))), 4)
+
+
+@override_settings(SMART_HOME_METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        create_room_with_devices(self.user, devices_per_type=2)
+
+    def test_requests_are_aggregated_per_view(self):
+        self.client.get('/analog-devices/')
+        self.client.get('/analog-devices/')
+        self.client.get('/analog-devices/0/')
+
+        metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+
+        self.assertIn('smart_home_requests_total{view="analogdevice-list",method="GET",status="200"} 2', metrics)
+        self.assertIn('smart_home_requests_total{view="analogdevice-detail",method="GET",status="404"} 1', metrics)
+        self.assertIn('smart_home_request_duration_seconds_count{view="analogdevice-list",method="GET"} 2', metrics)
+        self.assertIn('smart_home_request_duration_seconds_bucket{view="analogdevice-list",method="GET",le="+Inf"} 2',
+                      metrics)
+        self.assertIn('smart_home_db_queries_total{view="analogdevice-list",method="GET"} 2', metrics)
+        self.assertIn('smart_home_n_plus_one_requests_total{view="analogdevice-list",method="GET"} 0', metrics)
+        serializer_time = next(line for line in metrics.splitlines()
+                               if line.startswith('smart_home_serializer_seconds_total{view="analogdevice-list"'))
+        self.assertGreater(float(serializer_time.split()[-1]), 0)
+
+    def test_metrics_require_the_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer public').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.login(username='owner', password='password')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(SMART_HOME_METRICS_TOKEN=None, SMART_HOME_METRICS_PUBLIC=True)
+    def test_metrics_can_be_public(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 200)
+
+    @override_settings(SMART_HOME_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get('/rooms/')
+
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, '
+                                                    r'render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_repeated_queries_are_flagged(self):
+        def view(request):
+            for device in AnalogDevice.objects.all():
+                list(AnalogValues.objects.filter(device=device))
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/')
+        request.resolver_match = SimpleNamespace(view_name='n-plus-one')
+        with self.assertLogs('smart_home.metrics', 'WARNING') as logs:
+            with self.settings(SMART_HOME_N_PLUS_ONE_THRESHOLD=2):
+                MetricsMiddleware(view)(request)
+
+        self.assertIn('2 of 3 queries', logs.output[0])
+        self.assertIn('smart_home_n_plus_one_requests_total{view="n-plus-one",method="GET"} 1', registry.exposition())
+
+
+class RoomEventsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(name='Room', owner=self.user)
+        self.device = DigitalDevice.objects.create(mac_address=mac_address(1), name='Lamp', ip='192.168.100.10',
+                                                   room=self.room)
+        foreign_owner = User.objects.create_user(username='other', password='password')
+        self.foreign_room = Room.objects.create(name='Other', owner=foreign_owner)
+
+    def post_value(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/digital-values/', {'device': f'/digital-devices/{self.device.id}/', 'value': True})
+
+    async def test_pushes_value_changes_of_subscribed_rooms(self):
+        response = await self.async_client.get('/events/', {'rooms': f'{self.room.id},{self.foreign_room.id}'},
+                                               headers={'Authorization': f'Bearer {self.token}'})
+        events = response.streaming_content
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        self.assertTrue(get_broker().has_subscribers([room_channel(self.room.id)]))
+        self.assertFalse(get_broker().has_subscribers([room_channel(self.foreign_room.id)]))
+
+        await sync_to_async(self.post_value)()
+
+        event_type, data = (await anext(events)).decode().strip().split('\n')
+        self.assertEqual(event_type, 'event: value')
+        self.assertEqual(json.loads(data[len('data: '):])['value'], True)
+
+    async def test_stream_ends_after_max_age_and_unsubscribes(self):
+        events = [event async for event in event_stream([room_channel(self.room.id)], 0.01, 0.05)]
+
+        self.assertEqual(events[0], 'retry: 3000\n\n')
+        self.assertEqual(set(events[1:]), {': heartbeat\n\n'})
+        self.assertFalse(get_broker().has_subscribers())
+
+    async def test_rejects_unauthenticated_clients(self):
+        response = await self.async_client.get('/events/', {'ticket': 'invalid'})
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_accepts_tickets_but_no_access_tokens_in_the_url(self):
+        ticket = (await sync_to_async(self.client.post)('/events/ticket/')).data['ticket']
+
+        response = await self.async_client.get('/events/', {'ticket': ticket})
+        self.assertEqual(await anext(response.streaming_content), b'retry: 3000\n\n')
+        response = await self.async_client.get('/events/', {'ticket': self.token})
+        self.assertEqual(response.status_code, 401)
+        # Neither is a ticket an access token.
+        response = await sync_to_async(APIClient().get)('/rooms/', HTTP_AUTHORIZATION=f'Bearer {ticket}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_is_not_served_under_wsgi(self):
+        response = self.client.get('/events/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        self.assertEqual(response.status_code, 501)
+
+
+class ReadDatabaseLog:
+    """
+    The tables read by every query, with the alias the router chose for the request's reads.
+    """
+    def __init__(self):
+        self.reads = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith('SELECT'):
+            self.reads.append((read_database.get(), sql))
+        return execute(sql, params, many, context)
+
+    def database_reading(self, table):
+        return {alias for alias, sql in self.reads if f'"{table}"' in sql}
+
+
+# The test database stands in for a replica: the alias chosen for reads is recorded by ReadDatabaseLog.
+@override_settings(DATABASE_REPLICAS={'default': {}})
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = create_room_with_devices(self.user)
+        self.device = self.room.analog_devices.get()
+
+    def get(self, path):
+        log = ReadDatabaseLog()
+        with connection.execute_wrapper(log):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return log
+
+    def test_read_only_actions_read_from_replicas(self):
+        self.assertEqual(self.get('/analog-devices/').database_reading('manage_devices_analogdevice'), {'default'})
+        self.assertEqual(self.get('/analog-values/').database_reading('manage_devices_analogvalues'), {'default'})
+        # Actions filling caches read from the primary.
+        self.assertEqual(self.get('/rooms/').database_reading('manage_devices_room'), {None})
+        self.assertEqual(read_database.get(), None)
+
+    @override_settings(DATABASE_REPLICAS={})
+    def test_without_replicas_everything_reads_from_the_primary(self):
+        self.assertEqual(self.get('/analog-devices/').database_reading('manage_devices_analogdevice'), {None})
+
+    def test_writers_are_pinned_to_the_primary(self):
+        response = self.client.patch(f'/analog-devices/{self.device.pk}/activate/')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get('/analog-devices/').database_reading('manage_devices_analogdevice'), {None})
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.get('/analog-devices/').database_reading('manage_devices_analogdevice'), {'default'})
+
+        cache.delete(pin_key(self.user.pk))
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.get('/analog-devices/').database_reading('manage_devices_analogdevice'), {'default'})
+
+    def test_failed_writes_do_not_pin(self):
+        self.client.patch('/analog-devices/0/activate/')
+        self.assertIsNone(cache.get(pin_key(self.user.pk)))
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_write(Room), 'default')
+        self.assertIsNone(router.db_for_read(Room))
+        with override_settings(DATABASE_REPLICAS={'replica': {}}):
+            self.assertFalse(router.allow_migrate('replica', 'manage_devices'))
+            self.assertTrue(router.allow_migrate('default', 'manage_devices'))
+
+
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.device = create_room_with_devices(self.user).analog_devices.get()
+        AnalogValues.objects.all().delete()
+        # Not started: flushed by the tests, which the flusher thread could not see the data of.
+        self.buffer = writebehind.WriteBehindBuffer(capacity=3, batch_size=2)
+        patcher = mock.patch.object(writebehind, 'get_buffer', return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, value, device=None):
+        return self.client.post('/analog-values/', {
+            'device': f'http://testserver/analog-devices/{(device or self.device).pk}/', 'value': value,
+        }, format='json')
+
+    def reading(self, value):
+        return AnalogValues(device=self.device, value=value, timestamp=timezone.now())
+
+    def test_posts_are_acknowledged_before_they_are_stored(self):
+        response = self.post(21.5)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.data['id'])
+        self.assertFalse(AnalogValues.objects.exists())
+        self.assertEqual(DeviceState.objects.get(kind=DeviceKind.ANALOG, device_id=self.device.pk).value, 21.5)
+
+        self.post(22.5)
+        self.assertEqual(self.buffer.flush(), 2)
+
+        self.assertEqual(sorted(AnalogValues.objects.values_list('value', flat=True)), [21.5, 22.5])
+        self.assertEqual(AnalogRollup.objects.filter(device=self.device).first().count, 2)
+        self.assertEqual(self.buffer.stats['stored'], 2)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_readings_of_devices_of_others_are_refused(self):
+        other = create_room_with_devices(User.objects.create_user(username='other', password='password'), 'Other')
+
+        response = self.post(1.0, other.analog_devices.get())
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_full_buffer_rejects_with_the_reject_policy(self):
+        self.buffer.overflow = 'reject'
+        for value in range(3):
+            self.assertEqual(self.post(value).status_code, 202)
+
+        response = self.post(3)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.buffer.stats['rejected'], 1)
+
+    def test_overflow_policies(self):
+        for overflow, stored, dropped in (('flush', [0, 1, 2, 3, 4], 0), ('drop-oldest', [2, 3, 4], 2),
+                                          ('drop-newest', [0, 1, 2], 2)):
+            AnalogValues.objects.all().delete()
+            buffer = writebehind.WriteBehindBuffer(capacity=3, overflow=overflow)
+            for value in range(5):
+                self.assertTrue(buffer.put(self.reading(value)))
+            buffer.flush()
+
+            self.assertEqual(sorted(AnalogValues.objects.values_list('value', flat=True)), stored, overflow)
+            self.assertEqual(buffer.stats['dropped'], dropped, overflow)
+
+        with self.assertRaises(ValueError):
+            writebehind.WriteBehindBuffer(overflow='ignore')
+
+    def test_dropped_readings_do_not_become_the_current_state(self):
+        self.buffer.overflow = 'drop-newest'
+        for value in range(4):
+            self.assertEqual(self.post(value).status_code, 202)
+
+        self.assertEqual(self.buffer.stats['dropped'], 1)
+        self.assertEqual(DeviceState.objects.get(kind=DeviceKind.ANALOG, device_id=self.device.pk).value, 2.0)
+
+    def test_readings_are_retried_after_database_errors(self):
+        self.buffer.overflow = 'drop-oldest'
+        self.buffer.put(self.reading(1.0))
+        self.buffer.put(self.reading(2.0))
+
+        with self.assertLogs('manage_devices.writebehind', 'ERROR'), \
+                mock.patch.object(writebehind, 'store_values', side_effect=DatabaseError):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.put(self.reading(3.0))
+        self.buffer.put(self.reading(4.0))
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(list(AnalogValues.objects.order_by('timestamp').values_list('value', flat=True)),
+                         [2.0, 3.0, 4.0])
+        self.assertEqual({outcome: self.buffer.stats[outcome] for outcome in ('retried', 'failed', 'stored')},
+                         {'retried': 2, 'failed': 1, 'stored': 3})
+
+    def test_readings_of_deleted_devices_are_dropped(self):
+        self.buffer.put(self.reading(1.0))
+        self.device.delete()
+
+        self.buffer.flush()
+
+        self.assertEqual(self.buffer.stats['dropped'], 1)
+        self.assertFalse(AnalogValues.objects.exists())
+
+    def test_queue_depth_is_exposed(self):
+        self.post(1.0)
+        registry.add_collector(self.buffer.exposition)
+        self.addCleanup(registry.remove_collector, self.buffer.exposition)
+
+        with self.settings(SMART_HOME_METRICS_PUBLIC=True):
+            content = self.client.get('/metrics').content.decode()
+
+        self.assertIn('smart_home_write_behind_depth{kind="analog"} 1', content)
+        self.assertIn('smart_home_write_behind_readings_total{kind="analog",outcome="accepted"} 1', content)
+
+
+class WriteBehindFlusherTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.device = create_room_with_devices(self.user).analog_devices.get()
+        AnalogValues.objects.all().delete()
+
+    def test_flusher_stores_batches_and_the_rest_on_stop(self):
+        buffer = writebehind.WriteBehindBuffer(batch_size=2, flush_interval=60)
+        buffer.start()
+        for value in range(2):
+            buffer.put(AnalogValues(device=self.device, value=value, timestamp=timezone.now()))
+
+        for _ in range(200):
+            if buffer.stats['stored'] >= 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(buffer.stats['stored'], 2)
+
+        buffer.put(AnalogValues(device=self.device, value=2, timestamp=timezone.now()))
+        buffer.stop()
+        self.assertEqual(AnalogValues.objects.count(), 3)
+        self.assertFalse(buffer.thread)
+
+    @override_settings(SMART_HOME_WRITE_BEHIND=True, SMART_HOME_WRITE_BEHIND_FLUSH_INTERVAL=60)
+    def test_shutdown_stores_buffered_readings(self):
+        buffer = writebehind.get_buffer()
+        self.assertIs(writebehind.get_buffer(), buffer)
+        self.assertIn(buffer.exposition, registry.collectors)
+        buffer.put(AnalogValues(device=self.device, value=1.0, timestamp=timezone.now()))
+
+        writebehind.shutdown()
+
+        self.assertEqual(AnalogValues.objects.count(), 1)
+        self.assertNotIn(buffer.exposition, registry.collectors)
+        with override_settings(SMART_HOME_WRITE_BEHIND=False):
+            self.assertIsNone(writebehind.get_buffer())
@@ -0,0 +1,117 @@
+"""
+Queries over the state history of a device as a sequence of runs.
+
+A run is a stretch of time a device spent in one state: it starts with a value
+row changing the state and lasts until the next such row. Rows repeating the
+state merge into the run, so the queries give the same results whether every
+reading is stored or, with change-only storage, only the transitions.
+"""
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .filters import parse_datetime_param
+from .models import VALUE_MODELS
+from .streaming import keyset_chunks
+
+
+def superseded(rows):
+    """
+    The rows of a value queryset followed by a later row of the same device.
+    With change-only storage, the latest row of a device starts its current run
+    however old it is, so retention and archiving only remove superseded rows.
+    """
+    later = rows.model.objects.filter(Q(timestamp__gt=OuterRef('timestamp'))
+                                      | Q(timestamp=OuterRef('timestamp'), id__gt=OuterRef('id')),
+                                      device_id=OuterRef('device_id'))
+    return rows.filter(Exists(later))
+
+
+def state_at(kind, device_id, at):
+    """
+    The `(value, since)` of the latest row of a device taken at or before `at`, or None.
+    """
+    return (VALUE_MODELS[kind].objects.filter(device_id=device_id, timestamp__lte=at)
+            .order_by('-timestamp', '-id').values_list('value', 'timestamp').first())
+
+
+def state_runs(kind, device_id, start, end):
+    """
+    Yield `(value, run_start, run_end)` for the runs of a device overlapping
+    `start`-`end`, clipped to it. Time before the first known state is skipped.
+    """
+    initial = state_at(kind, device_id, start)
+    current, since = (initial[0], start) if initial else (None, None)
+
+    rows = VALUE_MODELS[kind].objects.filter(device_id=device_id, timestamp__gt=start, timestamp__lt=end)
+    for chunk in keyset_chunks(rows, ['value', 'timestamp'], 'timestamp'):
+        for value, timestamp in chunk:
+            if since is None:
+                current, since = value, timestamp
+            elif value != current:
+                yield current, since, timestamp
+                current, since = value, timestamp
+
+    if since is not None:
+        yield current, since, end
+
+
+def time_in_state(kind, device_id, start, end):
+    """
+    Seconds a device spent in each state between `start` and `end`, as a list
+    of `(value, seconds)` in order of first occurrence.
+    """
+    totals = {}
+    for value, run_start, run_end in state_runs(kind, device_id, start, end):
+        # Keyed by JSON-compatible value and type, so True and 1 stay apart.
+        key = (type(value).__name__, value)
+        totals[key] = totals.get(key, 0.0) + (run_end - run_start).total_seconds()
+    return [(value, seconds) for (_, value), seconds in totals.items()]
+
+
+class StateHistoryMixin:
+    """
+    Device viewset actions answering what state a device was in at a time and
+    how long it spent in each state, computed from its transitions. Requires a
+    `kind` attribute.
+    """
+    kind = None
+
+    @action(detail=True, methods=['get'])
+    def state(self, request, pk=None):
+        """
+        State of the device at `?at=`, defaulting to now.
+        """
+        device = self.get_object()
+        at = parse_datetime_param(request, 'at') or timezone.now()
+
+        state = state_at(self.kind, device.pk, at)
+        return Response({
+            'device': device.pk,
+            'at': at,
+            'value': state[0] if state else None,
+            'since': state[1] if state else None,
+        })
+
+    @action(detail=True, methods=['get'], url_path='time-in-state')
+    def time_in_state(self, request, pk=None):
+        """
+        Seconds the device spent in each state between `?start=` and `?end=`,
+        which defaults to now. A state lasts until the next transition.
+        """
+        device = self.get_object()
+        start = parse_datetime_param(request, 'start')
+        end = min(parse_datetime_param(request, 'end') or timezone.now(), timezone.now())
+        if start is None or start >= end:
+            return Response({'start': ["A start before the end of the range is required."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'device': device.pk,
+            'start': start,
+            'end': end,
+            'states': [{'value': value, 'seconds': seconds}
+                       for value, seconds in time_in_state(self.kind, device.pk, start, end)],
+        })
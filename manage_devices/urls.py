@@ -1,18 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import events, views
 
 
 router = DefaultRouter()
 router.register(r'analog-devices', views.AnalogDeviceViewSet)
 router.register(r'digital-devices', views.DigitalDeviceViewSet)
 router.register(r'smart-devices', views.SmartDeviceViewSet)
+router.register(r'devices', views.DeviceViewSet)
 router.register(r'rooms', views.RoomViewSet)
 router.register(r'analog-values', views.AnalogValuesViewSet)
 router.register(r'digital-values', views.DigitalValuesViewSet)
 router.register(r'smart-values', views.SmartValuesViewSet)
 
 urlpatterns = [
+    # Ahead of the router, whose `devices/<pk>/` route would match them otherwise.
+    path('devices/scene/', views.SceneView.as_view(), name='devices-scene'),
+    path('devices/resolve/', views.ResolveView.as_view(), name='devices-resolve'),
     path('', include(router.urls)),
     path('analog-devices/<int:pk>/activate/', views.AnalogDeviceViewSet.as_view({'patch': 'activate'}),
          name='analog-device-activate'),
@@ -20,5 +24,8 @@ urlpatterns = [
          name='digital-device-activate'),
     path('smart-devices/<int:pk>/activate/', views.SmartDeviceViewSet.as_view({'patch': 'activate'}),
          name='smart-device-activate'),
+    path('values/bulk/', views.BulkValuesView.as_view(), name='values-bulk'),
+    path('events/', events.room_events, name='room-events'),
+    path('events/ticket/', events.EventsTicketView.as_view(), name='room-events-ticket'),
 
 ]
@@ -1,34 +1,70 @@
+import hashlib
+from datetime import timedelta
+from urllib.parse import urlencode
+
 from django.contrib.auth.models import User
-from rest_framework import viewsets, permissions, status
+from django.db import transaction
+from django.db.models import OuterRef
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
-from .models import Room, AnalogDevice, SmartDevice, DigitalDevice, SmartValues, DigitalValues, AnalogValues
-from .permissions import IsAdminUserOrReadOnly, IsOwnerOfDeviceInRoom
+from .filters import DeviceFilter, RoomFilter, TimeRangeFilter, ValidatedOrderingFilter, parse_datetime_param
+from .models import (Room, AnalogDevice, SmartDevice, DigitalDevice, SmartValues, DigitalValues, AnalogValues,
+                     AnalogRollup, DeviceKind, Device)
+from .permissions import IsAdminUserOrReadOnly, IsOwnerOfDeviceInRoom, owns_room
 from .serializers import (RoomSerializer, AnalogDeviceSerializer, DigitalDeviceSerializer, SmartDeviceSerializer,
                           AnalogValuesSerializer, DigitalValuesSerializer, SmartValuesSerializer,
-                          RoomCreationSerializer)
+                          RoomCreationSerializer, SceneSerializer, DeviceSerializer, ResolveSerializer)
+from .analytics import analytics_window, device_statistics
+from .batches import AnalogBatchListMixin
+from .cache import cached_tree_response
+from .export import ExportMixin
+from .fastpath import FastListMixin
+from .ingest import record_values, refresh_values, ingest_readings
+from .pagination import DevicePagination, ValuesCursorPagination
+from .parsers import AnalogBatchParser
+from .resolver import resolve_for_user
+from .scenes import apply_scene
+from .rollups import choose_resolution, refresh_rollups
+from .state import current_value
+from .streaming import StreamingListMixin
+from .transitions import StateHistoryMixin
+from . import writebehind
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from smart_home.metrics import SerializerTimingMixin
+from smart_home.routers import ReplicaReadsMixin
 
 
-class AnalogDeviceViewSet(viewsets.ModelViewSet):
+class AnalogDeviceViewSet(FastListMixin, SerializerTimingMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = AnalogDevice.objects.all()
     serializer_class = AnalogDeviceSerializer
+    filter_backends = [DeviceFilter, filters.SearchFilter, ValidatedOrderingFilter]
+    search_fields = ['name']
+    ordering_fields = ['id', 'name', 'room', 'active', 'mac_address', 'ip']
+    ordering = ['id']
     permission_classes = [permissions.IsAuthenticated,
                           IsOwnerOfDeviceInRoom]
+    # Served from the analytics cache, which must not be filled from a lagging replica.
+    primary_actions = ('analytics',)
 
     def get_queryset(self):
         user = self.request.user
+        queryset = AnalogDevice.objects.annotate(current_value=current_value(DeviceKind.ANALOG))
 
         if user.is_staff:
-            return AnalogDevice.objects.all()
+            return queryset
 
-        return AnalogDevice.objects.filter(room__owner=user)
+        return queryset.filter(room__owner=user)
 
     def perform_create(self, serializer):
         user = self.request.user
         room = serializer.validated_data['room']
 
-        if user.is_staff or user == room.owner:
+        if user.is_staff or room.owner_id == user.pk:
             serializer.save()
         else:
             raise PermissionDenied("You cannot create a device in a room you don't own or you are not an admin.")
@@ -45,7 +81,7 @@ class AnalogDeviceViewSet(viewsets.ModelViewSet):
         if request.user.is_staff:
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.room.owner:
+        elif owns_room(request.user, instance.room_id):
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
@@ -71,26 +107,42 @@ class AnalogDeviceViewSet(viewsets.ModelViewSet):
 
         return Response({'status': 'success', 'active': instance.active}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Statistics of the device's values between `start` and `end`, or over the
+        last `window` seconds (a day by default).
+        """
+        device = self.get_object()
+        return analytics_response(request, [device])
 
-class DigitalDeviceViewSet(viewsets.ModelViewSet):
+
+class DigitalDeviceViewSet(StateHistoryMixin, FastListMixin, SerializerTimingMixin, ReplicaReadsMixin,
+                            viewsets.ModelViewSet):
     queryset = DigitalDevice.objects.all()
     serializer_class = DigitalDeviceSerializer
+    filter_backends = [DeviceFilter, filters.SearchFilter, ValidatedOrderingFilter]
+    search_fields = ['name']
+    ordering_fields = ['id', 'name', 'room', 'active', 'mac_address', 'ip']
+    ordering = ['id']
+    kind = DeviceKind.DIGITAL
     permission_classes = [permissions.IsAuthenticated,
                           IsOwnerOfDeviceInRoom]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = DigitalDevice.objects.annotate(current_value=current_value(DeviceKind.DIGITAL))
 
         if user.is_staff:
-            return DigitalDevice.objects.all()
+            return queryset
 
-        return DigitalDevice.objects.filter(room__owner=user)
+        return queryset.filter(room__owner=user)
 
     def perform_create(self, serializer):
         user = self.request.user
         room = serializer.validated_data['room']
 
-        if user.is_staff or user == room.owner:
+        if user.is_staff or room.owner_id == user.pk:
             serializer.save()
         else:
             raise PermissionDenied("You cannot create a device in a room you don't own or you are not an admin.")
@@ -107,7 +159,7 @@ class DigitalDeviceViewSet(viewsets.ModelViewSet):
         if request.user.is_staff:
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.room.owner:
+        elif owns_room(request.user, instance.room_id):
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
@@ -134,27 +186,34 @@ class DigitalDeviceViewSet(viewsets.ModelViewSet):
         return Response({'status': 'success', 'active': instance.active}, status=status.HTTP_200_OK)
 
 
-class SmartDeviceViewSet(viewsets.ModelViewSet):
+class SmartDeviceViewSet(StateHistoryMixin, FastListMixin, SerializerTimingMixin, ReplicaReadsMixin,
+                          viewsets.ModelViewSet):
     queryset = SmartDevice.objects.all()
     serializer_class = SmartDeviceSerializer
+    filter_backends = [DeviceFilter, filters.SearchFilter, ValidatedOrderingFilter]
+    search_fields = ['name']
+    ordering_fields = ['id', 'name', 'room', 'active', 'mac_address', 'ip', 'protocol_name']
+    ordering = ['id']
+    kind = DeviceKind.SMART
     permission_classes = [permissions.IsAuthenticated,
                           IsOwnerOfDeviceInRoom]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = SmartDevice.objects.annotate(current_value=current_value(DeviceKind.SMART))
 
         # If the user is an admin, show all smart devices
         if user.is_staff:
-            return SmartDevice.objects.all()
+            return queryset
 
         # If the user is not an admin, show only smart devices in their room
-        return SmartDevice.objects.filter(room__owner=user)
+        return queryset.filter(room__owner=user)
 
     def perform_create(self, serializer):
         user = self.request.user
         room = serializer.validated_data['room']
 
-        if user.is_staff or user == room.owner:
+        if user.is_staff or room.owner_id == user.pk:
             serializer.save()
         else:
             raise PermissionDenied("You cannot create a device in a room you don't own or you are not an admin.")
@@ -171,7 +230,7 @@ class SmartDeviceViewSet(viewsets.ModelViewSet):
         if request.user.is_staff:
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.room.owner:
+        elif owns_room(request.user, instance.room_id):
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
@@ -198,38 +257,98 @@ class SmartDeviceViewSet(viewsets.ModelViewSet):
         return Response({'status': 'success', 'active': instance.active}, status=status.HTTP_200_OK)
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+class DeviceViewSet(SerializerTimingMixin, ReplicaReadsMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Devices of every kind in one list, filtered, sorted and paginated in a single
+    query on the device registry. Changes go through the endpoint of each kind.
+    """
+    queryset = Device.objects.all()
+    serializer_class = DeviceSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = DevicePagination
+    filter_backends = [DeviceFilter, filters.SearchFilter, ValidatedOrderingFilter]
+    search_fields = ['name']
+    ordering_fields = ['id', 'name', 'kind', 'room', 'active', 'mac_address', 'ip', 'protocol_name']
+    ordering = ['name', 'id']
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Device.objects.annotate(current_value=current_value(OuterRef('kind'), OuterRef('device_id')))
+
+        if user.is_staff:
+            return queryset
+
+        return queryset.filter(room__owner=user)
+
+
+class RoomViewSet(SerializerTimingMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminUserOrReadOnly]
+    filter_backends = [RoomFilter, filters.SearchFilter, ValidatedOrderingFilter]
+    search_fields = ['name']
+    ordering_fields = ['id', 'name']
+    ordering = ['id']
+    # The query parameters the room list depends on.
+    list_params = ('name', 'owner', filters.SearchFilter.search_param, ValidatedOrderingFilter.ordering_param)
+    # Served from caches, which must not be filled from a lagging replica.
+    primary_actions = ('list', 'retrieve', 'analytics')
 
     def get_queryset(self):
         user = self.request.user
+        queryset = RoomSerializer.setup_eager_loading(Room.objects.all())
 
         if user.is_staff:
-            return Room.objects.all()
+            return queryset
 
-        return Room.objects.filter(owner=user)
+        return queryset.filter(owner=user)
 
     def get_serializer_class(self):
         if self.action in ['create', 'update']:
             return RoomCreationSerializer
         return RoomSerializer
 
+    def list(self, request, *args, **kwargs):
+        # Filtered, searched and ordered lists are cached apart from the full one. Other parameters
+        # are ignored by the list, and must not add cache entries; values are hashed to bound the key.
+        params = [(name, request.query_params[name]) for name in self.list_params if name in request.query_params]
+        view_key = f'list?{hashlib.sha256(urlencode(params).encode()).hexdigest()}' if params else 'list'
+        return cached_tree_response(request, view_key, lambda: super(RoomViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_tree_response(request, f"room-{kwargs['pk']}",
+                                    lambda: super(RoomViewSet, self).retrieve(request, *args, **kwargs))
+
     def perform_create(self, serializer):
         serializer.save()
 
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Statistics of the values of every analog device in the room between
+        `start` and `end`, or over the last `window` seconds (a day by default).
+        """
+        rooms = Room.objects.all() if request.user.is_staff else Room.objects.filter(owner=request.user)
+        room = get_object_or_404(rooms, pk=pk)
+        return analytics_response(request, list(room.analog_devices.order_by('pk')))
+
     def perform_update(self, serializer):
-        if self.request.user == self.get_object().owner or self.request.user.is_staff:
+        if self.get_object().owner_id == self.request.user.pk or self.request.user.is_staff:
             serializer.save()
         else:
             return Response("You are not the owner or an admin of this room.", status=status.HTTP_403_FORBIDDEN)
 
 
-class AnalogValuesViewSet(viewsets.ModelViewSet):
+class AnalogValuesViewSet(ExportMixin, StreamingListMixin, AnalogBatchListMixin, FastListMixin, SerializerTimingMixin,
+                          ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = AnalogValues.objects.all()
     serializer_class = AnalogValuesSerializer
+    kind = DeviceKind.ANALOG
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ValuesCursorPagination
+    filter_backends = [TimeRangeFilter, filters.OrderingFilter]
+    ordering_fields = ['id', 'timestamp']
+    ordering = '-id'
 
     def get_queryset(self):
         user = self.request.user
@@ -239,39 +358,117 @@ class AnalogValuesViewSet(viewsets.ModelViewSet):
 
         return AnalogValues.objects.filter(device__room__owner=user)
 
-    def perform_create(self, serializer):
-        user = self.request.user
-        device = serializer.validated_data['device']
+    def create(self, request, *args, **kwargs):
+        buffer = writebehind.get_buffer()
+        if buffer is None:
+            return super().create(request, *args, **kwargs)
 
-        if user.is_staff or user == device.room.owner:
-            serializer.save()
-        else:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.check_device_owner(serializer.validated_data['device'])
+
+        value = AnalogValues(**serializer.validated_data)
+        if writebehind.accept(buffer, value) == writebehind.REJECTED:
+            return Response({'error': "Too many readings are waiting to be stored, try again later."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
+        # Acknowledged before it is stored, so without an id yet.
+        serializer.instance = value
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    def check_device_owner(self, device):
+        user = self.request.user
+        if not (user.is_staff or owns_room(user, device.room_id)):
             raise PermissionDenied(
                 "You cannot create a value for a device in a room you don't own or you are not an admin.")
 
-    def perform_update(self, serializer):
-        if self.request.user == serializer.validated_data['device'].room.owner:
+    def perform_create(self, serializer):
+        self.check_device_owner(serializer.validated_data['device'])
+        with transaction.atomic():
             serializer.save()
+            record_values(DeviceKind.ANALOG, [serializer.instance])
+
+    def perform_update(self, serializer):
+        if owns_room(self.request.user, serializer.validated_data['device'].room_id):
+            previous_device_id, previous_timestamp = serializer.instance.device_id, serializer.instance.timestamp
+            with transaction.atomic():
+                serializer.save()
+                refresh_values(DeviceKind.ANALOG, [previous_device_id, serializer.instance.device_id])
+                refresh_rollups(previous_device_id, [previous_timestamp])
+                refresh_rollups(serializer.instance.device_id, [serializer.instance.timestamp])
         else:
             raise PermissionDenied("You are not allowed to change the value of the device.")
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
 
-        if request.user.is_staff:
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.device.room.owner:
-            instance.delete()
+        if request.user.is_staff or owns_room(request.user, instance.device.room_id):
+            with transaction.atomic():
+                instance.delete()
+                refresh_values(DeviceKind.ANALOG, [instance.device_id])
+                refresh_rollups(instance.device_id, [instance.timestamp])
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response("You are not authorized to delete this value.", status=status.HTTP_403_FORBIDDEN)
 
-
-class DigitalValuesViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def aggregate(self, request):
+        """
+        Min, max, average, count and last value of a device per time bucket between
+        `start` and `end`, read from the rollups at the finest resolution that fits
+        the range into at most `points` buckets.
+        """
+        device_id = request.query_params.get('device')
+        if device_id is None or not device_id.isdigit():
+            return Response({'device': ["A valid device id is required."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        devices = AnalogDevice.objects.all() if request.user.is_staff else AnalogDevice.objects.filter(
+            room__owner=request.user)
+        device = get_object_or_404(devices, pk=device_id)
+
+        start = parse_datetime_param(request, 'start')
+        end = parse_datetime_param(request, 'end') or timezone.now()
+        if start is None or start >= end:
+            return Response({'start': ["A start before the end of the range is required."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        points = request.query_params.get('points', '500')
+        if not points.isdigit() or int(points) < 1:
+            return Response({'points': ["A positive number of points is required."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        resolution = choose_resolution(start, end, int(points))
+        # The first bucket may start before the range, as long as it overlaps it.
+        rollups = AnalogRollup.objects.filter(device=device, resolution=resolution,
+                                              bucket__gt=start - timedelta(seconds=resolution),
+                                              bucket__lt=end).order_by('bucket')
+
+        return Response({
+            'device': device.id,
+            'resolution': resolution,
+            'start': start,
+            'end': end,
+            'buckets': [{
+                'bucket': rollup.bucket,
+                'count': rollup.count,
+                'min': rollup.min,
+                'max': rollup.max,
+                'avg': rollup.avg,
+                'last': rollup.last,
+            } for rollup in rollups],
+        })
+
+
+class DigitalValuesViewSet(ExportMixin, StreamingListMixin, FastListMixin, SerializerTimingMixin,
+                           ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = DigitalValues.objects.all()
     serializer_class = DigitalValuesSerializer
+    kind = DeviceKind.DIGITAL
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ValuesCursorPagination
+    filter_backends = [TimeRangeFilter, filters.OrderingFilter]
+    ordering_fields = ['id', 'timestamp']
+    ordering = '-id'
 
     def get_queryset(self):
         user = self.request.user
@@ -287,8 +484,10 @@ class DigitalValuesViewSet(viewsets.ModelViewSet):
         user = self.request.user
         device = serializer.validated_data['device']
 
-        if user.is_staff or user == device.room.owner:
-            serializer.save()
+        if user.is_staff or owns_room(user, device.room_id):
+            with transaction.atomic():
+                serializer.save()
+                record_values(DeviceKind.DIGITAL, [serializer.instance])
         else:
             raise PermissionDenied(
                 "You cannot create a value for a device in a room you don't own or you are not an admin.")
@@ -296,26 +495,34 @@ class DigitalValuesViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
 
-        if request.user.is_staff:
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.device.room.owner:
-            instance.delete()
+        if request.user.is_staff or owns_room(request.user, instance.device.room_id):
+            with transaction.atomic():
+                instance.delete()
+                refresh_values(DeviceKind.DIGITAL, [instance.device_id])
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response("You are not authorized to delete this value.", status=status.HTTP_403_FORBIDDEN)
 
     def perform_update(self, serializer):
-        if self.request.user == serializer.validated_data['device'].room.owner:
-            serializer.save()
+        if owns_room(self.request.user, serializer.validated_data['device'].room_id):
+            previous_device_id = serializer.instance.device_id
+            with transaction.atomic():
+                serializer.save()
+                refresh_values(DeviceKind.DIGITAL, [previous_device_id, serializer.instance.device_id])
         else:
             raise PermissionDenied("You are not allowed to change the value of the device.")
 
 
-class SmartValuesViewSet(viewsets.ModelViewSet):
+class SmartValuesViewSet(ExportMixin, StreamingListMixin, FastListMixin, SerializerTimingMixin,
+                         ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = SmartValues.objects.all()
     serializer_class = SmartValuesSerializer
+    kind = DeviceKind.SMART
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ValuesCursorPagination
+    filter_backends = [TimeRangeFilter, filters.OrderingFilter]
+    ordering_fields = ['id', 'timestamp']
+    ordering = '-id'
 
     def get_queryset(self):
         user = self.request.user
@@ -331,27 +538,134 @@ class SmartValuesViewSet(viewsets.ModelViewSet):
         user = self.request.user
         device = serializer.validated_data['device']
 
-        if user.is_staff or user == device.room.owner:
-            serializer.save()
+        if user.is_staff or owns_room(user, device.room_id):
+            with transaction.atomic():
+                serializer.save()
+                record_values(DeviceKind.SMART, [serializer.instance])
         else:
             raise PermissionDenied(
                 "You cannot create a value for a device in a room you don't own or you are not an admin.")
 
     def perform_update(self, serializer):
         # Check if the user is the owner of the device's room
-        if self.request.user == serializer.validated_data['device'].room.owner:
-            serializer.save()
+        if owns_room(self.request.user, serializer.validated_data['device'].room_id):
+            previous_device_id = serializer.instance.device_id
+            with transaction.atomic():
+                serializer.save()
+                refresh_values(DeviceKind.SMART, [previous_device_id, serializer.instance.device_id])
         else:
             raise PermissionDenied("You are not allowed to change the value of the device.")
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
 
-        if request.user.is_staff:
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        elif request.user == instance.device.room.owner:
-            instance.delete()
+        if request.user.is_staff or owns_room(request.user, instance.device.room_id):
+            with transaction.atomic():
+                instance.delete()
+                refresh_values(DeviceKind.SMART, [instance.device_id])
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response("You are not authorized to delete this value.", status=status.HTTP_403_FORBIDDEN)
+
+
+class BulkValuesView(APIView):
+    """
+    Store a batch of analog, digital and smart readings in one request, or a
+    packed batch of analog values. Invalid readings are reported per item
+    without rejecting the rest of the batch.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, AnalogBatchParser]
+    max_readings = 10000
+
+    def post(self, request, *args, **kwargs):
+        readings = request.data.get('readings') if isinstance(request.data, dict) else request.data
+
+        if not isinstance(readings, list) or not readings:
+            return Response({'readings': ["Expected a non-empty list of readings."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(readings) > self.max_readings:
+            return Response({'readings': [f"A batch cannot contain more than {self.max_readings} readings."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        created, unchanged, errors = ingest_readings(request.user, readings)
+
+        response_status = status.HTTP_201_CREATED if len(errors) < len(readings) else status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'unchanged': unchanged, 'errors': errors}, status=response_status)
+
+
+class SceneView(APIView):
+    """
+    Activate or deactivate many devices of any type at once, selected by room
+    and/or device id, e.g. `{"active": false, "rooms": [1], "devices": {"smart": [4, 7]}}`.
+    Devices the user does not control are skipped and reported as not found.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = SceneSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        active, rooms, devices = (serializer.validated_data[field] for field in ('active', 'rooms', 'devices'))
+
+        matched, changed = apply_scene(request.user, active, rooms, devices)
+
+        not_found = {}
+        for kind, ids in devices.items():
+            missing = sorted(set(ids) - {device_id for device_id, _ in matched[kind]})
+            if missing:
+                not_found[kind] = missing
+
+        return Response({
+            'active': active,
+            'changed': sum(len(devices) for devices in changed.values()),
+            'devices': [{'type': kind, 'id': device_id, 'room': room_id, 'active': active}
+                        for kind, devices in matched.items() for device_id, room_id in devices],
+            'not_found': not_found,
+        })
+
+
+class ResolveView(APIView):
+    """
+    Map many MAC addresses, in any common notation, to the ids and types of the
+    user's devices in one call, e.g. `{"mac_addresses": ["AA-BB-CC-DD-EE-FF"]}`.
+    MAC addresses are unique per device kind only, so every address maps to a
+    list, with one device of each kind at most.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = ResolveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        devices, invalid = resolve_for_user(request.user, serializer.validated_data['mac_addresses'])
+
+        return Response({
+            'devices': {mac_address: [{'type': kind, 'id': device_id} for kind, device_id in matches]
+                        for mac_address, matches in devices.items()},
+            'invalid': invalid,
+        })
+
+
+def analytics_response(request, devices):
+    start = parse_datetime_param(request, 'start')
+    end = parse_datetime_param(request, 'end')
+    window = request.query_params.get('window', '86400')
+    z_threshold = request.query_params.get('z', '3')
+    if not window.isdigit() or int(window) < 1:
+        return Response({'window': ["A positive number of seconds is required."]}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        z_threshold = float(z_threshold)
+    except ValueError:
+        return Response({'z': ["A number is required."]}, status=status.HTTP_400_BAD_REQUEST)
+
+    start, end = analytics_window(start, end, timezone.now(), timedelta(seconds=int(window)))
+    if start >= end:
+        return Response({'start': ["A start before the end of the range is required."]},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    statistics = device_statistics([device.pk for device in devices], start, end, z_threshold)
+    return Response({
+        'start': start,
+        'end': end,
+        'devices': [{'device': device.pk, 'name': device.name, **statistics[device.pk]} for device in devices],
+    })
@@ -0,0 +1,297 @@
+"""
+Write-behind of posted analog values.
+
+With SMART_HOME_WRITE_BEHIND, a posted analog value is validated, becomes the
+current state of its device right away and is acknowledged with 202 Accepted;
+the row itself waits in a bounded in-process buffer. A background thread stores
+the buffered rows with bulk inserts once SMART_HOME_WRITE_BEHIND_BATCH_SIZE of
+them are pending or SMART_HOME_WRITE_BEHIND_FLUSH_INTERVAL seconds passed, and
+whatever is left when the process exits. Rollups, the cached trees and
+analytics, and the events of `/events/` follow once the rows are stored.
+
+At most SMART_HOME_WRITE_BEHIND_CAPACITY rows are buffered. When the buffer is
+full, SMART_HOME_WRITE_BEHIND_OVERFLOW decides what happens to a new reading:
+
+- 'flush': the request stores the buffered rows itself, then buffers it;
+- 'reject': it is refused, and the client gets a 503 to retry later;
+- 'drop-oldest': the oldest buffered reading is dropped to make room;
+- 'drop-newest': it is acknowledged but dropped, and does not become the
+  current state of its device.
+
+Rows that cannot be stored because of a database error go back to the head of
+the buffer and are retried after SMART_HOME_WRITE_BEHIND_FLUSH_INTERVAL; they
+only fail for good when the buffer has no room left for them. Buffered rows
+are lost if the process dies without exiting cleanly, so only
+enable write-behind for readings that can afford it. The depth of the buffer
+and its counters are served at /metrics.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+
+from smart_home.metrics import registry
+from .ingest import store_values
+from .models import DeviceKind, DEVICE_MODELS
+from .state import update_current_state
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('flush', 'reject', 'drop-oldest', 'drop-newest')
+
+# What `put()` did with a reading.
+ACCEPTED, DROPPED, REJECTED = 'accepted', 'dropped', 'rejected'
+
+_lock = threading.Lock()
+_buffer = None
+
+
+class WriteBehindBuffer:
+    """
+    A bounded buffer of unsaved value rows of one kind, stored in bulk by
+    `flush()`, called from a background thread between `start()` and `stop()`.
+    """
+
+    def __init__(self, kind=DeviceKind.ANALOG, capacity=10000, batch_size=500, flush_interval=1.0, overflow='flush',
+                 clock=time.monotonic):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of: {', '.join(OVERFLOW_POLICIES)}.")
+        self.kind = kind
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.clock = clock
+
+        self.values = deque()
+        # Guards the buffer and the counters, and wakes the flusher.
+        self.condition = threading.Condition()
+        # One flush at a time, so rows are stored in the order they were accepted.
+        self.flush_lock = threading.Lock()
+        self.last_flush = clock()
+        # Rows at the head of the buffer put back by a failed flush, and whether the last flush failed.
+        self.retrying = 0
+        self.failing = False
+        self.running = False
+        self.thread = None
+        self.stats = {'accepted': 0, 'stored': 0, 'unchanged': 0, 'dropped': 0, 'rejected': 0, 'retried': 0,
+                      'failed': 0, 'flushes': 0}
+
+    def __len__(self):
+        return len(self.values)
+
+    def put(self, value):
+        """
+        Buffer an unsaved value row. Returns ACCEPTED, DROPPED if the buffer is full
+        and drops it, or REJECTED if the buffer is full and refuses it.
+        """
+        flushed = False
+        while True:
+            with self.condition:
+                if len(self.values) < self.capacity:
+                    self.values.append(value)
+                    self.stats['accepted'] += 1
+                    if len(self.values) >= self.batch_size:
+                        self.condition.notify()
+                    return ACCEPTED
+                # A flush that could not make room failed: refuse rather than try again.
+                if self.overflow == 'reject' or flushed:
+                    self.stats['rejected'] += 1
+                    return REJECTED
+                if self.overflow == 'drop-newest':
+                    self.stats['dropped'] += 1
+                    return DROPPED
+                if self.overflow == 'drop-oldest':
+                    self.values.popleft()
+                    self.values.append(value)
+                    self.stats['accepted'] += 1
+                    if self.retrying:
+                        self.retrying -= 1
+                        self.stats['failed'] += 1
+                    else:
+                        self.stats['dropped'] += 1
+                    return ACCEPTED
+            # 'flush': make room in this thread, then try again.
+            self.flush()
+            flushed = True
+
+    def flush(self):
+        """
+        Store the buffered rows. Returns how many were taken from the buffer, which
+        excludes those put back because they could not be stored.
+        """
+        with self.flush_lock:
+            with self.condition:
+                values = list(self.values)
+                self.values.clear()
+                self.retrying = 0
+                self.last_flush = self.clock()
+            if not values:
+                return 0
+
+            try:
+                # Devices may have been deleted since their readings were accepted.
+                existing_ids = set(DEVICE_MODELS[self.kind].objects
+                                   .filter(pk__in={value.device_id for value in values}).values_list('pk', flat=True))
+                existing = [value for value in values if value.device_id in existing_ids]
+                stored = store_values(self.kind, existing, batch_size=self.batch_size) if existing else []
+            except DatabaseError:
+                logger.exception("Could not store %d buffered %s readings, retrying later", len(values), self.kind)
+                self.requeue(values)
+                return 0
+
+            with self.condition:
+                self.failing = False
+                self.stats['flushes'] += 1
+                self.stats['dropped'] += len(values) - len(existing)
+                self.stats['stored'] += len(stored)
+                self.stats['unchanged'] += len(existing) - len(stored)
+            return len(values)
+
+    def requeue(self, values):
+        """
+        Put rows a flush could not store back at the head of the buffer, ahead of
+        those accepted since. The oldest fail for good if there is no room for all.
+        """
+        for value in values:
+            # Ids of the rolled back insert.
+            value.pk = None
+
+        with self.condition:
+            room = max(self.capacity - len(self.values), 0)
+            failed, values = values[:max(len(values) - room, 0)], values[max(len(values) - room, 0):]
+            self.values.extendleft(reversed(values))
+            self.retrying = len(values)
+            self.failing = True
+            self.stats['flushes'] += 1
+            self.stats['retried'] += len(values)
+            self.stats['failed'] += len(failed)
+        if failed:
+            logger.error("Dropped %d buffered %s readings that could not be stored", len(failed), self.kind)
+
+    def run(self):
+        """
+        Flush whenever a batch is full or the flush interval passed, until `stop()`.
+        """
+        try:
+            while True:
+                with self.condition:
+                    # After a failed flush, the next one waits for the interval even with a full batch.
+                    while self.running and (len(self.values) < self.batch_size or self.failing):
+                        remaining = self.flush_interval - (self.clock() - self.last_flush)
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    running = self.running
+
+                if self.values:
+                    # The thread outlives requests, which otherwise recycle stale connections.
+                    close_old_connections()
+                    try:
+                        self.flush()
+                    except Exception:
+                        logger.exception("Flushing the %s write-behind buffer failed", self.kind)
+                else:
+                    self.last_flush = self.clock()
+                if not running:
+                    return
+        finally:
+            connection.close()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f'{self.kind}-write-behind', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the flusher and store what is still buffered.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.flush()
+
+    def exposition(self):
+        """
+        The depth and counters of the buffer in the Prometheus text exposition format.
+        """
+        with self.condition:
+            depth = len(self.values)
+            stats = dict(self.stats)
+        label = f'kind="{self.kind}"'
+        lines = [
+            '# HELP smart_home_write_behind_depth Readings waiting in the write-behind buffer.',
+            '# TYPE smart_home_write_behind_depth gauge',
+            f'smart_home_write_behind_depth{{{label}}} {depth}',
+            '# HELP smart_home_write_behind_capacity Capacity of the write-behind buffer.',
+            '# TYPE smart_home_write_behind_capacity gauge',
+            f'smart_home_write_behind_capacity{{{label}}} {self.capacity}',
+            '# HELP smart_home_write_behind_readings_total Readings by what happened to them in the write-behind '
+            'buffer.',
+            '# TYPE smart_home_write_behind_readings_total counter',
+        ]
+        lines += [f'smart_home_write_behind_readings_total{{{label},outcome="{outcome}"}} {stats[outcome]}'
+                  for outcome in ('accepted', 'stored', 'unchanged', 'dropped', 'rejected', 'retried', 'failed')]
+        lines += [
+            '# HELP smart_home_write_behind_flushes_total Flushes of the write-behind buffer.',
+            '# TYPE smart_home_write_behind_flushes_total counter',
+            f'smart_home_write_behind_flushes_total{{{label}}} {stats["flushes"]}',
+        ]
+        return lines
+
+
+def get_buffer():
+    """
+    The running write-behind buffer of analog values, started on first use, or
+    None unless SMART_HOME_WRITE_BEHIND is enabled.
+    """
+    global _buffer
+    if not getattr(settings, 'SMART_HOME_WRITE_BEHIND', False):
+        return None
+
+    with _lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                DeviceKind.ANALOG,
+                capacity=getattr(settings, 'SMART_HOME_WRITE_BEHIND_CAPACITY', 10000),
+                batch_size=getattr(settings, 'SMART_HOME_WRITE_BEHIND_BATCH_SIZE', 500),
+                flush_interval=getattr(settings, 'SMART_HOME_WRITE_BEHIND_FLUSH_INTERVAL', 1.0),
+                overflow=getattr(settings, 'SMART_HOME_WRITE_BEHIND_OVERFLOW', 'flush'),
+            )
+            _buffer.start()
+            registry.add_collector(_buffer.exposition)
+        return _buffer
+
+
+def shutdown():
+    """
+    Stop the write-behind buffer, storing what it still holds.
+    """
+    global _buffer
+    with _lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        registry.remove_collector(buffer.exposition)
+        buffer.stop()
+
+
+atexit.register(shutdown)
+
+
+def accept(buffer, value):
+    """
+    Buffer an unsaved value row and make it the current state of its device,
+    unless the buffer dropped or rejected it. Returns the outcome of `put()`.
+    """
+    outcome = buffer.put(value)
+    if outcome == ACCEPTED:
+        update_current_state(buffer.kind, [value])
+    return outcome
@@ -2,6 +2,8 @@
 ASGI config for smart_home project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn smart_home.asgi:application``) so the
+server-sent events of ``/events/`` are pushed without tying up a worker per client.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -0,0 +1,252 @@
+"""
+Per-view request metrics in Prometheus format.
+
+For every request, `MetricsMiddleware` records the latency, the number and
+duration of the database queries, the time spent in serializers and renderers
+and the response size, aggregated per view and method. Queries are recorded by
+an execute wrapper installed on every database connection, reporting into the
+metrics of the request running in the current context, so queries issued from
+views run in a thread by the ASGI handler are counted as well. A request that
+runs the same SQL statement, parameters aside, several times is flagged as a
+probable N+1 query pattern and logged.
+
+Aggregates live in the process; with several worker processes, every process
+exposes its own, so scrape every worker or use a single process per target.
+"""
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from hmac import compare_digest
+from threading import Lock
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+def sql_shape(sql):
+    """
+    The statement with `IN` lists of any length collapsed, so statements
+    differing only in their parameters have the same shape.
+    """
+    return re.sub(r'\((?:%s, )+%s\)', '(%s, ...)', sql)
+
+
+class RequestMetrics:
+    """
+    Database, serializer and renderer time of one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.shapes = Counter()
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.shapes[sql_shape(sql)] += 1
+
+    def repeated_query(self, threshold):
+        """
+        The `(shape, count)` of the most repeated statement, if it ran at least `threshold` times.
+        """
+        if not self.shapes:
+            return None
+        shape, count = self.shapes.most_common(1)[0]
+        return (shape, count) if count >= threshold else None
+
+    def server_timing(self, duration):
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serializer_time * 1000:.1f}, render;dur={self.render_time * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}')
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+def instrument_connection(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(instrument_connection)
+
+
+def time_serializer(serializer):
+    """
+    Count the time `serializer` spends building its representation into the current request's metrics.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return serializer
+
+    to_representation = serializer.to_representation
+
+    def timed_to_representation(instance):
+        started = time.perf_counter()
+        try:
+            return to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+
+    serializer.to_representation = timed_to_representation
+    return serializer
+
+
+class SerializerTimingMixin:
+    """
+    Records the serializer time of a generic view in the request metrics.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        return time_serializer(super().get_serializer(*args, **kwargs))
+
+
+class MetricsRegistry:
+    """
+    Thread-safe aggregates of the requests of this process, by view and method.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.views = {}
+        self.collectors = []
+
+    def clear(self):
+        with self.lock:
+            self.views = {}
+
+    def add_collector(self, collector):
+        """
+        Add a callable returning further lines of the exposition, e.g. gauges of a queue.
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self.lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def observe(self, view, method, status, duration, metrics, size, n_plus_one):
+        with self.lock:
+            stats = self.views.get((view, method))
+            if stats is None:
+                stats = self.views[(view, method)] = {
+                    'statuses': Counter(), 'buckets': [0] * len(self.buckets), 'count': 0, 'duration': 0.0,
+                    'queries': 0, 'db_time': 0.0, 'serializer_time': 0.0, 'render_time': 0.0, 'bytes': 0,
+                    'n_plus_one': 0,
+                }
+            stats['statuses'][status] += 1
+            bucket = bisect_left(self.buckets, duration)
+            if bucket < len(self.buckets):
+                stats['buckets'][bucket] += 1
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['queries'] += metrics.queries
+            stats['db_time'] += metrics.db_time
+            stats['serializer_time'] += metrics.serializer_time
+            stats['render_time'] += metrics.render_time
+            stats['bytes'] += size or 0
+            stats['n_plus_one'] += n_plus_one
+
+    def exposition(self):
+        """
+        The aggregates in the Prometheus text exposition format.
+        """
+        with self.lock:
+            views = {key: {**stats, 'statuses': Counter(stats['statuses']), 'buckets': list(stats['buckets'])}
+                     for key, stats in self.views.items()}
+            collectors = list(self.collectors)
+
+        lines = [
+            '# HELP smart_home_requests_total Requests by view, method and status.',
+            '# TYPE smart_home_requests_total counter',
+        ]
+        for (view, method), stats in sorted(views.items()):
+            for status, count in sorted(stats['statuses'].items()):
+                lines.append(f'smart_home_requests_total{{{labels(view, method)},status="{status}"}} {count}')
+
+        lines += [
+            '# HELP smart_home_request_duration_seconds Request latency by view and method.',
+            '# TYPE smart_home_request_duration_seconds histogram',
+        ]
+        for (view, method), stats in sorted(views.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats['buckets']):
+                cumulative += count
+                lines.append(f'smart_home_request_duration_seconds_bucket{{{labels(view, method)},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'smart_home_request_duration_seconds_bucket{{{labels(view, method)},le="+Inf"}} '
+                         f'{stats["count"]}')
+            lines.append(f'smart_home_request_duration_seconds_sum{{{labels(view, method)}}} {stats["duration"]}')
+            lines.append(f'smart_home_request_duration_seconds_count{{{labels(view, method)}}} {stats["count"]}')
+
+        for name, key, description in (
+            ('smart_home_db_queries_total', 'queries', 'Database queries by view and method.'),
+            ('smart_home_db_query_seconds_total', 'db_time', 'Time spent in database queries.'),
+            ('smart_home_serializer_seconds_total', 'serializer_time', 'Time spent in serializers.'),
+            ('smart_home_render_seconds_total', 'render_time', 'Time spent rendering responses.'),
+            ('smart_home_response_bytes_total', 'bytes', 'Size of the non-streaming responses.'),
+            ('smart_home_n_plus_one_requests_total', 'n_plus_one',
+             'Requests repeating a query often enough to suggest an N+1 pattern.'),
+        ):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            lines += [f'{name}{{{labels(view, method)}}} {stats[key]}'
+                      for (view, method), stats in sorted(views.items())]
+
+        for collector in collectors:
+            lines += collector()
+
+        return '\n'.join(lines) + '\n'
+
+
+def labels(view, method):
+    view = view.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'view="{view}",method="{method}"'
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    """
+    The request metrics of this process, for Prometheus to scrape with the
+    SMART_HOME_METRICS_TOKEN as bearer token, or for staff logged in to the
+    admin. With SMART_HOME_METRICS_PUBLIC, they are served to anyone.
+    """
+    token = getattr(settings, 'SMART_HOME_METRICS_TOKEN', None)
+    if not (getattr(settings, 'SMART_HOME_METRICS_PUBLIC', False)
+            or token and compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+            or request.user.is_staff):
+        return HttpResponse(status=401)
+    return HttpResponse(registry.exposition(), content_type=CONTENT_TYPE)
+
+
+def n_plus_one_threshold():
+    return getattr(settings, 'SMART_HOME_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
@@ -0,0 +1,123 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import RequestMetrics, current_metrics, instrument_connection, logger, n_plus_one_threshold, registry
+from .routers import pin_to_primary, replicas
+
+
+class MetricsMiddleware:
+    """
+    Records the metrics of every request in the registry served at /metrics and,
+    with SMART_HOME_SERVER_TIMING, reports them in a Server-Timing header.
+    Should come first, so its latency covers the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        # Connections opened before the middleware was loaded missed the connection_created signal.
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(connection)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.record(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.record(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, metrics):
+        duration = time.perf_counter() - metrics.started
+        view = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+
+        repeated = metrics.repeated_query(n_plus_one_threshold())
+        if repeated:
+            logger.warning("Possible N+1 queries in %s %s: %d of %d queries ran %s", request.method, view,
+                           repeated[1], metrics.queries, repeated[0])
+
+        if not response.streaming:
+            size = len(response.content)
+        else:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+
+        registry.observe(view, request.method, response.status_code, duration, metrics, size, repeated is not None)
+
+        if getattr(settings, 'SMART_HOME_SERVER_TIMING', False):
+            response['Server-Timing'] = metrics.server_timing(duration)
+        return response
+
+
+class PrimaryPinningMiddleware:
+    """
+    Pins users to the primary database for a while after their successful
+    writes, so their next reads see them even if the replicas lag behind.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        user_id = self.writer(request, response)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self.writer(request, response)
+        if user_id is not None:
+            await sync_to_async(pin_to_primary)(user_id)
+        return response
+
+    def writer(self, request, response):
+        """
+        The id of the user who wrote in this request, if any and if there are replicas.
+        """
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not replicas():
+            return None
+        # The user set by the API's authentication, which happens in the view.
+        user = getattr(request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
@@ -0,0 +1,92 @@
+"""
+Read replicas.
+
+Every alias of DATABASE_REPLICAS is a copy of the default database, kept up to
+date by replication. `ReplicaReadsMixin` sends the queries of the read-only
+actions of a viewset (its safe methods) to a randomly chosen replica; every
+other query, and every write, goes to the primary through `ReplicaRouter`.
+
+Replication lags behind the primary, so a client reading what it just wrote
+could miss it: after a successful write, `PrimaryPinningMiddleware` pins the
+user to the primary for SMART_HOME_REPLICA_PIN_SECONDS. Pins are kept in the
+default cache, which must be shared by all processes for a pin to hold across
+them. Actions whose responses are cached are listed in `primary_actions`, so a
+stale replica never ends up in the cache.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULT_PIN_SECONDS = 10
+
+# The alias reads of the current request are sent to, None for the primary.
+read_database = ContextVar('read_database', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', {}))
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """
+    Send the reads of the user to the primary until the replicas caught up with their writes.
+    """
+    cache.set(pin_key(user_id), True, getattr(settings, 'SMART_HOME_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS))
+
+
+def is_pinned(user_id):
+    return cache.get(pin_key(user_id), False)
+
+
+class ReplicaRouter:
+    """
+    Reads go to the database chosen for the current request, everything else to the primary.
+    Replicas are never migrated: they receive the schema from the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaReadsMixin:
+    """
+    Serves the safe methods of a viewset from a replica, unless the action is
+    in `primary_actions` or the user recently wrote. The replica is bound to
+    the view's filtered querysets too, so streamed responses read from it as well.
+    """
+    primary_actions = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        token = read_database.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_database.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        aliases = replicas()
+        if (aliases and request.method in SAFE_METHODS and self.action not in self.primary_actions
+                and not (request.user.is_authenticated and is_pinned(request.user.pk))):
+            read_database.set(random.choice(aliases))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        alias = read_database.get()
+        return queryset.using(alias) if alias is not None else queryset
@@ -48,9 +48,21 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # MessagePack is negotiated alongside JSON, for requests and responses.
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'manage_devices.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'manage_devices.parsers.MessagePackParser',
+    ],
 }
 
 
@@ -64,11 +76,13 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'smart_home.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'smart_home.middleware.PrimaryPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -101,6 +115,94 @@ CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
 
 WSGI_APPLICATION = 'smart_home.wsgi.application'
+ASGI_APPLICATION = 'smart_home.asgi.application'
+
+# Pub/sub backend fanning out device events to the clients connected to /events/.
+# The in-memory broker only reaches clients of the same process.
+SMART_HOME_PUBSUB_BACKEND = 'manage_devices.pubsub.InMemoryBroker'
+
+# Serialized room/device trees are cached per user and invalidated on writes.
+# With several worker processes, use a shared backend such as Redis or Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SMART_HOME_ROOM_TREE_CACHE_TIMEOUT = 300
+
+# Analytics of analog devices are cached per device and window until new readings arrive.
+SMART_HOME_ANALYTICS_CACHE_TIMEOUT = 600
+
+# In-process cache of MAC address lookups. Other processes see device changes
+# after at most SMART_HOME_MAC_CACHE_TTL seconds.
+SMART_HOME_MAC_CACHE_SIZE = 10000
+SMART_HOME_MAC_CACHE_TTL = 300
+
+# Device kinds whose bulk and MQTT readings are only stored when they change the
+# device's state; repeated readings only update its last seen time.
+SMART_HOME_CHANGE_ONLY_KINDS = ['digital', 'smart']
+
+# Write-behind of posted analog values (see manage_devices.writebehind): posts are
+# answered with 202 once buffered and stored in bulk by a background thread when
+# BATCH_SIZE readings are pending or every FLUSH_INTERVAL seconds. At most CAPACITY
+# readings are buffered; when full, OVERFLOW is 'flush', 'reject', 'drop-oldest'
+# or 'drop-newest'. Buffered readings are lost if the process dies.
+SMART_HOME_WRITE_BEHIND = False
+SMART_HOME_WRITE_BEHIND_CAPACITY = 10000
+SMART_HOME_WRITE_BEHIND_BATCH_SIZE = 500
+SMART_HOME_WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+SMART_HOME_WRITE_BEHIND_OVERFLOW = 'flush'
+
+# Access tokens carry the user's roles, so requests are authenticated without
+# loading the user. Token versions and owned room ids are cached per process;
+# role changes, revocations and room changes reach other processes within
+# SMART_HOME_AUTH_CACHE_TTL seconds.
+SMART_HOME_AUTH_CACHE_SIZE = 10000
+SMART_HOME_AUTH_CACHE_TTL = 30
+
+# Registration hashes passwords in a pool of this many threads, so a burst of
+# sign-ups cannot tie up the workers serving devices. Beyond
+# SMART_HOME_AUTH_HASHING_MAX_PENDING hashes and logins running or waiting they answer 503.
+# Every client IP may try to log in, and to register, RATE[0] times per RATE[1]
+# seconds (None to disable). Attempts are logged to the 'accounts.auth' logger,
+# at most RATE[0] records of a kind per RATE[1] seconds.
+SMART_HOME_AUTH_HASHING_WORKERS = 4
+SMART_HOME_AUTH_HASHING_MAX_PENDING = 64
+SMART_HOME_AUTH_THROTTLE_RATE = (20, 60)
+SMART_HOME_AUTH_LOG_RATE = (10, 60)
+
+# The 'accounts.auth' audit trail of logins and registrations goes to stderr,
+# one line per attempt.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'auth': {
+            'format': '%(asctime)s %(levelname)s event=%(event)s outcome=%(outcome)s username=%(username)s '
+                      'ip=%(ip)s %(message)s',
+        },
+    },
+    'handlers': {
+        'auth': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'auth',
+        },
+    },
+    'loggers': {
+        'accounts.auth': {'handlers': ['auth'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Per-view request metrics served at /metrics to staff sessions and to clients
+# sending SMART_HOME_METRICS_TOKEN as bearer token. Set SMART_HOME_METRICS_PUBLIC
+# to serve them without authentication. Requests running one SQL statement at least
+# SMART_HOME_N_PLUS_ONE_THRESHOLD times are logged as probable N+1 queries.
+SMART_HOME_METRICS_TOKEN = os.environ.get('SMART_HOME_METRICS_TOKEN')
+SMART_HOME_METRICS_PUBLIC = False
+SMART_HOME_N_PLUS_ONE_THRESHOLD = 5
+# Adds a Server-Timing header with database, serializer and render time to every response.
+SMART_HOME_SERVER_TIMING = DEBUG
 
 
 # Database
@@ -114,9 +216,27 @@ DATABASES = {
         'PASSWORD': 'root',
         'HOST': 'localhost',  # or the hostname where your MySQL server is running
         'PORT': '3306',  # or the port on which your MySQL server is listening
+        # Seconds a connection is kept open across requests, checked before reuse. This is
+        # not pooling, and only helps WSGI workers: under ASGI every request runs its sync code
+        # in a new thread, so kept connections are never reused and linger until the server
+        # drops them. Leave it at 0 when serving through asgi.py.
+        'CONN_MAX_AGE': int(os.environ.get('SMART_HOME_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas of the default database, by alias, with the connection settings
+# that differ from the default's, e.g. {'replica': {'HOST': 'replica.example.com'}}.
+# The read-only actions of the API are served from them (see smart_home.routers);
+# users are pinned to the primary for SMART_HOME_REPLICA_PIN_SECONDS after a write.
+DATABASE_REPLICAS = {}
+SMART_HOME_REPLICA_PIN_SECONDS = 10
+
+for alias, replica in DATABASE_REPLICAS.items():
+    DATABASES[alias] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['smart_home.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators